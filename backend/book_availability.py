@@ -0,0 +1,105 @@
+"""
+Book availability, kept on ``books.active_loan_id``.
+
+A book is available while it has no open loan. Instead of anti-joining
+the loans on every read, handlers that check books out, return or delete
+loans store the open loan's id on its book in the same transaction, so
+the available books are a range scan of ``ix_books_active_loan_name``.
+
+If the column drifts, for instance after loans were edited by hand,
+rebuild it from the loans with::
+
+    python -m backend.book_availability
+"""
+from __future__ import annotations
+
+from collections.abc import Iterable
+from typing import Any
+
+from sqlalchemy import ColumnElement, bindparam, false, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import bulk, versioning
+from .database import SessionLocal, engine, ensure_columns, ensure_indexes
+from .excel_utils import chunked
+from .logging_config import get_logger
+from .models import Book, Loan
+
+logger = get_logger(__name__)
+
+
+def available_condition(available: bool) -> ColumnElement[bool]:
+    """Return the criteria of the books on the shelf, or of those on loan."""
+    return Book.active_loan_id.is_(None) if available else Book.active_loan_id.is_not(None)
+
+
+async def record_checkouts(db: AsyncSession, loans: Iterable[tuple[int, int]]) -> None:
+    """Mark books as on loan; ``loans`` holds the (loan id, book id) of the new loans."""
+    rows = [{"loan": loan_id, "book": book_id} for loan_id, book_id in loans]
+    if not rows:
+        return
+    table = Book.__table__
+    statement = update(table).where(table.c.id == bindparam("book")).values(active_loan_id=bindparam("loan"))
+    await db.execute(statement, rows)
+    await db.execute(versioning.table_versions_bump(Book.__tablename__))
+
+
+async def record_returns(db: AsyncSession, loan_ids: Iterable[int]) -> None:
+    """Put the books of returned loans back on the shelf."""
+    table = Book.__table__
+    changed = 0
+    for batch in chunked(loan_ids, bulk.LOOKUP_BATCH_ROWS):
+        statement = update(table).where(table.c.active_loan_id.in_(batch)).values(active_loan_id=None)
+        changed += (await db.execute(statement)).rowcount
+    if changed:
+        await db.execute(versioning.table_versions_bump(Book.__tablename__))
+
+
+async def record_removals(db: AsyncSession, *criteria: Any) -> None:
+    """
+    Put the books of the loans matching ``criteria`` back on the shelf; call before deleting them.
+
+    ``criteria`` may refer to the loan or its student, so deleting a
+    student frees the books they had borrowed.
+    """
+    table = Book.__table__
+    loan_ids = select(Loan.id).where(*criteria)
+    statement = update(table).where(table.c.active_loan_id.in_(loan_ids)).values(active_loan_id=None)
+    if (await db.execute(statement)).rowcount:
+        await db.execute(versioning.table_versions_bump(Book.__tablename__))
+
+
+def repair_book_availability(db: Session) -> int:
+    """Point every book at its open loan, or at none, and return how many books were out of step."""
+    table = Book.__table__
+    open_loan = (
+        select(Loan.id).where(Loan.book_id == table.c.id, Loan.returned == false()).limit(1).scalar_subquery()
+    )
+    statement = (
+        update(table).where(table.c.active_loan_id.is_distinct_from(open_loan)).values(active_loan_id=open_loan)
+    )
+    changed = db.execute(statement).rowcount
+    if changed:
+        versioning.bump_table_versions(db.connection(), Book.__tablename__)
+    db.commit()
+    if changed:
+        logger.info(f"Repaired the availability of {changed} books")
+    return changed
+
+
+def main() -> None:
+    """Rebuild the availability of every book from the loans."""
+    ensure_columns(engine)
+    ensure_indexes(engine)
+    db = SessionLocal()
+    try:
+        changed = repair_book_availability(db)
+    finally:
+        db.close()
+    if not changed:
+        logger.info("Book availability is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Set-based insert helpers for bulk imports."""
+from __future__ import annotations
+
+from collections.abc import Sequence
+from typing import Any
+
+from sqlalchemy import Insert, Row, Table, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Values per IN list of set-based lookups, well under SQLite's bound parameter limit
+LOOKUP_BATCH_ROWS = 500
+
+
+def insert_ignoring_conflicts(table: Table, dialect_name: str) -> Insert:
+    """
+    Return an INSERT into ``table`` that skips rows violating a unique constraint.
+
+    Uses ``ON CONFLICT DO NOTHING`` on SQLite and PostgreSQL; other databases
+    get a plain INSERT, so callers must not rely on it to drop duplicates.
+    """
+    if dialect_name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+async def insert_rows(
+    db: AsyncSession,
+    table: Table,
+    rows: Sequence[dict[str, Any]],
+    returning: Sequence[Any],
+) -> list[Row]:
+    """
+    Insert rows in batched multi-row VALUES statements, skipping conflicting rows.
+
+    Core inserts bypass the ORM, so callers bump the table versions
+    themselves.
+
+    Args:
+        db: Session to execute on
+        table: Target table
+        rows: Column values of each row
+        returning: Columns to return for the inserted rows
+
+    Returns:
+        The ``returning`` columns of the rows actually inserted
+    """
+    if not rows:
+        return []
+    statement = insert_ignoring_conflicts(table, db.get_bind().dialect.name).returning(*returning)
+    # Executed with a parameter list, SQLAlchemy batches the rows into
+    # multi-row VALUES statements ("insertmanyvalues") from one cached compile.
+    result = await db.execute(statement, list(rows))
+    return result.all()
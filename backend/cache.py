@@ -1,11 +1,27 @@
-"""Redis cache utilities for the library system backend."""
+"""
+Two-tier cache utilities for the library system backend.
+
+Values are looked up in a bounded in-process LRU (L1) first and in Redis
+(L2) second. Invalidations are broadcast on a Redis pub/sub channel so that
+every worker drops its stale L1 entries. L1 is only used while Redis is
+reachable, since otherwise workers could not learn about each other's writes.
+"""
 from __future__ import annotations
 
+import asyncio
 import json
+import re
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from threading import Lock
 from typing import Any
 
 from redis import Redis
+from redis.client import PubSub, PubSubWorkerThread
 from redis.exceptions import RedisError
+from starlette.concurrency import run_in_threadpool
 
 from .config import settings
 from .logging_config import get_logger
@@ -15,8 +31,103 @@ logger = get_logger(__name__)
 _BOOK_SEARCH_PREFIX = "books:search:"
 _STUDENT_SEARCH_PREFIX = "students:search:"
 _CATEGORY_LIST_KEY = "categories:list"
+_OVERDUE_STUDENT_IDS_KEY = "students:overdue-ids"
+
+_MISSING = object()
+
+# A TTL in seconds, or a function returning one once the value is computed
+Ttl = int | Callable[[], "int | None"] | None
+
+
+class LocalCache:
+    """Bounded, thread-safe LRU cache with a per-entry TTL, private to one worker."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        """Return the cached value, or ``_MISSING`` if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None) -> None:
+        """Store a value, evicting the least recently used entries beyond the size limit."""
+        if self.max_entries <= 0:
+            return
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix: str) -> None:
+        """Drop every entry whose key starts with ``prefix``."""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss/eviction counters and the current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
+
+
+_local_cache = LocalCache(settings.cache_local_max_entries, settings.cache_local_ttl)
+_redis_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+# The generation segment of a key, followed by its table snapshot if it has one
+_GENERATION_SEGMENT_RE = re.compile(r":v\d+:(?:@[^:]*:)?")
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Computations in progress in this worker's event loop, keyed by cache key
+_inflight: dict[str, asyncio.Future] = {}
 
 _redis_client: Redis | None = None
+_raw_redis_client: Redis | None = None
+_invalidation_thread: PubSubWorkerThread | None = None
+
+# Handlers of the broadcasts of other modules on the invalidation channel, by
+# message prefix. Prefixes start with "@", which no cache namespace does.
+_broadcast_handlers: dict[str, Callable[[str], None]] = {}
+# Tells this worker's own broadcasts apart when they come back from Redis
+_WORKER_ID = uuid.uuid4().hex
+# Run when the listener reconnects, to catch up on the broadcasts missed meanwhile
+_resync_handlers: list[Callable[[], None]] = []
+
+# Seconds between reconnection attempts of the invalidation listener
+_LISTENER_RETRY_SECONDS = 1.0
+_listener_connected = False
 
 
 def get_redis_client() -> Redis | None:
@@ -46,6 +157,22 @@ def get_redis_client() -> Redis | None:
     return _redis_client
 
 
+def get_raw_redis_client() -> Redis | None:
+    """
+    Return a singleton Redis client that returns values as bytes.
+
+    Used for pre-serialized response bodies, which are handed to the client
+    without decoding.
+    """
+    global _raw_redis_client
+
+    if get_redis_client() is None:
+        return None
+    if _raw_redis_client is None:
+        _raw_redis_client = Redis.from_url(settings.redis_url, decode_responses=False)
+    return _raw_redis_client
+
+
 def _safe_json_loads(payload: str | None) -> Any | None:
     if payload is None:
         return None
@@ -64,28 +191,262 @@ def _safe_json_dumps(data: Any) -> str | None:
         return None
 
 
-def build_book_search_key(term: str) -> str:
-    """Build the cache key for a book search term."""
-    normalized = term.strip().lower()
-    return f"{_BOOK_SEARCH_PREFIX}{normalized}"
+def _generation_key(namespace: str) -> str:
+    return f"{namespace.rstrip(':')}:generation"
 
 
-def get_cached_value(key: str) -> Any | None:
-    """Retrieve a cached JSON-serializable value from Redis."""
+def _namespace_prefix(namespace: str) -> str:
+    return f"{namespace.rstrip(':')}:"
+
+
+def get_generation(namespace: str) -> int:
+    """Return the current generation counter of a cache namespace (0 if unset or unavailable)."""
     client = get_redis_client()
     if client is None:
-        return None
+        return 0
+    key = _generation_key(namespace)
+    generation = _local_cache.get(key)
+    if generation is not _MISSING:
+        return generation
+    try:
+        value = client.get(key)
+    except RedisError as exc:
+        logger.error("Redis get failed for %s generation: %s", namespace, exc)
+        return 0
+    try:
+        generation = int(value) if value is not None else 0
+    except ValueError:
+        return 0
+    _local_cache.set(key, generation)
+    return generation
+
+
+def build_namespaced_key(namespace: str, *parts: object, snapshot: str | None = None) -> str:
+    """
+    Build a cache key that embeds the namespace's current generation.
+
+    Bumping the generation makes every older key unreachable; the stale
+    entries are left to expire through their TTL. A ``snapshot`` token
+    from ``versioning.snapshot_token`` follows the generation, where
+    ``_stale_key`` can strip it along with the generation.
+    """
+    suffix = ":".join("" if part is None else str(part) for part in parts)
+    snapshot_segment = f"@{snapshot}:" if snapshot else ""
+    return f"{namespace.rstrip(':')}:v{get_generation(namespace)}:{snapshot_segment}{suffix}"
+
+
+def invalidate_namespace(namespace: str) -> None:
+    """
+    Invalidate every key of a namespace with a single INCR of its generation.
+
+    The local tier is cleared immediately and the namespace is published so
+    that the other workers clear theirs.
+    """
+    client = get_redis_client()
+    if client is None:
+        return
+    _local_cache.delete_prefix(_namespace_prefix(namespace))
+    try:
+        generation = client.incr(_generation_key(namespace))
+        client.publish(settings.cache_invalidation_channel, namespace)
+    except RedisError as exc:
+        logger.error("Redis invalidate failed for %s: %s", namespace, exc)
+        return
+    _local_cache.set(_generation_key(namespace), generation)
+
+
+def subscribe(prefix: str, handler: Callable[[str], None], resync: Callable[[], None] | None = None) -> None:
+    """
+    Run ``handler`` on the payload of every ``broadcast`` of other workers under ``prefix``.
+
+    Handlers run in the listener thread. ``prefix`` must start with "@".
+    ``resync`` runs after the listener reconnects to Redis and should
+    rebuild whatever the broadcasts missed in the meantime kept current.
+    """
+    _broadcast_handlers[prefix] = handler
+    if resync is not None:
+        _resync_handlers.append(resync)
+
+
+def broadcast(prefix: str, payload: str) -> None:
+    """Send ``payload`` to the handlers the other workers subscribed under ``prefix``; a no-op without Redis."""
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.publish(settings.cache_invalidation_channel, f"{prefix}{_WORKER_ID}:{payload}")
+    except RedisError as exc:
+        logger.error("Redis broadcast failed for %s: %s", prefix, exc)
+
+
+def _handle_invalidation_message(message: dict[str, Any]) -> None:
+    data = message.get("data")
+    if not isinstance(data, str):
+        return
+    for prefix, handler in _broadcast_handlers.items():
+        if data.startswith(prefix):
+            sender, _, payload = data[len(prefix):].partition(":")
+            if sender != _WORKER_ID:
+                try:
+                    handler(payload)
+                except Exception as exc:
+                    logger.error(f"Broadcast handler for {prefix} failed: {exc}", exc_info=True)
+            return
+    _local_cache.delete_prefix(_namespace_prefix(data))
+
+
+def _disable_local_cache() -> None:
+    _local_cache.max_entries = 0
+    _local_cache.clear()
+
+
+def _on_listener_error(exc: BaseException, pubsub: PubSub, thread: PubSubWorkerThread) -> None:
+    """
+    Keep the listener thread alive across Redis disconnects.
+
+    While disconnected this worker cannot hear other workers' writes, so L1
+    is turned off. Once the connection and subscription are restored, L1 is
+    turned back on empty and the resync handlers catch up on what the
+    missed broadcasts carried.
+    """
+    global _listener_connected
+
+    if _listener_connected:
+        logger.warning(f"Cache invalidation listener disconnected, disabling local cache: {exc}")
+        _listener_connected = False
+        _disable_local_cache()
+    time.sleep(_LISTENER_RETRY_SECONDS)
+    try:
+        # Connecting resubscribes the channel through the pubsub's connect callback
+        pubsub.connection.disconnect()
+        pubsub.connection.connect()
+    except RedisError:
+        return
+
+    _local_cache.clear()
+    _local_cache.max_entries = settings.cache_local_max_entries
+    _listener_connected = True
+    logger.info("Cache invalidation listener reconnected, local cache enabled")
+    for resync in _resync_handlers:
+        try:
+            resync()
+        except Exception as resync_exc:
+            logger.error(f"Resync after listener reconnect failed: {resync_exc}", exc_info=True)
+
+
+def start_invalidation_listener() -> None:
+    """Subscribe this worker to cache invalidation broadcasts in a background thread that survives disconnects."""
+    global _invalidation_thread, _listener_connected
+
+    client = get_redis_client()
+    if client is None or _invalidation_thread is not None:
+        return
+    try:
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{settings.cache_invalidation_channel: _handle_invalidation_message})
+        _invalidation_thread = pubsub.run_in_thread(
+            sleep_time=1.0, daemon=True, exception_handler=_on_listener_error
+        )
+        _listener_connected = True
+        logger.info(f"Listening for cache invalidations on {settings.cache_invalidation_channel}")
+    except RedisError as exc:
+        # Without broadcasts other workers' writes would go unnoticed, so turn L1 off.
+        logger.warning(f"Cache invalidation listener unavailable, disabling local cache: {exc}")
+        _disable_local_cache()
+
+
+def stop_invalidation_listener() -> None:
+    """Stop the invalidation listener thread, if running."""
+    global _invalidation_thread
+
+    if _invalidation_thread is not None:
+        _invalidation_thread.stop()
+        _invalidation_thread = None
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    """Return hit/miss/eviction counters for the local and Redis tiers."""
+    return {"local": _local_cache.stats(), "redis": dict(_redis_stats)}
+
+
+def build_book_search_key(
+    term: str,
+    cursor: str | None = None,
+    limit: int | None = None,
+    snapshot: str | None = None,
+    available: bool | None = None,
+) -> str:
+    """Build the cache key for one page of a book search term, optionally tied to a table snapshot."""
+    normalized = term.strip().lower()
+    return build_namespaced_key(_BOOK_SEARCH_PREFIX, limit, cursor, available, normalized, snapshot=snapshot)
+
+
+def build_student_search_key(
+    term: str | None,
+    grade: str | None = None,
+    major: str | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+    snapshot: str | None = None,
+) -> str:
+    """Build the cache key for one page of a student search with grade/major filters."""
+    normalized = (term or "").strip().lower()
+    filters = json.dumps([grade or "", major or ""], ensure_ascii=False, separators=(",", ":"))
+    return build_namespaced_key(_STUDENT_SEARCH_PREFIX, limit, cursor, filters, normalized, snapshot=snapshot)
+
+
+def build_category_list_key() -> str:
+    """Build the cache key for the category list."""
+    return build_namespaced_key(_CATEGORY_LIST_KEY)
+
+
+def build_overdue_student_ids_key(snapshot: str) -> str:
+    """Build the cache key for the ids of students with overdue loans, tied to the loans' snapshot."""
+    return build_namespaced_key(_OVERDUE_STUDENT_IDS_KEY, snapshot=snapshot)
+
+
+def _get_from_redis(client: Redis, key: str, raw: bool) -> Any | None:
+    """Read a value from Redis only, filling the local tier on a hit."""
     try:
         payload = client.get(key)
     except RedisError as exc:
+        _redis_stats["errors"] += 1
         logger.error("Redis get failed for %s: %s", key, exc)
         return None
-    return _safe_json_loads(payload)
+    if payload is None:
+        _redis_stats["misses"] += 1
+        return None
+    _redis_stats["hits"] += 1
+    value = payload if raw else _safe_json_loads(payload)
+    if value is not None:
+        _local_cache.set(key, value)
+    return value
+
+
+def _get_from_remote_tier(key: str, raw: bool) -> Any | None:
+    client = get_raw_redis_client() if raw else get_redis_client()
+    return _get_from_redis(client, key, raw) if client is not None else None
+
+
+def get_cached_value(key: str) -> Any | None:
+    """
+    Retrieve a cached JSON-serializable value, checking the local tier before Redis.
+
+    Values served from the local tier are shared between requests and must
+    be treated as read-only.
+    """
+    client = get_redis_client()
+    if client is None:
+        return None
+    value = _local_cache.get(key)
+    if value is not _MISSING:
+        return value
+    return _get_from_redis(client, key, raw=False)
 
 
 def set_cached_value(key: str, value: Any, ttl_seconds: int | None = None) -> None:
     """
-    Store a JSON-serializable value in Redis with a TTL.
+    Store a JSON-serializable value in Redis and the local tier with a TTL.
     
     Args:
         key: Cache key
@@ -106,16 +467,218 @@ def set_cached_value(key: str, value: Any, ttl_seconds: int | None = None) -> No
         client.setex(key, ttl, payload)
         logger.debug(f"Cached key: {key} (TTL: {ttl}s)")
     except RedisError as exc:
+        _redis_stats["errors"] += 1
         logger.error(f"Redis set failed for {key}: {exc}")
+        return
+    _local_cache.set(key, value, ttl)
 
 
-def invalidate_book_search_cache() -> None:
-    """Invalidate all cached book search results."""
-    client = get_redis_client()
+def get_cached_bytes(key: str) -> bytes | None:
+    """Retrieve a cached raw payload, checking the local tier before Redis."""
+    client = get_raw_redis_client()
+    if client is None:
+        return None
+    value = _local_cache.get(key)
+    if value is not _MISSING:
+        return value
+    return _get_from_redis(client, key, raw=True)
+
+
+def set_cached_bytes(key: str, payload: bytes, ttl_seconds: int | None = None) -> None:
+    """
+    Store a raw payload in Redis and the local tier with a TTL.
+
+    Args:
+        key: Cache key
+        payload: Bytes to cache, typically a serialized response body
+        ttl_seconds: Time to live in seconds (uses settings default if None)
+    """
+    client = get_raw_redis_client()
     if client is None:
         return
+
+    ttl = ttl_seconds if ttl_seconds is not None else settings.cache_ttl
+
     try:
-        for key in client.scan_iter(match=f"{_BOOK_SEARCH_PREFIX}*"):
-            client.delete(key)
+        client.setex(key, ttl, payload)
+        logger.debug(f"Cached key: {key} (TTL: {ttl}s, {len(payload)} bytes)")
     except RedisError as exc:
-        logger.error("Redis invalidate failed: %s", exc)
+        _redis_stats["errors"] += 1
+        logger.error(f"Redis set failed for {key}: {exc}")
+        return
+    _local_cache.set(key, payload, ttl)
+
+
+def _stale_key(key: str) -> str | None:
+    """Return the key holding the last computed value whatever the generation and snapshot, if any."""
+    if _GENERATION_SEGMENT_RE.search(key) is None:
+        return None
+    return _GENERATION_SEGMENT_RE.sub(":stale:", key, count=1)
+
+
+def _tier_accessors(raw: bool) -> tuple[Callable[[str], Any], Callable[..., None]]:
+    return (get_cached_bytes, set_cached_bytes) if raw else (get_cached_value, set_cached_value)
+
+
+def _get_stale_value(key: str, raw: bool) -> Any | None:
+    stale_key = _stale_key(key) if settings.cache_serve_stale else None
+    return _tier_accessors(raw)[0](stale_key) if stale_key else None
+
+
+def _try_lock(client: Redis, lock_key: str, token: str) -> bool:
+    return bool(client.set(lock_key, token, nx=True, px=settings.cache_lock_timeout_ms))
+
+
+def _release_lock(client: Redis, lock_key: str, token: str) -> None:
+    try:
+        client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+    except RedisError as exc:
+        logger.error("Redis unlock failed for %s: %s", lock_key, exc)
+
+
+def _store_computed(key: str, value: Any, ttl_seconds: Ttl, raw: bool) -> None:
+    if callable(ttl_seconds):
+        ttl_seconds = ttl_seconds()
+    set_cached = _tier_accessors(raw)[1]
+    set_cached(key, value, ttl_seconds)
+    stale_key = _stale_key(key) if settings.cache_serve_stale else None
+    if stale_key:
+        set_cached(stale_key, value, settings.cache_stale_ttl)
+
+
+async def get_or_compute(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    ttl_seconds: Ttl = None,
+    raw: bool = False,
+) -> Any:
+    """
+    Return the cached value for ``key``, computing it at most once on a miss.
+
+    Concurrent misses in this worker await the first caller's result, and
+    a short Redis lock elects a single computing worker across processes;
+    the others poll the cache until the value appears. While a recompute is
+    in progress, callers are served the previous generation's value if one
+    is still held (stale-while-revalidate). Blocking Redis calls run in
+    the threadpool so waiting never holds a thread or the event loop.
+
+    Args:
+        key: Cache key built with ``build_namespaced_key``
+        compute: Coroutine function producing the JSON-serializable value, or bytes if ``raw``
+        ttl_seconds: Time to live in seconds (uses settings default if None), or a
+            function called once ``compute`` has run that returns it
+        raw: Cache the computed bytes as-is instead of JSON-encoding them
+    """
+    return (await get_or_compute_with_status(key, compute, ttl_seconds, raw))[0]
+
+
+async def get_or_compute_with_status(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    ttl_seconds: Ttl = None,
+    raw: bool = False,
+) -> tuple[Any, bool]:
+    """
+    Same as ``get_or_compute`` but also report whether a stale value was served.
+
+    Returns:
+        Tuple of (value, is_stale)
+    """
+    cached = _local_cache.get(key)
+    if cached is _MISSING:
+        cached = await run_in_threadpool(_get_from_remote_tier, key, raw)
+    if cached is not None:
+        return cached, False
+
+    future = _inflight.get(key)
+    if future is not None:
+        stale = await run_in_threadpool(_get_stale_value, key, raw)
+        if stale is not None:
+            return stale, True
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), settings.cache_lock_timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out waiting for in-flight computation of %s", key)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+        return await compute(), False
+
+    future = asyncio.get_running_loop().create_future()
+    # Mark a failure as retrieved even if nobody was waiting for it.
+    future.add_done_callback(lambda done: done.cancelled() or done.exception())
+    _inflight[key] = future
+    try:
+        result = await _compute_once_across_workers(key, compute, ttl_seconds, raw)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        _inflight.pop(key, None)
+
+
+async def _compute_once_across_workers(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    ttl_seconds: Ttl,
+    raw: bool,
+) -> tuple[Any, bool]:
+    client = get_redis_client()
+    if client is None:
+        return await compute(), False
+
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
+    try:
+        acquired = await run_in_threadpool(_try_lock, client, lock_key, token)
+    except RedisError as exc:
+        logger.error("Redis lock failed for %s: %s", key, exc)
+        acquired = True
+
+    if not acquired:
+        stale = await run_in_threadpool(_get_stale_value, key, raw)
+        if stale is not None:
+            return stale, True
+        get_cached = _tier_accessors(raw)[0]
+        deadline = time.monotonic() + settings.cache_lock_timeout_ms / 1000
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(settings.cache_lock_poll_ms / 1000)
+            cached = await run_in_threadpool(get_cached, key)
+            if cached is not None:
+                return cached, False
+            # The holder may have failed without filling the cache; take over its lock.
+            try:
+                acquired = await run_in_threadpool(_try_lock, client, lock_key, token)
+            except RedisError:
+                break
+        if not acquired:
+            logger.warning("Timed out waiting for another worker to compute %s", key)
+
+    try:
+        value = await compute()
+        await run_in_threadpool(_store_computed, key, value, ttl_seconds, raw)
+        return value, False
+    finally:
+        if acquired:
+            await run_in_threadpool(_release_lock, client, lock_key, token)
+
+
+def invalidate_book_search_cache() -> None:
+    """Invalidate all cached book search results."""
+    invalidate_namespace(_BOOK_SEARCH_PREFIX)
+
+
+def invalidate_student_search_cache() -> None:
+    """Invalidate all cached student search results."""
+    invalidate_namespace(_STUDENT_SEARCH_PREFIX)
+
+
+def invalidate_category_list_cache() -> None:
+    """Invalidate the cached category list."""
+    invalidate_namespace(_CATEGORY_LIST_KEY)
@@ -18,10 +18,32 @@ class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite:///./library.db"
     database_echo: bool = False
+    database_async: bool = False
+    database_read_urls: list[str] = []
+    database_replica_strategy: str = "round_robin"  # or "least_latency"
+    database_replica_eject_seconds: int = 30
+    database_read_your_writes_seconds: int = 5
+
+    # SQLite performance profile (applied to every connection)
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size: int = 268435456  # 256MB
+    sqlite_cache_size: int = -65536  # negative = KiB, i.e. 64MB per connection
+    sqlite_reader_pool_size: int = 8
+    sqlite_writer_pool_timeout: float = 10.0
+    database_busy_retry_after: int = 2
     
     # Redis Cache
     redis_url: str = "redis://localhost:6379/0"
     cache_ttl: int = 300
+    cache_local_max_entries: int = 1024
+    cache_local_ttl: int = 30
+    cache_invalidation_channel: str = "library:cache:invalidate"
+    cache_lock_timeout_ms: int = 5000
+    cache_lock_poll_ms: int = 50
+    cache_serve_stale: bool = True
+    cache_stale_ttl: int = 600
     
     # Authentication
     password: str = "library"
@@ -39,6 +61,15 @@ class Settings(BaseSettings):
     default_page_size: int = 20
     max_page_size: int = 100
     
+    # Bulk import
+    import_chunk_size: int = 1000
+    import_job_workers: int = 2
+    import_parse_workers: int = 2
+    import_parse_max_tasks_per_child: int = 50
+    
+    # Streaming
+    stream_batch_size: int = 1000
+    
     # Logging
     log_level: str = "INFO"
     log_file: str = "library.log"
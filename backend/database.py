@@ -1,59 +1,680 @@
 """Database configuration module for the library system backend."""
 from __future__ import annotations
 
-from collections.abc import Generator
+import itertools
+import time
+from collections.abc import AsyncGenerator, AsyncIterator, Callable, Sequence
+from contextlib import asynccontextmanager
+from threading import Lock
+from typing import Any, TypeVar
 
-from sqlalchemy import create_engine, event
-from sqlalchemy.engine import Engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from fastapi import Request, Response
+from sqlalchemy import Executable, Index, Row, create_engine, event, func, inspect, select, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.schema import CreateColumn
+from starlette.concurrency import run_in_threadpool
 
 from .config import settings
 from .logging_config import get_logger
 
 logger = get_logger(__name__)
 
+T = TypeVar("T")
+
+# Async drivers used for each backend when LIBRARY_DATABASE_ASYNC is enabled
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# Dialects whose partial indexes carry their condition in the "where" option
+_PARTIAL_INDEX_DIALECTS = ("sqlite", "postgresql")
+
+# Indexes since removed from the models, dropped from existing databases
+_RETIRED_INDEXES = (
+    # Allowed a single copy of a title per category
+    "uq_books_name_category",
+)
+
+_database_url = make_url(settings.database_url)
+_is_sqlite = _database_url.get_backend_name() == "sqlite"
+# A SQLite file can be shared by separate writer and reader pools; an
+# in-memory database exists per connection, so it keeps a single engine.
+_split_pools = _is_sqlite and _database_url.database not in (None, "", ":memory:")
+
+
+def _pool_options(readonly: bool) -> dict[str, Any]:
+    """
+    Return pool sizing for the writer or reader engine.
+
+    SQLite allows one writer at a time, so the writer engine holds a single
+    connection and concurrent writes queue in the pool instead of failing
+    with "database is locked"; readers get their own pool and, in WAL mode,
+    never wait for the writer. A write that waits longer than
+    ``sqlite_writer_pool_timeout`` fails with a pool ``TimeoutError``,
+    answered with 503 and ``Retry-After``.
+    """
+    if not _split_pools:
+        return {}
+    if readonly:
+        return {"pool_size": settings.sqlite_reader_pool_size, "max_overflow": 0}
+    return {"pool_size": 1, "max_overflow": 0, "pool_timeout": settings.sqlite_writer_pool_timeout}
+
+
 # Create engine with config
 engine = create_engine(
     settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {},
+    connect_args={"check_same_thread": False} if _is_sqlite else {},
     pool_pre_ping=True,
     echo=settings.database_echo,
     future=True,
+    **_pool_options(readonly=False),
 )
+read_engine = engine
+if _split_pools:
+    read_engine = create_engine(
+        settings.database_url,
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+        echo=settings.database_echo,
+        future=True,
+        **_pool_options(readonly=True),
+    )
 
-# Enable foreign keys for SQLite
-if "sqlite" in settings.database_url:
+# Enable foreign keys, apply the performance profile and register the search helpers for SQLite
+if _is_sqlite:
     @event.listens_for(Engine, "connect")
     def set_sqlite_pragma(dbapi_conn, connection_record):
         cursor = dbapi_conn.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
         cursor.close()
 
+
+def _set_query_only(dbapi_conn, connection_record) -> None:
+    # Guards against a handler on the reader pool writing by mistake.
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+if _split_pools:
+    event.listen(read_engine, "connect", _set_query_only)
+
 SessionLocal = sessionmaker(
     bind=engine,
     autoflush=False,
     autocommit=False,
     future=True,
 )
+ReadSessionLocal = sessionmaker(
+    bind=read_engine,
+    autoflush=False,
+    autocommit=False,
+    future=True,
+)
 
 Base = declarative_base()
 
 
-def get_db() -> Generator:
+def ensure_columns(bind: Engine) -> set[str]:
     """
-    FastAPI dependency that yields a database session.
-    
-    Yields:
-        Database session that will be automatically closed after use.
+    Add the model columns missing from existing tables and return the names of the tables that gained any.
+
+    ``create_all`` leaves existing tables alone, so nullable columns added
+    to a model later are added here with ``ALTER TABLE``. Columns that
+    need a value for existing rows are logged and skipped.
+    """
+    altered: set[str] = set()
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                logger.warning(f"Cannot add required column {table.name}.{column.name} to an existing table")
+                continue
+            table_name = bind.dialect.identifier_preparer.format_table(table)
+            definition = CreateColumn(column).compile(dialect=bind.dialect)
+            with bind.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {definition}"))
+            logger.info(f"Added column {table.name}.{column.name}")
+            altered.add(table.name)
+    return altered
+
+
+def ensure_indexes(bind: Engine) -> None:
+    """
+    Create the model indexes missing from existing tables and drop retired ones.
+
+    ``create_all`` only creates indexes together with their table, so indexes
+    added to a model later are created here. A plain index that cannot be
+    built is logged and skipped.
+
+    Raises:
+        RuntimeError: If a unique index cannot be built over existing rows.
+            Handlers rely on unique indexes to reject double checkouts, so
+            the error names the conflicting rows and startup stops until
+            they are resolved.
+    """
+    with bind.begin() as connection:
+        for name in _RETIRED_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=bind, checkfirst=True)
+            except SQLAlchemyError as e:
+                if not index.unique:
+                    logger.warning(f"Could not create index {index.name}: {e}")
+                    continue
+                columns = ", ".join(column.name for column in index.columns)
+                message = (
+                    f"Cannot create unique index {index.name} on {table.name}({columns}): {e}. "
+                    f"Values shared by several rows, with their row count: {_duplicate_values(bind, index)}. "
+                    "Resolve these rows and restart."
+                )
+                logger.error(message)
+                raise RuntimeError(message) from e
+
+
+def _duplicate_values(bind: Engine, index: Index, limit: int = 20) -> list[tuple[Any, ...]]:
+    """Return up to ``limit`` value sets that break a unique index, each followed by its row count."""
+    columns = list(index.columns)
+    statement = (
+        select(*columns, func.count())
+        .where(*(column.is_not(None) for column in columns))
+        .group_by(*columns)
+        .having(func.count() > 1)
+        .limit(limit)
+    )
+    # Partial indexes only cover the rows matching their condition
+    where = None
+    if bind.dialect.name in _PARTIAL_INDEX_DIALECTS:
+        where = index.dialect_options[bind.dialect.name].get("where")
+    if where is not None:
+        statement = statement.where(where)
+    try:
+        with bind.connect() as connection:
+            return [tuple(row) for row in connection.execute(statement)]
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not list the rows conflicting with {index.name}: {e}")
+        return []
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    Return the async driver URL for a database URL.
+
+    ``sqlite://`` maps to aiosqlite and ``postgresql://`` to asyncpg; URLs
+    that already name a driver are returned unchanged.
+    """
+    parsed = make_url(url)
+    if "+" in parsed.drivername:
+        return url
+    driver = _ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.get_backend_name()!r} databases")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+# The sync engines above are still used for startup tasks (table creation,
+# indexes, counters); request handlers use the async engines when enabled.
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal: async_sessionmaker[AsyncSession] | None = None
+AsyncReadSessionLocal: async_sessionmaker[AsyncSession] | None = None
+if settings.database_async:
+    async_engine = create_async_engine(
+        get_async_database_url(settings.database_url),
+        pool_pre_ping=True,
+        echo=settings.database_echo,
+        **_pool_options(readonly=False),
+    )
+    async_read_engine = async_engine
+    if _split_pools:
+        async_read_engine = create_async_engine(
+            get_async_database_url(settings.database_url),
+            pool_pre_ping=True,
+            echo=settings.database_echo,
+            **_pool_options(readonly=True),
+        )
+        event.listen(async_read_engine.sync_engine, "connect", _set_query_only)
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+    AsyncReadSessionLocal = async_sessionmaker(
+        bind=async_read_engine,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+READ_YOUR_WRITES_COOKIE = "library_last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+# Marks a request whose read database was not chosen by get_read_db
+_UNCHOSEN = object()
+
+
+class Replica:
+    """
+    A read replica with its own engines, a latency estimate and an ejection deadline.
+
+    Latency is an exponentially weighted average of query round-trips seen
+    on the replica's connections. Connection-level failures eject the
+    replica for ``LIBRARY_DATABASE_REPLICA_EJECT_SECONDS``, after which it
+    is tried again.
+    """
+
+    def __init__(self, url: str):
+        parsed = make_url(url)
+        self.name = parsed.render_as_string(hide_password=True)
+        is_sqlite = parsed.get_backend_name() == "sqlite"
+        self.engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False} if is_sqlite else {},
+            pool_pre_ping=True,
+            echo=settings.database_echo,
+            future=True,
+        )
+        self.session_factory = sessionmaker(bind=self.engine, autoflush=False, autocommit=False, future=True)
+        self.async_engine = None
+        self.async_session_factory: async_sessionmaker[AsyncSession] | None = None
+        sync_engines = [self.engine]
+        if settings.database_async:
+            self.async_engine = create_async_engine(
+                get_async_database_url(url),
+                pool_pre_ping=True,
+                echo=settings.database_echo,
+            )
+            self.async_session_factory = async_sessionmaker(
+                bind=self.async_engine,
+                autoflush=False,
+                expire_on_commit=False,
+            )
+            sync_engines.append(self.async_engine.sync_engine)
+
+        self.latency_ms: float | None = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        for sync_engine in sync_engines:
+            event.listen(sync_engine, "before_cursor_execute", self._before_execute)
+            event.listen(sync_engine, "after_cursor_execute", self._after_execute)
+            event.listen(sync_engine, "handle_error", self._on_error)
+            if is_sqlite:
+                event.listen(sync_engine, "connect", _set_query_only)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def open_session(self) -> AsyncSession | ThreadpoolSession:
+        if self.async_session_factory is not None:
+            return self.async_session_factory()
+        return ThreadpoolSession(self.session_factory(expire_on_commit=False))
+
+    def eject(self) -> None:
+        self.failures += 1
+        self.ejected_until = time.monotonic() + settings.database_replica_eject_seconds
+        logger.warning(
+            f"Read replica {self.name} ejected for {settings.database_replica_eject_seconds}s "
+            f"({self.failures} failures)"
+        )
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "latency_ms": round(self.latency_ms, 2) if self.latency_ms is not None else None,
+            "failures": self.failures,
+        }
+
+    async def dispose(self) -> None:
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+        self.engine.dispose()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info["replica_query_start"] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        started = conn.info.pop("replica_query_start", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.latency_ms = elapsed_ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * elapsed_ms
+
+    def _on_error(self, context) -> None:
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            self.eject()
+
+
+class ReplicaSet:
+    """Selects a healthy read replica by round-robin or lowest latency."""
+
+    def __init__(self, urls: list[str], strategy: str):
+        if strategy not in ("round_robin", "least_latency"):
+            raise ValueError(f"Unknown replica selection strategy {strategy!r}")
+        self.replicas = [Replica(url) for url in urls]
+        self.strategy = strategy
+        self._counter = itertools.count()
+        self._lock = Lock()
+
+    def choose(self) -> Replica | None:
+        """Return the replica to read from, or None if every replica is ejected."""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.strategy == "least_latency":
+            # Replicas without samples sort first so that each gets measured.
+            return min(healthy, key=lambda replica: replica.latency_ms or 0.0)
+        with self._lock:
+            return healthy[next(self._counter) % len(healthy)]
+
+    def status(self) -> dict[str, dict[str, Any]]:
+        return {replica.name: replica.status() for replica in self.replicas}
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.dispose()
+
+
+class ThreadpoolSession:
+    """
+    ``AsyncSession``-compatible wrapper around a blocking ``Session``.
+
+    Used when async mode is disabled so the ``async def`` handlers can await
+    the same calls either way; each call runs in Starlette's threadpool.
+    Only the subset of the ``AsyncSession`` API used by the routers is
+    provided.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    @property
+    def info(self) -> dict[Any, Any]:
+        return self.sync_session.info
+
+    def get_bind(self, *args: Any, **kwargs: Any) -> Any:
+        return self.sync_session.get_bind(*args, **kwargs)
+
+    def add(self, instance: object) -> None:
+        self.sync_session.add(instance)
+
+    def add_all(self, instances: list[object]) -> None:
+        self.sync_session.add_all(instances)
+
+    async def execute(self, *args: Any, **kwargs: Any) -> Any:
+        return await run_in_threadpool(self.sync_session.execute, *args, **kwargs)
+
+    async def scalar(self, *args: Any, **kwargs: Any) -> Any:
+        return await run_in_threadpool(self.sync_session.scalar, *args, **kwargs)
+
+    async def get(self, *args: Any, **kwargs: Any) -> Any:
+        return await run_in_threadpool(self.sync_session.get, *args, **kwargs)
+
+    async def flush(self, *args: Any, **kwargs: Any) -> None:
+        await run_in_threadpool(self.sync_session.flush, *args, **kwargs)
+
+    async def refresh(self, *args: Any, **kwargs: Any) -> None:
+        await run_in_threadpool(self.sync_session.refresh, *args, **kwargs)
+
+    async def delete(self, instance: object) -> None:
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def commit(self) -> None:
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self) -> None:
+        await run_in_threadpool(self.sync_session.close)
+
+    async def run_sync(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+
+def open_session(readonly: bool = False, replica: Replica | None = None) -> AsyncSession | ThreadpoolSession:
     """
-    db = SessionLocal()
+    Open a session for request handlers in the configured database mode.
+
+    Args:
+        readonly: Use the reader pool, for handlers that do not write
+        replica: Read replica to open the session on instead of the primary
+    """
+    if replica is not None:
+        return replica.open_session()
+    if AsyncSessionLocal is not None:
+        return (AsyncReadSessionLocal if readonly else AsyncSessionLocal)()
+    factory = ReadSessionLocal if readonly else SessionLocal
+    # Handlers refresh explicitly, as with the async session, so nothing is expired on commit.
+    return ThreadpoolSession(factory(expire_on_commit=False))
+
+
+@asynccontextmanager
+async def session_scope(readonly: bool = False, replica: Replica | None = None) -> AsyncIterator[AsyncSession]:
+    """Open a session, rolling back on error and always closing it."""
+    db = open_session(readonly, replica)
     try:
         logger.debug("Database session created")
         yield db
     except Exception as e:
         logger.error(f"Database session error: {e}", exc_info=True)
-        db.rollback()
+        await db.rollback()
         raise
     finally:
-        db.close()
+        await db.close()
         logger.debug("Database session closed")
+
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    FastAPI dependency that yields a database session on the writer engine.
+
+    With ``LIBRARY_DATABASE_ASYNC`` enabled this is an ``AsyncSession`` on the
+    async engine; otherwise a ``ThreadpoolSession`` exposing the same
+    awaitable API over the sync engine.
+
+    Yields:
+        Database session that will be automatically closed after use.
+    """
+    async with session_scope() as db:
+        yield db
+
+
+async def get_read_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    FastAPI dependency that yields a session for handlers that only read.
+
+    With ``LIBRARY_DATABASE_READ_URLS`` set, the session is opened on a
+    healthy replica, unless the client wrote within the read-your-writes
+    window or every replica is ejected, in which case the primary is used.
+    Without replicas, a SQLite file is read through the reader pool, whose
+    connections are opened with ``query_only``; otherwise it is the same as
+    ``get_db``.
+    """
+    replica = choose_read_replica(request)
+    # Streamed bodies are read from the same database, see stream_read_partitions
+    request.state.read_replica = replica
+    async with session_scope(readonly=True, replica=replica) as db:
+        yield db
+
+
+async def get_primary_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    FastAPI dependency that yields a read session on the primary database, never a replica.
+
+    For reads that must see the latest commits, such as job progress. On
+    SQLite the session comes from the reader pool, so frequent polling
+    does not compete for the single writer connection.
+    """
+    async with session_scope(readonly=True) as db:
+        yield db
+
+
+def choose_read_replica(request: Request) -> Replica | None:
+    """Return the replica to serve a read-only request from, or None to read from the primary."""
+    if replicas is None or recently_wrote(request) or getattr(request.state, "read_from_primary", False):
+        return None
+    replica = replicas.choose()
+    if replica is not None:
+        # Lets PrimaryRetryMiddleware tell whether the replica failed during the request
+        request.state.read_replicas = [*getattr(request.state, "read_replicas", []), (replica, replica.failures)]
+    return replica
+
+
+class PrimaryRetryMiddleware:
+    """
+    Retry a read once on the primary when its replica fails before the response starts.
+
+    The failure ejects the replica, but the request that hit it would still
+    fail. The response start is held back until its status is known: a
+    server error or exception from a request whose replica failed meanwhile
+    is dropped and the request is run again with its reads on the primary.
+    Streamed bodies that fail after they started cannot be retried.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        state: dict[str, Any] = dict(scope.get("state", {}))
+        held: list[dict[str, Any]] = []
+        started = False
+
+        async def send_unless_failed(message: dict[str, Any]) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                if message["status"] >= 500 and _replica_failed(state):
+                    held.append(message)
+                    return
+                started = True
+            if held:
+                # The failed response's body is dropped along with its start
+                return
+            await send(message)
+
+        try:
+            await self.app({**scope, "state": state}, receive, send_unless_failed)
+        except Exception:
+            if started or not _replica_failed(state):
+                raise
+        else:
+            if not held:
+                return
+        logger.warning(f"Retrying {scope['path']} on the primary after a read replica failed")
+        retry_state = {**scope.get("state", {}), "read_from_primary": True}
+        await self.app({**scope, "state": retry_state}, receive, send)
+
+
+def _replica_failed(state: dict[str, Any]) -> bool:
+    """Check whether a replica chosen for a request failed after it was chosen."""
+    return any(replica.failures > failures for replica, failures in state.get("read_replicas", []))
+
+
+async def stream_partitions(
+    db: AsyncSession | ThreadpoolSession, statement: Executable, size: int
+) -> AsyncIterator[Sequence[Row]]:
+    """
+    Yield the rows of a query in lists of at most ``size``, buffering one list at a time.
+
+    Rows are fetched with ``yield_per``, through ``AsyncSession.stream`` in
+    async mode and with ``fetchmany`` in the threadpool otherwise, so the
+    memory used does not grow with the size of the result.
+    """
+    statement = statement.execution_options(yield_per=size)
+    if isinstance(db, ThreadpoolSession):
+        result = await db.execute(statement)
+        try:
+            while rows := await run_in_threadpool(result.fetchmany, size):
+                yield rows
+        finally:
+            await run_in_threadpool(result.close)
+        return
+
+    result = await db.stream(statement)
+    try:
+        async for rows in result.partitions(size):
+            yield rows
+    finally:
+        await result.close()
+
+
+async def stream_read_partitions(request: Request, statement: Executable, size: int) -> AsyncIterator[Sequence[Row]]:
+    """
+    Run ``stream_partitions`` on a read session of its own.
+
+    For streamed response bodies, which are sent after the request's
+    dependencies, and their sessions, are closed. The session is opened on
+    the replica, or the primary, that ``get_read_db`` chose for the request,
+    so the body is never older than the ETag computed from that session.
+    """
+    replica = getattr(request.state, "read_replica", _UNCHOSEN)
+    if replica is _UNCHOSEN:
+        replica = choose_read_replica(request)
+    async with session_scope(readonly=True, replica=replica) as db:
+        async for rows in stream_partitions(db, statement, size):
+            yield rows
+
+
+def remember_write(response: Response) -> None:
+    """
+    Mark the client as having written, pinning its reads to the primary for a while.
+
+    The server's time of the write is sent in the ``X-Last-Write`` header
+    for the frontend to echo, and in a cookie for same-origin clients, so
+    the window never depends on the client's clock.
+    """
+    written_at = f"{time.time():.3f}"
+    response.headers[LAST_WRITE_HEADER] = written_at
+    response.set_cookie(
+        READ_YOUR_WRITES_COOKIE,
+        written_at,
+        max_age=settings.database_read_your_writes_seconds,
+        httponly=True,
+        samesite="lax",
+    )
+
+
+def recently_wrote(request: Request) -> bool:
+    """
+    Check whether the client wrote within the read-your-writes window.
+
+    The time of the last write is the value ``remember_write`` handed out,
+    echoed in the ``X-Last-Write`` header, which the frontend sends since
+    cookies are not shared across origins, or read from the cookie. Times
+    further in the future than the window are ignored, so a forged value
+    cannot pin a client to the primary for longer than one window ahead.
+    """
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(READ_YOUR_WRITES_COOKIE)
+    if value is None:
+        return False
+    try:
+        return abs(time.time() - float(value)) < settings.database_read_your_writes_seconds
+    except ValueError:
+        return False
+
+
+replicas: ReplicaSet | None = (
+    ReplicaSet(settings.database_read_urls, settings.database_replica_strategy)
+    if settings.database_read_urls
+    else None
+)
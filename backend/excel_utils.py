@@ -1,8 +1,11 @@
 """Excel file processing utilities for bulk import."""
 from __future__ import annotations
 
+import queue
+from collections.abc import Callable, Iterable, Iterator
 from io import BytesIO
-from typing import Any
+from itertools import chain, islice
+from typing import Any, BinaryIO, NamedTuple
 
 from openpyxl import load_workbook
 
@@ -10,136 +13,370 @@ from .logging_config import get_logger
 
 logger = get_logger(__name__)
 
+BOOK_NAME_COLUMNS = ['نام کتاب', 'نام', 'عنوان', 'کتاب']
+STUDENT_FIRST_NAME_COLUMNS = ['نام', 'نام دانش‌آموز', 'نام هنرجو']
+STUDENT_LAST_NAME_COLUMNS = ['نام خانوادگی', 'نام‌خانوادگی', 'فامیل']
+STUDENT_GRADE_COLUMNS = ['پایه', 'کلاس', 'مقطع']
+STUDENT_NATIONAL_ID_COLUMNS = ['کد ملی', 'شناسه', 'کدملی', 'شناسه ملی']
+STUDENT_PHONE_COLUMNS = ['تلفن', 'شماره تماس', 'شماره', 'موبایل']
+# Columns that take the place of the sheet name in CSV and NDJSON imports
+BOOK_CATEGORY_COLUMNS = ['دسته‌بندی', 'دسته بندی', 'دسته', 'موضوع']
+STUDENT_MAJOR_COLUMNS = ['رشته', 'رشته تحصیلی']
 
-def _find_column(sheet_data: list[dict[str, Any]], possible_names: list[str]) -> str | None:
-    """Helper to find a column by multiple possible names."""
+# Fields of the normalized rows, in the order of the tuples put by parse_sheet
+BOOK_FIELDS = ("name",)
+STUDENT_FIELDS = ("first_name", "last_name", "grade", "major", "national_id", "phone_number")
+
+# How often a parsing worker waiting on a full queue checks whether the import was cancelled
+_PUT_POLL_SECONDS = 1.0
+
+RowValidator = Callable[[dict[str, str]], "dict[str, Any] | None"]
+
+
+class SheetChunk(NamedTuple):
+    """A chunk of validated rows from one sheet, or the error that made the sheet unusable."""
+
+    sheet_name: str
+    rows: list[dict[str, Any]]
+    error: str | None = None
+
+
+class SheetRows(NamedTuple):
+    """A chunk of validated rows of one sheet as field tuples, or the error that made the sheet unusable."""
+
+    sheet_name: str
+    rows: list[tuple[Any, ...]]
+    error: str | None = None
+
+
+def _find_header(headers: Iterable[str], possible_names: list[str]) -> str | None:
+    """Helper to find a column by multiple possible names in a sheet's headers."""
+    present = set(headers)
     for name in possible_names:
-        if any(name in row for row in sheet_data):
+        if name in present:
             return name
     return None
 
 
-def read_excel_sheets(file_bytes: bytes) -> dict[str, list[dict[str, Any]]]:
+def _sheet_headers(sheet_data: list[dict[str, Any]]) -> set[str]:
+    return {header for row in sheet_data for header in row}
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    """Yield lists of at most ``size`` items from an iterable without materializing it."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _open_workbook(source: str | BinaryIO):
+    try:
+        return load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        logger.error(f"Failed to read Excel file: {e}", exc_info=True)
+        raise ValueError(f"خطا در خواندن فایل اکسل: {str(e)}")
+
+
+def _sheet_rows(sheet_name: str, worksheet) -> tuple[list[str], Iterator[dict[str, str]]] | None:
+    """Return the headers and a lazy iterator of the non-empty data rows of a sheet, or None if it is empty."""
+    rows = worksheet.iter_rows(values_only=True)
+    header_row = next(rows, None)
+    if header_row is None:
+        logger.warning(f"Sheet '{sheet_name}' is empty")
+        return None
+
+    # First row is headers
+    headers = [str(h).strip() if h else f"Column_{i}" for i, h in enumerate(header_row)]
+
+    # Data rows, skipping empty ones
+    return headers, (
+        {h: str(cell).strip() if cell else "" for h, cell in zip(headers, row)}
+        for row in rows
+        if any(cell for cell in row)
+    )
+
+
+def iter_excel_sheets(source: BinaryIO) -> Iterator[tuple[str, list[str], Iterator[dict[str, str]]]]:
+    """
+    Stream the sheets of an Excel file in openpyxl's read-only mode.
+
+    Rows are produced lazily, so only the current row is held in memory.
+    Each sheet's row iterator must be consumed before advancing to the next
+    sheet.
+
+    Args:
+        source: Seekable binary file holding the workbook
+
+    Yields:
+        Tuples of (sheet name, header names, iterator of row dictionaries)
+
+    Raises:
+        ValueError: If the file is not a readable Excel workbook.
+    """
+    workbook = _open_workbook(source)
+    try:
+        for sheet_name in workbook.sheetnames:
+            sheet = _sheet_rows(sheet_name, workbook[sheet_name])
+            if sheet is not None:
+                yield sheet_name, *sheet
+    finally:
+        workbook.close()
+
+
+def read_excel_sheets(source: bytes | BinaryIO) -> dict[str, list[dict[str, Any]]]:
     """
     Read all sheets from an Excel file and return structured data.
-    
+
+    Loads every row into memory; imports parse the file sheet by sheet
+    with ``parse_sheet`` in the process pool instead.
+
     Args:
-        file_bytes: Excel file content as bytes
-        
+        source: Excel file content as bytes, or a binary file
+
     Returns:
         Dictionary mapping sheet names to lists of row dictionaries
     """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    result: dict[str, list[dict[str, Any]]] = {}
     try:
-        workbook = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
-        result: dict[str, list[dict[str, Any]]] = {}
-        
-        for sheet_name in workbook.sheetnames:
-            rows = list(workbook[sheet_name].iter_rows(values_only=True))
-            
-            if not rows:
-                logger.warning(f"Sheet '{sheet_name}' is empty")
-                continue
-            
-            # First row is headers
-            headers = [str(h).strip() if h else f"Column_{i}" for i, h in enumerate(rows[0])]
-            
-            # Process data rows (skip empty rows)
-            sheet_data = [
-                {h: str(cell).strip() if cell else "" for h, cell in zip(headers, row)}
-                for row in rows[1:]
-                if any(cell for cell in row)
-            ]
-            
-            result[sheet_name] = sheet_data
-            logger.info(f"Processed sheet '{sheet_name}': {len(sheet_data)} rows")
-        
-        workbook.close()
-        return result
-        
+        for sheet_name, _, rows in iter_excel_sheets(source):
+            result[sheet_name] = list(rows)
+            logger.info(f"Processed sheet '{sheet_name}': {len(result[sheet_name])} rows")
+    except ValueError:
+        raise
     except Exception as e:
         logger.error(f"Failed to read Excel file: {e}", exc_info=True)
         raise ValueError(f"خطا در خواندن فایل اکسل: {str(e)}")
+    return result
+
+
+def _validated_rows(
+    sheet_name: str,
+    headers: list[str],
+    rows: Iterator[dict[str, str]],
+    make_validator: Callable[[str, list[str]], RowValidator],
+) -> Iterator[dict[str, Any]] | str | None:
+    """Return an iterator of a sheet's validated rows, the sheet's error message, or None if it has no data rows."""
+    first_row = next(rows, None)
+    if first_row is None:
+        return None
+    try:
+        validate = make_validator(sheet_name, headers)
+    except ValueError as e:
+        return f"شیت '{sheet_name}': {str(e)}"
+    return (data for row in chain([first_row], rows) if (data := validate(row)) is not None)
+
+
+def iter_validated_chunks(
+    source: BinaryIO,
+    make_validator: Callable[[str, list[str]], RowValidator],
+    chunk_size: int,
+) -> Iterator[SheetChunk]:
+    """
+    Stream an Excel file as chunks of validated rows.
+
+    Peak memory is bounded by ``chunk_size`` rows regardless of the file
+    size. Sheets without data rows are skipped; a sheet whose headers are
+    rejected by ``make_validator`` yields a single chunk carrying the error.
+
+    Args:
+        source: Seekable binary file holding the workbook
+        make_validator: Builds a row validator from (sheet name, headers),
+            raising ValueError if required columns are missing; the validator
+            returns the normalized row or None to skip it
+        chunk_size: Maximum number of rows per chunk
+
+    Raises:
+        ValueError: If the file is not a readable Excel workbook.
+    """
+    for sheet_name, headers, rows in iter_excel_sheets(source):
+        validated = _validated_rows(sheet_name, headers, rows, make_validator)
+        if isinstance(validated, str):
+            yield SheetChunk(sheet_name, [], validated)
+        elif validated is not None:
+            for chunk in chunked(validated, chunk_size):
+                yield SheetChunk(sheet_name, chunk)
+
+
+def list_sheet_names(path: str) -> list[str]:
+    """
+    Return the sheet names of an Excel file.
+
+    Raises:
+        ValueError: If the file is not a readable Excel workbook.
+    """
+    workbook = _open_workbook(path)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def parse_sheet(
+    path: str,
+    sheet_name: str,
+    make_validator: Callable[[str, list[str]], RowValidator],
+    fields: tuple[str, ...],
+    chunk_size: int,
+    chunks: Any,
+    cancelled: Any,
+) -> None:
+    """
+    Parse and validate a single sheet of an Excel file, putting it on ``chunks`` a chunk at a time.
+
+    Meant to run in a worker process, one sheet per task. ``chunks`` is a
+    bounded queue shared with the consumer, so the worker holds at most the
+    chunk it is building while the consumer catches up. Each chunk is a
+    ``SheetRows`` of tuples of ``fields`` to keep it small to pickle, and
+    ``None`` marks the end of the sheet. The worker gives up once the
+    ``cancelled`` event is set.
+
+    Raises:
+        ValueError: If the file is not a readable Excel workbook.
+    """
+    try:
+        workbook = _open_workbook(path)
+        try:
+            sheet = _sheet_rows(sheet_name, workbook[sheet_name])
+            validated = _validated_rows(sheet_name, *sheet, make_validator) if sheet is not None else None
+            if isinstance(validated, str):
+                _put_chunk(chunks, SheetRows(sheet_name, [], validated), cancelled)
+                return
+            count = 0
+            for rows in chunked(validated or (), chunk_size):
+                count += len(rows)
+                chunk = SheetRows(sheet_name, [tuple(data.get(field) for field in fields) for data in rows])
+                if not _put_chunk(chunks, chunk, cancelled):
+                    return
+            logger.info(f"Parsed sheet '{sheet_name}': {count} rows")
+        finally:
+            workbook.close()
+    finally:
+        _put_chunk(chunks, None, cancelled)
+
+
+def _put_chunk(chunks: Any, chunk: SheetRows | None, cancelled: Any) -> bool:
+    """Wait for room on the queue, returning False if the import was cancelled first."""
+    while not cancelled.is_set():
+        try:
+            chunks.put(chunk, timeout=_PUT_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def resolve_book_columns(headers: Iterable[str]) -> str:
+    """
+    Return the book name column of a sheet.
+
+    Raises:
+        ValueError: If none of the accepted name columns is present.
+    """
+    name_column = _find_header(headers, BOOK_NAME_COLUMNS)
+    if not name_column:
+        raise ValueError("ستون 'نام کتاب' یافت نشد. لطفاً یکی از ستون‌های 'نام کتاب'، 'نام' یا 'عنوان' را اضافه کنید.")
+    return name_column
+
+
+def validate_book_row(row: dict[str, str], name_column: str) -> dict[str, Any] | None:
+    """Return the normalized book of a row, or None if it has no name."""
+    book_name = row.get(name_column, "").strip()
+    return {"name": book_name} if book_name else None
+
+
+def book_row_validator(sheet_name: str, headers: list[str]) -> RowValidator:
+    """Build the row validator of a book sheet for ``iter_validated_chunks``."""
+    name_column = resolve_book_columns(headers)
+    return lambda row: validate_book_row(row, name_column)
 
 
 def validate_book_sheet_data(sheet_data: list[dict[str, Any]]) -> list[dict[str, Any]]:
     """
     Validate and normalize book data from a sheet.
-    
+
     Required columns: 'نام کتاب' or 'نام' or 'عنوان'
-    
+
     Args:
         sheet_data: List of row dictionaries from a sheet
-        
+
     Returns:
         List of validated book dictionaries with 'name' field
     """
-    name_column = _find_column(sheet_data, ['نام کتاب', 'نام', 'عنوان', 'کتاب'])
-    
-    if not name_column:
-        raise ValueError("ستون 'نام کتاب' یافت نشد. لطفاً یکی از ستون‌های 'نام کتاب'، 'نام' یا 'عنوان' را اضافه کنید.")
-    
-    return [
-        {"name": book_name}
-        for row in sheet_data
-        if (book_name := row.get(name_column, "").strip())
-    ]
+    name_column = resolve_book_columns(_sheet_headers(sheet_data))
+    return [book for row in sheet_data if (book := validate_book_row(row, name_column))]
+
+
+def resolve_student_columns(headers: Iterable[str]) -> dict[str, str | None]:
+    """
+    Map the student fields to the columns of a sheet.
+
+    Raises:
+        ValueError: If a required column is missing.
+    """
+    headers = list(headers)
+    columns = {
+        "first_name": _find_header(headers, STUDENT_FIRST_NAME_COLUMNS),
+        "last_name": _find_header(headers, STUDENT_LAST_NAME_COLUMNS),
+        "grade": _find_header(headers, STUDENT_GRADE_COLUMNS),
+        "national_id": _find_header(headers, STUDENT_NATIONAL_ID_COLUMNS),
+        "phone_number": _find_header(headers, STUDENT_PHONE_COLUMNS),
+    }
+    if not columns["first_name"]:
+        raise ValueError("ستون 'نام' در شیت یافت نشد")
+    if not columns["last_name"]:
+        raise ValueError("ستون 'نام خانوادگی' در شیت یافت نشد")
+    if not columns["grade"]:
+        raise ValueError("ستون 'پایه' در شیت یافت نشد")
+    return columns
+
+
+def validate_student_row(row: dict[str, str], columns: dict[str, str | None], major: str) -> dict[str, Any] | None:
+    """Return the normalized student of a row, or None if a required field is empty."""
+    first_name = row.get(columns["first_name"], "").strip()
+    last_name = row.get(columns["last_name"], "").strip()
+    grade = row.get(columns["grade"], "").strip()
+
+    if not (first_name and last_name and grade):
+        return None
+
+    student_data = {
+        "first_name": first_name,
+        "last_name": last_name,
+        "grade": grade,
+        "major": major,
+    }
+
+    # Add optional fields if present
+    for field in ("national_id", "phone_number"):
+        if columns[field]:
+            value = row.get(columns[field], "").strip()
+            if value:
+                student_data[field] = value
+
+    return student_data
+
+
+def student_row_validator(sheet_name: str, headers: list[str]) -> RowValidator:
+    """Build the row validator of a student sheet, whose name is the major, for ``iter_validated_chunks``."""
+    columns = resolve_student_columns(headers)
+    return lambda row: validate_student_row(row, columns, sheet_name)
 
 
 def validate_student_sheet_data(sheet_data: list[dict[str, Any]], major: str) -> list[dict[str, Any]]:
     """
     Validate and normalize student data from a sheet.
-    
+
     Required columns: 'نام', 'نام خانوادگی', 'پایه'
     Optional columns: 'کد ملی', 'شناسه', 'تلفن', 'شماره تماس'
-    
+
     Args:
         sheet_data: List of row dictionaries from a sheet
         major: Major/field extracted from sheet name
-        
+
     Returns:
         List of validated student dictionaries
     """
-    # Find required columns
-    first_name_col = _find_column(sheet_data, ['نام', 'نام دانش‌آموز', 'نام هنرجو'])
-    last_name_col = _find_column(sheet_data, ['نام خانوادگی', 'نام‌خانوادگی', 'فامیل'])
-    grade_col = _find_column(sheet_data, ['پایه', 'کلاس', 'مقطع'])
-    national_id_col = _find_column(sheet_data, ['کد ملی', 'شناسه', 'کدملی', 'شناسه ملی'])
-    phone_col = _find_column(sheet_data, ['تلفن', 'شماره تماس', 'شماره', 'موبایل'])
-    
-    if not first_name_col:
-        raise ValueError("ستون 'نام' در شیت یافت نشد")
-    if not last_name_col:
-        raise ValueError("ستون 'نام خانوادگی' در شیت یافت نشد")
-    if not grade_col:
-        raise ValueError("ستون 'پایه' در شیت یافت نشد")
-    
-    validated_students = []
-    for row in sheet_data:
-        first_name = row.get(first_name_col, "").strip()
-        last_name = row.get(last_name_col, "").strip()
-        grade = row.get(grade_col, "").strip()
-        
-        if not (first_name and last_name and grade):
-            continue
-        
-        student_data = {
-            "first_name": first_name,
-            "last_name": last_name,
-            "grade": grade,
-            "major": major,
-        }
-        
-        # Add optional fields if present
-        if national_id_col:
-            national_id = row.get(national_id_col, "").strip()
-            if national_id:
-                student_data["national_id"] = national_id
-        
-        if phone_col:
-            phone = row.get(phone_col, "").strip()
-            if phone:
-                student_data["phone_number"] = phone
-        
-        validated_students.append(student_data)
-    
-    return validated_students
+    columns = resolve_student_columns(_sheet_headers(sheet_data))
+    return [student for row in sheet_data if (student := validate_student_row(row, columns, major))]
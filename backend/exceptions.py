@@ -7,7 +7,9 @@ from fastapi import Request, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
+from .config import settings
 from .logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -120,6 +122,20 @@ async def integrity_exception_handler(
     )
 
 
+async def pool_timeout_exception_handler(
+    request: Request,
+    exc: PoolTimeoutError,
+) -> JSONResponse:
+    """Handle a request that waited too long for a database connection, such as the SQLite writer."""
+    logger.warning(f"Database connection pool exhausted: {exc}")
+
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "پایگاه داده مشغول است، لطفاً دوباره تلاش کنید"},
+        headers={"Retry-After": str(settings.database_busy_retry_after)},
+    )
+
+
 async def database_exception_handler(
     request: Request,
     exc: SQLAlchemyError,
@@ -0,0 +1,156 @@
+"""SQLite FTS5 full-text index for book titles."""
+from __future__ import annotations
+
+from sqlalchemy import and_, column, func, literal_column, or_, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import Select
+
+from .logging_config import get_logger
+from .text_utils import CHAR_REPLACEMENTS, normalize_persian
+
+logger = get_logger(__name__)
+
+FTS_TABLE = "books_fts"
+
+
+# Nesting all the replace() calls in one expression overflows SQLite's parser
+# stack, so they are applied a few at a time in nested subqueries
+_REPLACEMENTS_PER_STAGE = 8
+
+
+def _normalized_names_sql(row_id: str, name: str, source: str = "") -> str:
+    """
+    Return a SELECT of ``(id, name)`` with the name normalized like ``normalize_persian``.
+
+    Built from SQLite's own replace() and char(), so the triggers work on
+    every connection, including the sqlite3 shell and restore tools. Case
+    and whitespace are left to the FTS5 tokenizer.
+
+    Args:
+        row_id: SQL expression of the book id
+        name: SQL expression of the title
+        source: Table to select from, if any
+    """
+    replacements = list(CHAR_REPLACEMENTS.items())
+    query = ""
+    for start in range(0, len(replacements), _REPLACEMENTS_PER_STAGE):
+        expression = name if not query else "name"
+        for character, target in replacements[start:start + _REPLACEMENTS_PER_STAGE]:
+            replacement = f"char({ord(target)})" if target else "''"
+            expression = f"replace({expression}, char({ord(character)}), {replacement})"
+        if not query:
+            query = f"SELECT {row_id} AS id, {expression} AS name" + (f" FROM {source}" if source else "")
+        else:
+            query = f"SELECT id, {expression} AS name FROM ({query})"
+    return query
+
+
+_TRIGGER_NAMES = (f"{FTS_TABLE}_ai", f"{FTS_TABLE}_ad", f"{FTS_TABLE}_au")
+
+# The index stores its own normalized copy of each title (rowid = books.id).
+# Triggers are dropped and recreated so databases whose triggers called the
+# former fa_normalize connection function are brought up to date.
+_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    "USING fts5(name, tokenize='unicode61 remove_diacritics 2')",
+    *(f"DROP TRIGGER IF EXISTS {name}" for name in _TRIGGER_NAMES),
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON books BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name) {_normalized_names_sql('new.id', 'new.name')};
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON books BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name ON books BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, name) {_normalized_names_sql('new.id', 'new.name')};
+    END""",
+)
+
+_REBUILD_SQL = (
+    f"DELETE FROM {FTS_TABLE}",
+    f"INSERT INTO {FTS_TABLE}(rowid, name) {_normalized_names_sql('id', 'name', 'books')}",
+)
+
+_fts = table(FTS_TABLE, column("rowid"))
+_fts_enabled = False
+
+
+def ensure_book_fts(engine: Engine) -> bool:
+    """
+    Create the FTS5 table and sync triggers, populating the index on first run.
+
+    Args:
+        engine: Engine bound to the application database
+
+    Returns:
+        True if full-text search is available, False on non-SQLite engines or
+        SQLite builds without FTS5.
+    """
+    global _fts_enabled
+
+    if engine.dialect.name != "sqlite":
+        _fts_enabled = False
+        return False
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE},
+            ).first()
+            for statement in _FTS_DDL:
+                conn.exec_driver_sql(statement)
+            if exists is None:
+                for statement in _REBUILD_SQL:
+                    conn.exec_driver_sql(statement)
+                logger.info("Built full-text index for books")
+    except OperationalError as exc:
+        logger.warning(f"FTS5 unavailable, falling back to LIKE search: {exc}")
+        _fts_enabled = False
+        return False
+
+    _fts_enabled = True
+    return True
+
+
+def fts_enabled() -> bool:
+    """Return whether book searches should use the FTS5 index."""
+    return _fts_enabled
+
+
+def build_match_query(term: str) -> str | None:
+    """
+    Convert a user search term into an FTS5 MATCH expression.
+
+    Each word becomes a quoted prefix query and all words must match, so
+    partially typed words still find titles. Returns None when the term has
+    no searchable characters.
+    """
+    tokens = [
+        token for token in normalize_persian(term).split()
+        if any(ch.isalnum() for ch in token)
+    ]
+    if not tokens:
+        return None
+    return " ".join('"' + token.replace('"', '""') + '"*' for token in tokens)
+
+
+def book_hits(match_query: str):
+    """Subquery of (book_id, rank) for books matching an FTS5 query, best rank lowest."""
+    return (
+        select(
+            _fts.c.rowid.label("book_id"),
+            func.bm25(literal_column(FTS_TABLE)).label("rank"),
+        )
+        .select_from(_fts)
+        .where(literal_column(FTS_TABLE).op("MATCH")(match_query))
+        .subquery("book_hits")
+    )
+
+
+def after_hit(statement: Select, hits, rank: float, book_id: int) -> Select:
+    """Restrict a ranked search statement to rows after the given (rank, id) cursor."""
+    return statement.where(
+        or_(hits.c.rank > rank, and_(hits.c.rank == rank, hits.c.book_id > book_id))
+    )
@@ -0,0 +1,151 @@
+"""Process pool that parses uploaded workbooks away from the event loop."""
+from __future__ import annotations
+
+import asyncio
+import queue
+import shutil
+import tempfile
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from multiprocessing.managers import SyncManager
+from threading import Lock
+from typing import Any, BinaryIO
+
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from .config import settings
+from .excel_utils import RowValidator, SheetChunk, SheetRows, iter_validated_chunks, list_sheet_names, parse_sheet
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Chunks a parsing worker may queue ahead of the import consuming them
+_QUEUED_CHUNKS_PER_SHEET = 1
+# How often the import checks on a parsing worker that has not sent a chunk
+_GET_POLL_SECONDS = 1.0
+
+_executor: ProcessPoolExecutor | None = None
+_manager: SyncManager | None = None
+_executor_lock = Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Return the parsing pool, starting it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.import_parse_workers,
+                max_tasks_per_child=settings.import_parse_max_tasks_per_child or None,
+            )
+            logger.info(f"Started workbook parsing pool with {settings.import_parse_workers} processes")
+        return _executor
+
+
+def get_manager() -> SyncManager:
+    """Return the manager process hosting the queues that parsing workers send chunks through."""
+    global _manager
+    with _executor_lock:
+        if _manager is None:
+            _manager = Manager()
+        return _manager
+
+
+def shutdown() -> None:
+    """Stop the parsing pool, dropping queued tasks."""
+    global _executor, _manager
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        if _manager is not None:
+            _manager.shutdown()
+            _manager = None
+
+
+def save_upload(source: BinaryIO) -> str:
+    """Copy an uploaded workbook to a temporary file that worker processes can open, returning its path."""
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="library-import-", suffix=".xlsx", delete=False) as target:
+        shutil.copyfileobj(source, target)
+        return target.name
+
+
+async def _next_chunk(chunks: Any, task: asyncio.Future[None]) -> SheetRows | None:
+    """Wait for a sheet's next chunk, returning None at its end and raising the worker's error if it failed."""
+    while True:
+        try:
+            chunk = await run_in_threadpool(chunks.get, True, _GET_POLL_SECONDS)
+        except queue.Empty:
+            if not task.done():
+                continue
+            chunk = None
+        if chunk is None:
+            await task
+        return chunk
+
+
+async def iter_sheet_chunks(
+    path: str,
+    make_validator: Callable[[str, list[str]], RowValidator],
+    fields: tuple[str, ...],
+    chunk_size: int,
+) -> AsyncIterator[SheetChunk]:
+    """
+    Parse a saved workbook in the process pool and yield chunks of validated rows.
+
+    Every sheet is parsed by its own task, with at most
+    ``LIBRARY_IMPORT_PARSE_WORKERS`` sheets in flight, so sheets are parsed
+    in parallel while chunks are still yielded in sheet order. Workers send
+    each sheet back ``chunk_size`` rows at a time, as tuples of ``fields``,
+    through a queue that holds one chunk, so a worker ahead of the import
+    waits instead of buffering its sheet. Peak memory is therefore a few
+    chunks per worker rather than the whole workbook. With
+    ``LIBRARY_IMPORT_PARSE_WORKERS=0`` the file is streamed from the
+    threadpool instead, holding one chunk at a time.
+
+    Raises:
+        ValueError: If the file is not a readable Excel workbook.
+    """
+    if settings.import_parse_workers <= 0:
+        with open(path, "rb") as source:
+            chunks = iter_validated_chunks(source, make_validator, chunk_size)
+            try:
+                async for chunk in iterate_in_threadpool(chunks):
+                    yield chunk
+            finally:
+                chunks.close()
+        return
+
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    manager = await run_in_threadpool(get_manager)
+    sheet_names = iter(await loop.run_in_executor(executor, list_sheet_names, path))
+    cancelled = manager.Event()
+    sheets: deque[tuple[Any, asyncio.Future[None]]] = deque()
+
+    def start_next_sheet() -> None:
+        sheet_name = next(sheet_names, None)
+        if sheet_name is None:
+            return
+        chunks = manager.Queue(_QUEUED_CHUNKS_PER_SHEET)
+        task = loop.run_in_executor(
+            executor, parse_sheet, path, sheet_name, make_validator, fields, chunk_size, chunks, cancelled
+        )
+        sheets.append((chunks, task))
+
+    for _ in range(settings.import_parse_workers):
+        start_next_sheet()
+    try:
+        while sheets:
+            chunks, task = sheets[0]
+            while (sheet := await _next_chunk(chunks, task)) is not None:
+                yield SheetChunk(sheet.sheet_name, [dict(zip(fields, row)) for row in sheet.rows], sheet.error)
+            sheets.popleft()
+            start_next_sheet()
+    finally:
+        cancelled.set()
+        for _, task in sheets:
+            task.cancel()
@@ -0,0 +1,126 @@
+"""Background jobs for imports too large to run within a request."""
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+from typing import Any
+from uuid import uuid4
+
+from sqlalchemy import Update, select, update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import session_scope
+from .logging_config import get_logger
+from .models import TEHRAN_TZ, ImportJob
+
+logger = get_logger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# Error recorded on jobs that stopped with the server
+_SERVER_STOPPED = "عملیات به دلیل توقف سرور متوقف شد"
+
+# Jobs run as tasks on the event loop and hand the blocking work (parsing,
+# and database calls outside async mode) to the threadpool; the semaphore
+# bounds how many run at once in this process.
+_slots = asyncio.Semaphore(max(1, settings.import_job_workers))
+_tasks: set[asyncio.Task] = set()
+
+
+async def create_job(kind: str, file_name: str | None = None) -> str:
+    """Record a pending job and return its id."""
+    job = ImportJob(id=uuid4().hex, kind=kind, status=JOB_PENDING, file_name=file_name)
+    async with session_scope() as db:
+        db.add(job)
+        await db.commit()
+    return job.id
+
+
+def record_progress(job_id: str, processed: int, created: int, skipped: int, errors: list[str]) -> Update:
+    """
+    Return the statement adding a chunk's counts to a job.
+
+    Executed in the transaction that writes the chunk, so the reported
+    progress always matches what has been committed.
+    """
+    return (
+        update(ImportJob)
+        .where(ImportJob.id == job_id)
+        .values(
+            rows_processed=ImportJob.rows_processed + processed,
+            total_created=ImportJob.total_created + created,
+            total_skipped=ImportJob.total_skipped + skipped,
+            errors=list(errors),
+        )
+    )
+
+
+async def _set_job(job_id: str, **values: Any) -> None:
+    async with session_scope() as db:
+        await db.execute(update(ImportJob).where(ImportJob.id == job_id).values(**values))
+        await db.commit()
+
+
+async def _finish(job_id: str, status: str, error: str | None = None) -> None:
+    values: dict[str, Any] = {"status": status, "finished_at": datetime.now(TEHRAN_TZ)}
+    if error is not None:
+        async with session_scope() as db:
+            job = await db.get(ImportJob, job_id)
+            values["errors"] = [*(job.errors if job else []), error]
+    await _set_job(job_id, **values)
+
+
+async def _run(job_id: str, work: Callable[[], Awaitable[None]]) -> None:
+    async with _slots:
+        await _set_job(job_id, status=JOB_RUNNING)
+        try:
+            await work()
+        except asyncio.CancelledError:
+            await _finish(job_id, JOB_FAILED, _SERVER_STOPPED)
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            await _finish(job_id, JOB_FAILED, str(e))
+        else:
+            await _finish(job_id, JOB_COMPLETED)
+            logger.info(f"Job {job_id} completed")
+
+
+def submit(job_id: str, work: Callable[[], Awaitable[None]]) -> None:
+    """Run ``work`` for a job in the background, tracking its status."""
+    task = asyncio.create_task(_run(job_id, work))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def shutdown() -> None:
+    """Cancel the jobs still running, marking them failed."""
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+
+
+def fail_abandoned_jobs(db: Session) -> int:
+    """
+    Mark the jobs left pending or running by an earlier run as failed and return how many there were.
+
+    Jobs are tasks of the process that accepted them, so after a crash or
+    a kill nothing would ever finish them and their clients would poll
+    forever. A clean shutdown already marks its jobs failed.
+    """
+    statement = select(ImportJob).where(ImportJob.status.in_((JOB_PENDING, JOB_RUNNING)))
+    jobs = db.execute(statement).scalars().all()
+    finished_at = datetime.now(TEHRAN_TZ)
+    for job in jobs:
+        job.status = JOB_FAILED
+        job.finished_at = finished_at
+        job.errors = [*job.errors, _SERVER_STOPPED]
+    db.commit()
+    if jobs:
+        logger.warning(f"Marked {len(jobs)} jobs left unfinished by an earlier run as failed")
+    return len(jobs)
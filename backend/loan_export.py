@@ -0,0 +1,162 @@
+"""Loan history export, written incrementally as CSV or XLSX."""
+from __future__ import annotations
+
+import csv
+import io
+import os
+import tempfile
+from collections.abc import AsyncIterator, Sequence
+from datetime import date, datetime
+from typing import Any
+
+from openpyxl import Workbook
+from sqlalchemy import ColumnElement, Row, Select, select
+from starlette.concurrency import run_in_threadpool
+
+from .models import TEHRAN_TZ, Book, Category, Loan, Student, as_tehran_time
+
+HEADERS = [
+    'نام',
+    'نام خانوادگی',
+    'پایه',
+    'رشته',
+    'کتاب',
+    'دسته‌بندی',
+    'تاریخ امانت',
+    'تاریخ بازگشت',
+    'مدت امانت (روز)',
+    'مدت تا تحویل (روز)',
+    'تاخیر (روز)',
+]
+
+# Bytes read at a time when sending a saved workbook
+_READ_SIZE = 64 * 1024
+
+
+def history_statement(grade: str = "", major: str = "", name: str = "") -> Select:
+    """Return the query of the loan history rows, newest first, filtered like the report tab."""
+    statement = (
+        select(
+            Student.first_name,
+            Student.last_name,
+            Student.grade,
+            Student.major,
+            Book.name,
+            Category.name,
+            Loan.loan_date,
+            Loan.due_date,
+            Loan.return_date,
+            Loan.returned,
+        )
+        .select_from(Loan)
+        .join(Student, Loan.student_id == Student.id)
+        .join(Book, Loan.book_id == Book.id)
+        .outerjoin(Category, Book.category_id == Category.id)
+        .order_by(Loan.loan_date.desc(), Loan.id.desc())
+    )
+    return statement.where(*student_criteria(grade, major, name))
+
+
+def student_criteria(grade: str = "", major: str = "", name: str = "") -> list[ColumnElement[bool]]:
+    """Return the report tab's filters on the student of a loan; empty values do not filter."""
+    criteria = []
+    if grade:
+        criteria.append(Student.grade == grade)
+    if major:
+        criteria.append(Student.major == major)
+    if name:
+        criteria.append((Student.first_name + " " + Student.last_name).ilike(f"%{name}%"))
+    return criteria
+
+
+def days_between(start: datetime, end: datetime) -> int:
+    """Return the whole days from ``start`` to ``end``, rounded and never negative."""
+    return max(0, round((end - start).total_seconds() / 86400))
+
+
+def history_row(row: Row, now: datetime) -> list[Any]:
+    """
+    Compute the exported values of a loan history row.
+
+    The planned duration runs from loan to due date and the duration until
+    return only exists once the book is back. The delay is the time past
+    the due date at return, or up to ``now`` for an overdue open loan.
+    Missing values are None.
+    """
+    first_name, last_name, grade, major, book_name, category_name, loan_date, due_date, return_date, returned = row
+    loaned_at, due_at, returned_at = as_tehran_time(loan_date), as_tehran_time(due_date), as_tehran_time(return_date)
+
+    planned_days = days_between(loaned_at, due_at) if due_at else None
+    until_return_days = days_between(loaned_at, returned_at) if returned_at else None
+    delay_days = None
+    if returned_at and due_at:
+        delay_days = days_between(due_at, returned_at)
+    elif not returned and due_at and now > due_at:
+        delay_days = days_between(due_at, now)
+
+    return [
+        first_name,
+        last_name,
+        grade,
+        major,
+        book_name,
+        category_name,
+        loaned_at.date(),
+        returned_at.date() if returned_at else None,
+        planned_days,
+        until_return_days,
+        delay_days,
+    ]
+
+
+def _csv_cell(value: Any) -> Any:
+    if value is None or value == "":
+        return "-"
+    return value.isoformat() if isinstance(value, date) else value
+
+
+async def iter_csv(partitions: AsyncIterator[Sequence[Row]]) -> AsyncIterator[bytes]:
+    """Encode streamed history rows as UTF-8 CSV, one piece per partition."""
+    now = datetime.now(TEHRAN_TZ)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The BOM makes Excel open the Persian text as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(HEADERS)
+    async for rows in partitions:
+        writer.writerows([_csv_cell(value) for value in history_row(row, now)] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _append_rows(sheet: Any, rows: list[list[Any]]) -> None:
+    for values in rows:
+        sheet.append(values)
+
+
+async def iter_xlsx(partitions: AsyncIterator[Sequence[Row]]) -> AsyncIterator[bytes]:
+    """
+    Write streamed history rows to a workbook and yield the saved file.
+
+    openpyxl's write-only mode spools appended rows to a temporary file,
+    so memory stays flat; the workbook can only be sent once it is saved.
+    """
+    now = datetime.now(TEHRAN_TZ)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("تاریخچه امانت")
+    sheet.append(HEADERS)
+    async for rows in partitions:
+        await run_in_threadpool(_append_rows, sheet, [history_row(row, now) for row in rows])
+
+    fd, path = tempfile.mkstemp(prefix="library-export-", suffix=".xlsx")
+    os.close(fd)
+    try:
+        await run_in_threadpool(workbook.save, path)
+        with open(path, "rb") as source:
+            while data := await run_in_threadpool(source.read, _READ_SIZE):
+                yield data
+    finally:
+        os.remove(path)
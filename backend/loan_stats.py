@@ -0,0 +1,258 @@
+"""
+Loan statistics rollup for the reports API.
+
+``loan_stats`` holds running counters per value of each report dimension.
+Handlers that create, return or delete loans apply the change to the
+rollup in the same transaction, so reports read a few small rows instead
+of aggregating the whole history.
+
+Loans are counted under the student's grade and major and the book's
+category at checkout. Checkouts store those values on the loan, so a
+return or deletion is taken out of the same rows even after the student
+moves up a grade or the book changes category.
+
+If the rollup drifts, for instance after loans were edited by hand,
+rebuild it from the loans with::
+
+    python -m backend.loan_stats
+"""
+from __future__ import annotations
+
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from typing import Any
+
+from sqlalchemy import Insert, Select, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import bulk
+from .config import settings
+from .database import SessionLocal, engine, ensure_columns, ensure_indexes
+from .excel_utils import chunked
+from .loan_export import days_between
+from .logging_config import get_logger
+from .models import Book, Loan, LoanStat, Student, as_tehran_time
+
+logger = get_logger(__name__)
+
+COUNTERS = ("loans", "returned", "duration_days", "delay_days")
+
+Totals = dict[tuple[str, str], Counter]
+
+
+def _loan_facts_statement(*criteria: Any) -> Select:
+    return (
+        select(
+            Loan.book_id,
+            Loan.loan_date,
+            Loan.due_date,
+            Loan.return_date,
+            Loan.returned,
+            Loan.student_grade,
+            Loan.student_major,
+            Loan.book_category_id,
+        )
+        .select_from(Loan)
+        .join(Student, Loan.student_id == Student.id)
+        .join(Book, Loan.book_id == Book.id)
+        .where(*criteria)
+    )
+
+
+def _dimension_keys(row: Any) -> list[tuple[str, str]]:
+    """Return the (dimension, key) of every rollup row a loan counts towards."""
+    return [
+        ("total", ""),
+        ("grade", row.student_grade or ""),
+        ("major", row.student_major or ""),
+        ("category", str(row.book_category_id) if row.book_category_id is not None else ""),
+        ("month", as_tehran_time(row.loan_date).strftime("%Y-%m")),
+        ("book", str(row.book_id)),
+    ]
+
+
+def _accumulate(totals: Totals, rows: Iterable[Any], loans: bool, returns: bool, sign: int = 1) -> None:
+    """
+    Add the counters of loans to ``totals``.
+
+    Args:
+        loans: Count the loans themselves
+        returns: Count the return, duration and delay of the loans already returned
+        sign: -1 to subtract the loans instead
+    """
+    for row in rows:
+        deltas: Counter = Counter()
+        if loans:
+            deltas["loans"] = sign
+        if returns and row.returned and row.return_date is not None:
+            returned_at = as_tehran_time(row.return_date)
+            deltas["returned"] = sign
+            deltas["duration_days"] = sign * days_between(as_tehran_time(row.loan_date), returned_at)
+            if row.due_date is not None:
+                deltas["delay_days"] = sign * days_between(as_tehran_time(row.due_date), returned_at)
+        if deltas:
+            for dimension_key in _dimension_keys(row):
+                totals[dimension_key].update(deltas)
+
+
+def _rows(totals: Totals) -> list[dict[str, Any]]:
+    return [
+        {"dimension": dimension, "key": key, **{name: counters[name] for name in COUNTERS}}
+        for (dimension, key), counters in totals.items()
+    ]
+
+
+def _upsert_adding(dialect_name: str) -> Insert | None:
+    """Return an INSERT that adds to the counters of existing rows, or None if the database has no upsert."""
+    table = LoanStat.__table__
+    if dialect_name == "sqlite":
+        statement = sqlite.insert(table)
+    elif dialect_name == "postgresql":
+        statement = postgresql.insert(table)
+    else:
+        return None
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.dimension, table.c.key],
+        set_={name: table.c[name] + statement.excluded[name] for name in COUNTERS},
+    )
+
+
+async def _apply(db: AsyncSession, totals: Totals) -> None:
+    rows = _rows(totals)
+    if not rows:
+        return
+    statement = _upsert_adding(db.get_bind().dialect.name)
+    if statement is not None:
+        await db.execute(statement, rows)
+        return
+    table = LoanStat.__table__
+    for row in rows:
+        result = await db.execute(
+            update(table)
+            .where(table.c.dimension == row["dimension"], table.c.key == row["key"])
+            .values({name: table.c[name] + row[name] for name in COUNTERS})
+        )
+        if result.rowcount == 0:
+            await db.execute(insert(table).values(row))
+
+
+async def _record(db: AsyncSession, loan_ids: Iterable[int], loans: bool, returns: bool) -> None:
+    totals: Totals = defaultdict(Counter)
+    for batch in chunked(loan_ids, bulk.LOOKUP_BATCH_ROWS):
+        rows = await db.execute(_loan_facts_statement(Loan.id.in_(batch)))
+        _accumulate(totals, rows, loans=loans, returns=returns)
+    await _apply(db, totals)
+
+
+def _record_dimensions_statement(*criteria: Any):
+    """Return an UPDATE storing the current grade, major and category on the loans matching ``criteria``."""
+    table = Loan.__table__
+    return (
+        update(table)
+        .where(*criteria)
+        .values(
+            student_grade=select(Student.grade).where(Student.id == table.c.student_id).scalar_subquery(),
+            student_major=select(Student.major).where(Student.id == table.c.student_id).scalar_subquery(),
+            book_category_id=select(Book.category_id).where(Book.id == table.c.book_id).scalar_subquery(),
+        )
+    )
+
+
+async def record_checkouts(db: AsyncSession, loan_ids: Iterable[int]) -> None:
+    """Store the dimensions of new loans and count them in the rollup; call before committing their insert."""
+    loan_ids = list(loan_ids)
+    for batch in chunked(loan_ids, bulk.LOOKUP_BATCH_ROWS):
+        await db.execute(_record_dimensions_statement(Loan.__table__.c.id.in_(batch)))
+    await _record(db, loan_ids, loans=True, returns=False)
+
+
+async def record_returns(db: AsyncSession, loan_ids: Iterable[int]) -> None:
+    """Count the returns of loans, whose return must already be flushed, in the rollup."""
+    await _record(db, loan_ids, loans=False, returns=True)
+
+
+async def record_removals(db: AsyncSession, *criteria: Any) -> None:
+    """
+    Take the loans matching ``criteria`` out of the rollup; call before deleting them.
+
+    ``criteria`` may refer to the loan, its student or its book, so deleting
+    a student, book or category can remove the loans that go with it.
+    """
+    totals: Totals = defaultdict(Counter)
+    _accumulate(totals, await db.execute(_loan_facts_statement(*criteria)), loans=True, returns=True, sign=-1)
+    await _apply(db, totals)
+
+
+def _build(db: Session) -> int:
+    """Insert the rollup of the whole loan history into an empty ``loan_stats`` and return its row count."""
+    totals: Totals = defaultdict(Counter)
+    statement = _loan_facts_statement().execution_options(yield_per=settings.stream_batch_size)
+    for rows in db.execute(statement).partitions():
+        _accumulate(totals, rows, loans=True, returns=True)
+    if totals:
+        db.execute(insert(LoanStat), _rows(totals))
+    return len(totals)
+
+
+def rebuild_loan_stats(db: Session, record_dimensions: bool = False) -> int:
+    """
+    Recount the rollup from the loan history in one transaction and return its row count.
+
+    Args:
+        record_dimensions: First store the current grade, major and
+            category on every loan, for loans from before checkouts kept them
+    """
+    # Clearing the table first takes the write lock before the history is read
+    db.execute(delete(LoanStat))
+    if record_dimensions:
+        db.execute(_record_dimensions_statement())
+    count = _build(db)
+    db.commit()
+    logger.info(f"Rebuilt loan statistics from the loan history ({count} rows)")
+    return count
+
+
+def ensure_loan_stats(db: Session, record_dimensions: bool = False) -> None:
+    """
+    Build the rollup from the loan history if it is empty, as after an upgrade.
+
+    Workers starting together may all find it empty; the first to commit
+    wins and the others' inserts fail on the primary key and are dropped.
+
+    Args:
+        record_dimensions: The loans just gained the columns holding their
+            dimensions at checkout, so fill them with the current values
+            and rebuild the rollup under them
+    """
+    if record_dimensions:
+        rebuild_loan_stats(db, record_dimensions=True)
+        return
+    if db.execute(select(LoanStat.dimension).limit(1)).first() is not None:
+        return
+    try:
+        count = _build(db)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        logger.info("Loan statistics were built by another worker")
+        return
+    if count:
+        logger.info(f"Built loan statistics from the loan history ({count} rows)")
+
+
+def main() -> None:
+    """Rebuild the loan statistics from the loans."""
+    altered = ensure_columns(engine)
+    ensure_indexes(engine)
+    db = SessionLocal()
+    try:
+        rebuild_loan_stats(db, record_dimensions=Loan.__tablename__ in altered)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
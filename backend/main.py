@@ -4,15 +4,28 @@ from __future__ import annotations
 from contextlib import asynccontextmanager
 from typing import Any, AsyncGenerator
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
-from . import auth
+from . import auth, book_availability, cache, fulltext, import_pool, job_queue, loan_stats, suggest, versioning
 from .config import settings
-from .database import Base, SessionLocal, engine
+from .database import (
+    Base,
+    PrimaryRetryMiddleware,
+    ReadSessionLocal,
+    SessionLocal,
+    async_engine,
+    async_read_engine,
+    engine,
+    ensure_columns,
+    ensure_indexes,
+    remember_write,
+    replicas,
+)
 from .models import DEFAULT_CATEGORIES
 from .exceptions import (
     LibraryException,
@@ -20,11 +33,12 @@ from .exceptions import (
     general_exception_handler,
     integrity_exception_handler,
     library_exception_handler,
+    pool_timeout_exception_handler,
     validation_exception_handler,
 )
 from .logging_config import get_logger
-from .models import Category
-from .routers import books, loans, students
+from .models import Category, Loan
+from .routers import books, jobs, loans, reports, students
 
 logger = get_logger(__name__)
 
@@ -32,6 +46,7 @@ logger = get_logger(__name__)
 def initialize_default_categories() -> None:
     """Create default categories if they don't exist."""
     db = SessionLocal()
+    created = False
     try:
         for cat_data in DEFAULT_CATEGORIES:
             # Check if category already exists
@@ -40,8 +55,11 @@ def initialize_default_categories() -> None:
             if existing is None:
                 category = Category(**cat_data)
                 db.add(category)
+                created = True
                 logger.info(f"Created default category: {cat_data['name']}")
         db.commit()
+        if created:
+            cache.invalidate_category_list_cache()
     except Exception as e:
         logger.error(f"Failed to initialize categories: {e}")
         db.rollback()
@@ -55,11 +73,22 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     Manage application lifespan events.
     
     Startup:
-        - Create database tables
+        - Create database tables and the columns added since
+        - Build the book full-text index
+        - Initialize table change counters
+        - Build the loan statistics rollup on first start, or after loans gain their checkout dimensions
+        - Bring the book availability flags in step with the loans
+        - Fail the background jobs a crashed run left unfinished
         - Initialize default categories
+        - Build the in-memory suggestion index
+        - Subscribe to cache invalidation broadcasts
         - Log application info
         
     Shutdown:
+        - Cancel background jobs still running
+        - Stop the workbook parsing processes
+        - Stop the cache invalidation listener
+        - Dispose of the async engines' and read replicas' connections
         - Log shutdown message
     """
     # Startup
@@ -67,13 +96,40 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     logger.info(f"Environment: {settings.environment}")
     logger.info("Creating database tables if they do not exist")
     Base.metadata.create_all(bind=engine)
+    altered_tables = ensure_columns(engine)
+    ensure_indexes(engine)
+    if fulltext.ensure_book_fts(engine):
+        logger.info("Book full-text search enabled")
+    db = SessionLocal()
+    try:
+        versioning.ensure_table_versions(db)
+        loan_stats.ensure_loan_stats(db, record_dimensions=Loan.__tablename__ in altered_tables)
+        book_availability.repair_book_availability(db)
+        job_queue.fail_abandoned_jobs(db)
+    finally:
+        db.close()
     logger.info("Initializing default categories")
     initialize_default_categories()
+    db = SessionLocal()
+    try:
+        suggest.build_index(db)
+    finally:
+        db.close()
+    cache.start_invalidation_listener()
     logger.info("Application startup complete")
     
     yield
     
     # Shutdown
+    await job_queue.shutdown()
+    import_pool.shutdown()
+    cache.stop_invalidation_listener()
+    if replicas is not None:
+        await replicas.dispose()
+    if async_read_engine is not None and async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
     logger.info("Application shutting down...")
 
 
@@ -100,13 +156,26 @@ def create_app() -> FastAPI:
         allow_origins=settings.cors_origins,
         allow_credentials=True,
         allow_methods=["GET", "POST", "PATCH", "DELETE"],
-        allow_headers=["Content-Type", "Authorization"],
+        allow_headers=["Content-Type", "Authorization", "If-None-Match", "X-Last-Write"],
+        expose_headers=["ETag", "X-Last-Write"],
     )
 
+    if replicas is not None:
+        app.add_middleware(PrimaryRetryMiddleware)
+
+        @app.middleware("http")
+        async def read_your_writes(request: Request, call_next):
+            """Pin a client's reads to the primary for a short window after it writes."""
+            response = await call_next(request)
+            if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+                remember_write(response)
+            return response
+
     # Exception handlers
     app.add_exception_handler(LibraryException, library_exception_handler)
     app.add_exception_handler(RequestValidationError, validation_exception_handler)
     app.add_exception_handler(IntegrityError, integrity_exception_handler)
+    app.add_exception_handler(PoolTimeoutError, pool_timeout_exception_handler)
     app.add_exception_handler(SQLAlchemyError, database_exception_handler)
     app.add_exception_handler(Exception, general_exception_handler)
 
@@ -115,6 +184,8 @@ def create_app() -> FastAPI:
     app.include_router(books.router, prefix=settings.api_prefix)
     app.include_router(students.router, prefix=settings.api_prefix)
     app.include_router(loans.router, prefix=settings.api_prefix)
+    app.include_router(jobs.router, prefix=settings.api_prefix)
+    app.include_router(reports.router, prefix=settings.api_prefix)
 
     @app.get("/", tags=["health"], summary="Health check")
     async def health_check() -> dict[str, str]:
@@ -140,7 +211,7 @@ def create_app() -> FastAPI:
             Detailed health information.
         """
         from datetime import datetime
-        from .cache import get_redis_client
+        from .cache import get_cache_stats, get_redis_client
         
         health = {
             "status": "healthy",
@@ -152,7 +223,7 @@ def create_app() -> FastAPI:
         
         # Check database
         try:
-            db = SessionLocal()
+            db = ReadSessionLocal()
             db.execute(select(1))
             db.close()
             health["services"]["database"] = "operational"
@@ -160,6 +231,9 @@ def create_app() -> FastAPI:
             health["services"]["database"] = f"error: {str(e)}"
             health["status"] = "degraded"
         
+        if replicas is not None:
+            health["replicas"] = replicas.status()
+
         # Check Redis
         try:
             redis = get_redis_client()
@@ -171,6 +245,7 @@ def create_app() -> FastAPI:
         except Exception as e:
             health["services"]["redis"] = f"error: {str(e)}"
         
+        health["cache"] = get_cache_stats()
         return health
 
     logger.info("FastAPI application created and configured")
@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String
+from sqlalchemy import JSON, Boolean, DateTime, ForeignKey, Index, Integer, String, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql.expression import null
 
@@ -21,6 +21,14 @@ DEFAULT_CATEGORIES = [
 # Tehran timezone (UTC+3:30)
 TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
 
+
+def as_tehran_time(value: datetime | None) -> datetime | None:
+    """Return a stored timestamp in Tehran time; SQLite returns them without an offset."""
+    if value is None:
+        return None
+    return value.replace(tzinfo=TEHRAN_TZ) if value.tzinfo is None else value.astimezone(TEHRAN_TZ)
+
+
 class Category(Base):
     """Represents a book category."""
 
@@ -45,6 +53,10 @@ class Book(Base):
 
     __tablename__ = "books"
     __table_args__ = (
+        # Serves the lookup of the titles a bulk import already holds in a category
+        Index("ix_books_category_name", "category_id", "name"),
+        # Serves the available books in name order: a range scan over the books with no open loan
+        Index("ix_books_active_loan_name", "active_loan_id", "name"),
         {"comment": "Books available in the library"},
     )
 
@@ -56,10 +68,17 @@ class Book(Base):
         nullable=True,
         index=True,  # Added index for filtering
     )
+    # Open loan of the book, None while it is on the shelf; kept in step by checkouts and returns
+    active_loan_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     category: Mapped[Category | None] = relationship("Category", back_populates="books")
     loans: Mapped[list[Loan]] = relationship("Loan", back_populates="book", cascade="all, delete-orphan")
 
+    @property
+    def available(self) -> bool:
+        """Return whether the book is on the shelf."""
+        return self.active_loan_id is None
+
     def __repr__(self) -> str:
         return f"Book(id={self.id!r}, name={self.name!r})"
 
@@ -78,7 +97,7 @@ class Student(Base):
     grade: Mapped[str | None] = mapped_column(String(30), nullable=True, index=True)
     major: Mapped[str | None] = mapped_column(String(60), nullable=True, index=True)
     national_id: Mapped[str | None] = mapped_column(String(20), nullable=True, index=True)
-    phone_number = Mapped[str | None] = mapped_column(String(15), nullable=True)
+    phone_number: Mapped[str | None] = mapped_column(String(15), nullable=True)
     registered_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         nullable=False,
@@ -102,6 +121,16 @@ class Loan(Base):
 
     __tablename__ = "loans"
     __table_args__ = (
+        # At most one open loan per book, so concurrent checkouts cannot both succeed
+        Index(
+            "uq_loans_active_book",
+            "book_id",
+            unique=True,
+            sqlite_where=text("NOT returned"),
+            postgresql_where=text("NOT returned"),
+        ),
+        # Serves the overdue queries: open loans by due date
+        Index("ix_loans_returned_due_date", "returned", "due_date"),
         {"comment": "Loan records tracking book borrowing by students"},
     )
 
@@ -136,6 +165,10 @@ class Loan(Base):
         default=False,
         index=True,  # Added index for filtering active/returned loans
     )
+    # Student's grade and major and book's category at checkout, which the loan is counted under in loan_stats
+    student_grade: Mapped[str | None] = mapped_column(String(30), nullable=True)
+    student_major: Mapped[str | None] = mapped_column(String(60), nullable=True)
+    book_category_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     book: Mapped[Book] = relationship("Book", back_populates="loans")
     student: Mapped[Student] = relationship("Student", back_populates="loans")
@@ -145,3 +178,65 @@ class Loan(Base):
             f"Loan(id={self.id!r}, book_id={self.book_id!r}, "
             f"student_id={self.student_id!r}, returned={self.returned!r})"
         )
+
+
+class TableVersion(Base):
+    """Change counter per table, bumped on every flush that writes to the table."""
+
+    __tablename__ = "table_versions"
+    __table_args__ = (
+        {"comment": "Per-table change counters used for conditional GET"},
+    )
+
+    table_name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"TableVersion(table_name={self.table_name!r}, version={self.version!r})"
+
+
+class LoanStat(Base):
+    """Running loan counters for one value of a report dimension, such as a grade or a month."""
+
+    __tablename__ = "loan_stats"
+    __table_args__ = (
+        Index("ix_loan_stats_dimension_loans", "dimension", "loans"),
+        {"comment": "Loan statistics rolled up by grade, major, category, month and book"},
+    )
+
+    dimension: Mapped[str] = mapped_column(String(20), primary_key=True)
+    key: Mapped[str] = mapped_column(String(150), primary_key=True)
+    loans: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    returned: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    duration_days: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    delay_days: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"LoanStat(dimension={self.dimension!r}, key={self.key!r}, loans={self.loans!r})"
+
+
+class ImportJob(Base):
+    """Progress and outcome of an import running in the background."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        {"comment": "Background import jobs and their progress"},
+    )
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(30), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, index=True)
+    file_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    rows_processed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total_created: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total_skipped: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    errors: Mapped[list[str]] = mapped_column(JSON, nullable=False, default=list)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(TEHRAN_TZ),
+    )
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self) -> str:
+        return f"ImportJob(id={self.id!r}, kind={self.kind!r}, status={self.status!r})"
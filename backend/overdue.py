@@ -0,0 +1,72 @@
+"""Overdue loan queries, answered from the (returned, due_date) index."""
+from __future__ import annotations
+
+import math
+from datetime import datetime
+
+from sqlalchemy import ColumnElement, Select, and_, false, func, select
+
+from .config import settings
+from .models import Book, Loan, Student, as_tehran_time
+
+
+def _open_loans() -> ColumnElement[bool]:
+    # Compared with "=" rather than IS, which PostgreSQL cannot match against an index
+    return Loan.returned == false()
+
+
+def overdue_condition(now: datetime) -> ColumnElement[bool]:
+    """Return the criteria of the open loans past their due date at ``now``."""
+    return and_(_open_loans(), Loan.due_date < now)
+
+
+def overdue_loans_statement(now: datetime) -> Select:
+    """Return the open loans past their due date at ``now`` with their book and student names, oldest due first."""
+    return (
+        select(
+            Loan.id,
+            Loan.book_id,
+            Book.name,
+            Loan.student_id,
+            Student.first_name,
+            Student.last_name,
+            Loan.due_date,
+        )
+        .join(Book, Loan.book_id == Book.id)
+        .join(Student, Loan.student_id == Student.id)
+        .where(overdue_condition(now))
+        .order_by(Loan.due_date.asc(), Loan.id.asc())
+    )
+
+
+def overdue_student_ids_statement(now: datetime) -> Select:
+    """Return the ids of the students holding an overdue loan at ``now``."""
+    return (
+        select(Loan.student_id)
+        .where(overdue_condition(now))
+        .distinct()
+        .order_by(Loan.student_id.asc())
+    )
+
+
+def next_due_date_statement(now: datetime) -> Select:
+    """Return the earliest due date of an open loan that is not overdue yet at ``now``."""
+    return select(func.min(Loan.due_date)).where(_open_loans(), Loan.due_date >= now)
+
+
+def days_overdue(due_date: datetime, now: datetime) -> int:
+    """Return the whole days a loan due at ``due_date`` is late at ``now``."""
+    return max(0, (now - as_tehran_time(due_date)).days)
+
+
+def seconds_until(boundary: datetime | None, now: datetime) -> int:
+    """
+    Return how long a result computed at ``now`` stays valid, given the next due date.
+
+    Capped at the cache TTL, so results are recomputed at least that often
+    even when no loan comes due.
+    """
+    if boundary is None:
+        return settings.cache_ttl
+    remaining = math.ceil((as_tehran_time(boundary) - now).total_seconds())
+    return max(1, min(remaining, settings.cache_ttl))
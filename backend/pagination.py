@@ -0,0 +1,122 @@
+"""Keyset (cursor) pagination helpers for list endpoints."""
+from __future__ import annotations
+
+import base64
+import json
+from collections.abc import Callable
+from typing import Any
+
+from fastapi import HTTPException, Query, status
+
+from .config import settings
+
+
+class PageParams:
+    """
+    FastAPI dependency holding the cursor and page size of a list request.
+
+    The cursor is an opaque token produced by ``encode_cursor`` from the sort
+    key of the last row of the previous page.
+    """
+
+    def __init__(
+        self,
+        cursor: str | None = Query(default=None, description="Opaque cursor returned as next_cursor"),
+        limit: int = Query(
+            default=settings.default_page_size,
+            ge=1,
+            le=settings.max_page_size,
+            description="Maximum number of items to return",
+        ),
+    ):
+        self.cursor = cursor
+        self.limit = limit
+
+    def decode(self, size: int) -> list[Any] | None:
+        """
+        Return the decoded sort key of the cursor, or None for the first page.
+
+        Args:
+            size: Number of values the endpoint's sort key is made of
+
+        Raises:
+            HTTPException: 400 if the cursor does not hold ``size`` values.
+        """
+        if not self.cursor:
+            return None
+        values = decode_cursor(self.cursor)
+        if len(values) != size:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        return values
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode the sort key values of a row into an opaque URL-safe cursor."""
+    raw = json.dumps(list(values), separators=(",", ":"), ensure_ascii=False, default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    """
+    Decode a cursor produced by ``encode_cursor``.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+    if not isinstance(values, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
+
+
+def parse_cursor(values: list[Any], *converters: Callable[[Any], Any]) -> list[Any]:
+    """
+    Convert the decoded values of a cursor to the types of their sort key columns.
+
+    Args:
+        values: Values returned by ``PageParams.decode``
+        converters: One converter per value, such as ``int`` or ``cursor_text``
+
+    Raises:
+        HTTPException: 400 if a value does not convert, so a tampered cursor
+            never reaches the keyset comparison.
+    """
+    try:
+        return [convert(value) for convert, value in zip(converters, values, strict=True)]
+    except (TypeError, ValueError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+
+
+def cursor_text(value: Any) -> str:
+    """Cursor converter for text sort keys, which are encoded as strings."""
+    if not isinstance(value, str):
+        raise TypeError(f"Expected a string, got {type(value).__name__}")
+    return value
+
+
+def cursor_number(value: Any) -> float:
+    """Cursor converter for numeric sort keys, such as a search rank."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"Expected a number, got {type(value).__name__}")
+    return float(value)
+
+
+def cursor_id(value: Any) -> int:
+    """Cursor converter for integer ids."""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(f"Expected an integer, got {type(value).__name__}")
+    return value
+
+
+def split_page(rows: list[Any], limit: int) -> tuple[list[Any], bool]:
+    """
+    Trim a result fetched with ``limit + 1`` rows.
+
+    Returns:
+        The rows of the current page and whether another page follows.
+    """
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,105 @@
+"""Pre-serialized JSON responses for hot read endpoints."""
+from __future__ import annotations
+
+import hashlib
+from collections.abc import AsyncIterator, Sequence
+from typing import Any
+
+import orjson
+from fastapi import Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dump_json(data: Any) -> bytes:
+    """Serialize schema instances, or plain data containing them, to JSON bytes with orjson."""
+    return orjson.dumps(data, default=_default)
+
+
+def json_bytes_response(body: bytes, status_code: int = 200, headers: dict[str, str] | None = None) -> Response:
+    """
+    Wrap an already serialized JSON body in a response.
+
+    FastAPI skips response_model validation for returned Response objects, so
+    the body is sent exactly as produced or cached.
+    """
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+def make_etag(body: bytes) -> str:
+    """Return a strong ETag derived from the response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check whether the request's If-None-Match header matches an ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def validator_headers(etag: str, vary: str | None = None) -> dict[str, str]:
+    """
+    Return the caching headers sent with an ETag.
+
+    ``Cache-Control: no-cache`` makes browsers revalidate on every use
+    instead of serving a stale copy. ``vary`` names the request headers
+    that select the representation, such as ``Accept``.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if vary:
+        headers["Vary"] = vary
+    return headers
+
+
+def not_modified_response(etag: str, vary: str | None = None) -> Response:
+    """Return an empty ``304 Not Modified`` response for an ETag."""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(etag, vary))
+
+
+def conditional_json_response(request: Request, body: bytes, etag: str | None = None) -> Response:
+    """Answer with ``304 Not Modified`` if the client already holds ``body``, else return it with its ETag."""
+    etag = etag or make_etag(body)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    return json_bytes_response(body, headers=validator_headers(etag))
+
+
+def list_media_type(ndjson: bool) -> str:
+    """Return the media type of a list response, for the representation part of its ETag."""
+    return NDJSON_MEDIA_TYPE if ndjson else "application/json"
+
+
+def wants_ndjson(request: Request, stream: bool = False) -> bool:
+    """Check whether a list should be streamed as NDJSON, via ``stream=true`` or the Accept header."""
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(
+    partitions: AsyncIterator[Sequence[Any]],
+    schema: type[BaseModel],
+    headers: dict[str, str] | None = None,
+) -> StreamingResponse:
+    """
+    Stream query rows as NDJSON, one ``schema`` object per line.
+
+    The first column of each row is validated into ``schema``, and each
+    partition is written as soon as it is serialized, so the client can
+    start reading before the query is exhausted.
+    """
+
+    async def body() -> AsyncIterator[bytes]:
+        async for rows in partitions:
+            yield b"".join(dump_json(schema.model_validate(row[0], from_attributes=True)) + b"\n" for row in rows)
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
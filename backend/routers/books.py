@@ -2,104 +2,260 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Iterable
-
-from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
-from sqlalchemy import select
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, selectinload
-
-from .. import cache
-from ..database import get_db
-from ..excel_utils import read_excel_sheets, validate_book_sheet_data
-from ..models import Book, Category
-from ..schemas import BookCreate, BookRead, BookUpdate, CategoryCreate, CategoryRead, CategoryUpdate
+import os
+from collections.abc import AsyncIterator
+from typing import Any, Iterable, Literal
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from sqlalchemy import Select, and_, or_, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from .. import book_availability, bulk, cache, fulltext, import_pool, loan_stats, suggest, text_import, versioning
+from ..config import settings
+from ..database import get_db, get_read_db, stream_read_partitions
+from ..excel_utils import BOOK_CATEGORY_COLUMNS, BOOK_FIELDS, SheetChunk, book_row_validator, chunked
+from ..models import Book, Category, Loan
+from ..pagination import (
+    PageParams,
+    cursor_id,
+    cursor_number,
+    cursor_text,
+    encode_cursor,
+    parse_cursor,
+    split_page,
+)
+from ..responses import (
+    conditional_json_response,
+    dump_json,
+    etag_matches,
+    json_bytes_response,
+    list_media_type,
+    ndjson_response,
+    not_modified_response,
+    validator_headers,
+    wants_ndjson,
+)
+from ..schemas import (
+    BookCreate,
+    BookRead,
+    BookUpdate,
+    CategoryCreate,
+    CategoryRead,
+    CategoryUpdate,
+    Page,
+    SuggestionRead,
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/books", tags=["books"])
 
 
-def _serialize_books(books: Iterable[Book]) -> list[dict[str, object]]:
-    """Convert SQLAlchemy book instances to serializable dicts."""
-    return [BookRead.model_validate(book, from_attributes=True).model_dump() for book in books]
+def _serialize_books(books: Iterable[Book]) -> list[BookRead]:
+    """Convert SQLAlchemy book instances to response schemas."""
+    return [BookRead.model_validate(book, from_attributes=True) for book in books]
 
 
 @router.post("/", response_model=BookRead, status_code=status.HTTP_201_CREATED)
-def create_book(payload: BookCreate, db: Session = Depends(get_db)) -> BookRead:
+async def create_book(payload: BookCreate, db: AsyncSession = Depends(get_db)) -> BookRead:
     """Create a new book entry."""
     book = Book(**payload.model_dump())
     db.add(book)
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError as exc:
-        db.rollback()
+        await db.rollback()
         logger.error("Failed to create book due to integrity error: %s", exc)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Book could not be created")
-    db.refresh(book)
-    cache.invalidate_book_search_cache()
+    book = await _load_book_with_category(book.id, db)
+    await run_in_threadpool(cache.invalidate_book_search_cache)
+    await run_in_threadpool(suggest.index_book, book.id, book.name)
     return BookRead.model_validate(book, from_attributes=True)
 
 
-@router.get("/", response_model=list[BookRead])
-def list_books(
+@router.get("/", response_model=Page[BookRead])
+async def list_books(
+    request: Request,
     search: str | None = Query(default=None, description="Optional search term for book name"),
-    db: Session = Depends(get_db),
-) -> list[BookRead]:
-    """Return books optionally filtered by name with Redis cache support."""
-    if search:
-        normalized = search.strip().lower()
-        if normalized:
-            cache_key = cache.build_book_search_key(normalized)
-            cached = cache.get_cached_value(cache_key)
-            if cached is not None:
-                return [BookRead.model_validate(item) for item in cached]
-
-            statement = (
-                select(Book)
-                .options(selectinload(Book.category))
-                .where(Book.name.ilike(f"%{normalized}%"))
-                .order_by(Book.name.asc())
-            )
-            books = db.execute(statement).scalars().all()
-            serialized = _serialize_books(books)
-            cache.set_cached_value(cache_key, serialized)
-            return [BookRead.model_validate(item) for item in serialized]
+    available: bool | None = Query(default=None, description="Only books on the shelf (true) or on loan (false)"),
+    page: PageParams = Depends(),
+    stream: bool = Query(default=False, description="Stream every matching book as NDJSON instead of a page"),
+    db: AsyncSession = Depends(get_read_db),
+) -> Response:
+    """
+    Return a page of books, optionally filtered by name, with Redis cache support.
+
+    Searches use the FTS5 index ranked by BM25 when available and fall back
+    to a substring match ordered by name otherwise. ``available`` filters on
+    the availability kept on each book, an index range scan rather than a
+    lookup of open loans. The page is serialized
+    once and search results are cached as the final response body. The
+    ETag follows the books and categories change counters, so a matching
+    If-None-Match is answered with 304 before any query runs.
+
+    With ``stream=true`` or ``Accept: application/x-ndjson``, every book
+    from the cursor on is streamed as one JSON line, bypassing the cache.
+    """
+    versions = await versioning.get_table_versions(db, Book, Category)
+    ndjson = wants_ndjson(request, stream)
+    etag = versioning.etag_for_versions(request, versions, list_media_type(ndjson))
+    if etag_matches(request, etag):
+        return not_modified_response(etag, vary="Accept")
+
+    normalized = search.strip().lower() if search else ""
+    match_query = fulltext.build_match_query(normalized) if normalized and fulltext.fts_enabled() else None
+    after = page.decode(2)
+    if after is not None:
+        # Ranked searches page by (rank, id), the others by (name, id)
+        after = parse_cursor(after, cursor_number if match_query is not None else cursor_text, cursor_id)
+
+    if ndjson:
+        if match_query is not None:
+            statement = _books_fulltext_statement(match_query, available, after)
+        else:
+            statement = _books_by_name_statement(normalized, available, after)
+        partitions = stream_read_partitions(request, statement, settings.stream_batch_size)
+        return ndjson_response(partitions, BookRead, headers=validator_headers(etag, vary="Accept"))
+
+    async def render() -> bytes:
+        if match_query is not None:
+            return dump_json(await _search_books_fulltext(match_query, available, after, page.limit, db))
+        return dump_json(await _list_books_by_name(normalized, available, after, page.limit, db))
+
+    if not normalized:
+        return json_bytes_response(await render(), headers=validator_headers(etag, vary="Accept"))
+
+    cache_key = await run_in_threadpool(
+        cache.build_book_search_key,
+        normalized,
+        page.cursor,
+        page.limit,
+        versioning.snapshot_token(versions),
+        available,
+    )
+    body, is_stale = await cache.get_or_compute_with_status(cache_key, render, raw=True)
+    # A stale body predates the current counters, so it must not carry their ETag.
+    # The body varies with Accept even without an ETag
+    headers = {"Vary": "Accept"} if is_stale else validator_headers(etag, vary="Accept")
+    return json_bytes_response(body, headers=headers)
+
+
+def _books_fulltext_statement(match_query: str, available: bool | None, after: list | None) -> Select:
+    """Return the books matching an FTS5 query with their rank, ordered by BM25 rank."""
+    hits = fulltext.book_hits(match_query)
+    statement = (
+        select(Book, hits.c.rank)
+        .join(hits, hits.c.book_id == Book.id)
+        .options(selectinload(Book.category))
+        .order_by(hits.c.rank.asc(), Book.id.asc())
+    )
+    if available is not None:
+        statement = statement.where(book_availability.available_condition(available))
+    if after is not None:
+        last_rank, last_id = after
+        statement = fulltext.after_hit(statement, hits, last_rank, last_id)
+    return statement
+
+
+async def _search_books_fulltext(
+    match_query: str, available: bool | None, after: list | None, limit: int, db: AsyncSession
+) -> Page[BookRead]:
+    """Return a page of books matching an FTS5 query, ordered by BM25 rank."""
+    statement = _books_fulltext_statement(match_query, available, after).limit(limit + 1)
+    rows, has_more = split_page((await db.execute(statement)).all(), limit)
+    return Page[BookRead](
+        items=_serialize_books(book for book, _ in rows),
+        next_cursor=encode_cursor(rows[-1].rank, rows[-1].Book.id) if has_more else None,
+    )
+
+
+def _books_by_name_statement(term: str, available: bool | None, after: list | None) -> Select:
+    """Return the books ordered by name, optionally filtered with a substring match and by availability."""
+    statement = select(Book).options(selectinload(Book.category)).order_by(Book.name.asc(), Book.id.asc())
+    if term:
+        statement = statement.where(Book.name.ilike(f"%{term}%"))
+    if available is not None:
+        statement = statement.where(book_availability.available_condition(available))
+    if after is not None:
+        last_name, last_id = after
+        statement = statement.where(
+            or_(Book.name > last_name, and_(Book.name == last_name, Book.id > last_id))
+        )
+    return statement
+
+
+async def _list_books_by_name(
+    term: str, available: bool | None, after: list | None, limit: int, db: AsyncSession
+) -> Page[BookRead]:
+    """Return a page of books ordered by name, optionally filtered with a substring match and by availability."""
+    statement = _books_by_name_statement(term, available, after).limit(limit + 1)
+    books, has_more = split_page((await db.execute(statement)).scalars().all(), limit)
+    return Page[BookRead](
+        items=_serialize_books(books),
+        next_cursor=encode_cursor(books[-1].name, books[-1].id) if has_more else None,
+    )
 
-    statement = select(Book).options(selectinload(Book.category)).order_by(Book.name.asc())
-    books = db.execute(statement).scalars().all()
-    return [BookRead.model_validate(book, from_attributes=True) for book in books]
+
+@router.get("/suggest", response_model=list[SuggestionRead])
+async def suggest_names(
+    prefix: str = Query(..., min_length=1, description="Typed prefix of a book title or student name"),
+    limit: int = Query(default=10, ge=1, le=50, description="Maximum number of suggestions"),
+    kind: Literal["book", "student"] | None = Query(default=None, description="Only suggest this kind"),
+) -> list[SuggestionRead]:
+    """Return book titles and student names starting with a prefix, served from memory."""
+    return [
+        SuggestionRead(kind=entry_kind, id=entry_id, label=label)
+        for entry_kind, entry_id, label in suggest.suggestion_index.search(prefix, limit, kind)
+    ]
 
 
 # Category endpoints (must be before /{book_id} to avoid path conflicts)
 @router.post("/categories", response_model=CategoryRead, status_code=status.HTTP_201_CREATED)
-def create_category(payload: CategoryCreate, db: Session = Depends(get_db)) -> CategoryRead:
+async def create_category(payload: CategoryCreate, db: AsyncSession = Depends(get_db)) -> CategoryRead:
     """Create a new category."""
     category = Category(**payload.model_dump())
     db.add(category)
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError as exc:
-        db.rollback()
+        await db.rollback()
         logger.error("Failed to create category due to integrity error: %s", exc)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Category name must be unique")
-    db.refresh(category)
+    await db.refresh(category)
+    await run_in_threadpool(cache.invalidate_category_list_cache)
     return CategoryRead.model_validate(category, from_attributes=True)
 
 
 @router.get("/categories", response_model=list[CategoryRead])
-def list_categories(db: Session = Depends(get_db)) -> list[CategoryRead]:
-    """Return all categories."""
-    statement = select(Category).order_by(Category.name.asc())
-    categories = db.execute(statement).scalars().all()
-    return [CategoryRead.model_validate(category, from_attributes=True) for category in categories]
+async def list_categories(request: Request, db: AsyncSession = Depends(get_db)) -> Response:
+    """
+    Return all categories, served from cache and answering If-None-Match with 304.
+
+    The cache is filled from the primary so that replica lag cannot be
+    cached; sessions connect lazily, so cache hits never touch the database.
+    """
+
+    async def render() -> bytes:
+        statement = select(Category).order_by(Category.name.asc())
+        categories = (await db.execute(statement)).scalars().all()
+        return dump_json([CategoryRead.model_validate(category, from_attributes=True) for category in categories])
+
+    cache_key = await run_in_threadpool(cache.build_category_list_key)
+    body = await cache.get_or_compute(cache_key, render, raw=True)
+    return conditional_json_response(request, body)
 
 
 @router.patch("/categories/{category_id}", response_model=CategoryRead)
-def update_category(category_id: int, payload: CategoryUpdate, db: Session = Depends(get_db)) -> CategoryRead:
+async def update_category(
+    category_id: int, payload: CategoryUpdate, db: AsyncSession = Depends(get_db)
+) -> CategoryRead:
     """Update an existing category."""
     statement = select(Category).where(Category.id == category_id)
-    category = db.execute(statement).scalar_one_or_none()
+    category = (await db.execute(statement)).scalar_one_or_none()
     if category is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
 
@@ -107,47 +263,51 @@ def update_category(category_id: int, payload: CategoryUpdate, db: Session = Dep
         setattr(category, field, value)
 
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError as exc:
-        db.rollback()
+        await db.rollback()
         logger.error("Failed to update category due to integrity error: %s", exc)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Category name must be unique")
-    db.refresh(category)
+    await db.refresh(category)
+    await run_in_threadpool(cache.invalidate_category_list_cache)
+    await run_in_threadpool(cache.invalidate_book_search_cache)
     return CategoryRead.model_validate(category, from_attributes=True)
 
 
 @router.delete("/categories/{category_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_category(category_id: int, db: Session = Depends(get_db)) -> None:
+async def delete_category(category_id: int, db: AsyncSession = Depends(get_db)) -> None:
     """Delete a category and detach related books."""
-    statement = select(Category).where(Category.id == category_id)
-    category = db.execute(statement).scalar_one_or_none()
+    statement = select(Category).options(selectinload(Category.books)).where(Category.id == category_id)
+    category = (await db.execute(statement)).scalar_one_or_none()
     if category is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
 
-    db.delete(category)
-    db.commit()
+    book_ids = [book.id for book in category.books]
+    # The category's books and their loans are deleted with it
+    await loan_stats.record_removals(db, Book.category_id == category_id)
+    await db.delete(category)
+    await db.commit()
+    await run_in_threadpool(cache.invalidate_category_list_cache)
+    if book_ids:
+        await run_in_threadpool(cache.invalidate_book_search_cache)
+        await run_in_threadpool(suggest.remove_books, book_ids)
 
 
 # Book endpoints with path parameters
 @router.get("/{book_id}", response_model=BookRead)
-def get_book(book_id: int, db: Session = Depends(get_db)) -> BookRead:
+async def get_book(book_id: int, db: AsyncSession = Depends(get_read_db)) -> BookRead:
     """Retrieve a book by its identifier."""
-    statement = (
-        select(Book)
-        .options(selectinload(Book.category))
-        .where(Book.id == book_id)
-    )
-    book = db.execute(statement).scalar_one_or_none()
+    book = await _load_book_with_category(book_id, db)
     if book is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
     return BookRead.model_validate(book, from_attributes=True)
 
 
 @router.patch("/{book_id}", response_model=BookRead)
-def update_book(book_id: int, payload: BookUpdate, db: Session = Depends(get_db)) -> BookRead:
+async def update_book(book_id: int, payload: BookUpdate, db: AsyncSession = Depends(get_db)) -> BookRead:
     """Update an existing book entry."""
     statement = select(Book).where(Book.id == book_id)
-    book = db.execute(statement).scalar_one_or_none()
+    book = (await db.execute(statement)).scalar_one_or_none()
     if book is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
 
@@ -155,33 +315,38 @@ def update_book(book_id: int, payload: BookUpdate, db: Session = Depends(get_db)
         setattr(book, field, value)
 
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError as exc:
-        db.rollback()
+        await db.rollback()
         logger.error("Failed to update book due to integrity error: %s", exc)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Book could not be updated")
-    db.refresh(book)
-    cache.invalidate_book_search_cache()
+    book = await _load_book_with_category(book_id, db)
+    await run_in_threadpool(cache.invalidate_book_search_cache)
+    await run_in_threadpool(suggest.index_book, book.id, book.name)
     return BookRead.model_validate(book, from_attributes=True)
 
 
 @router.delete("/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_book(book_id: int, db: Session = Depends(get_db)) -> None:
+async def delete_book(book_id: int, db: AsyncSession = Depends(get_db)) -> None:
     """Delete a book by its identifier."""
     statement = select(Book).where(Book.id == book_id)
-    book = db.execute(statement).scalar_one_or_none()
+    book = (await db.execute(statement)).scalar_one_or_none()
     if book is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
 
-    db.delete(book)
-    db.commit()
-    cache.invalidate_book_search_cache()
+    # The book's loans are deleted with it
+    await loan_stats.record_removals(db, Loan.book_id == book_id)
+    await db.delete(book)
+    await db.commit()
+    await run_in_threadpool(cache.invalidate_book_search_cache)
+    await run_in_threadpool(suggest.remove_book, book_id)
 
 
 @router.post("/upload-excel", status_code=status.HTTP_201_CREATED)
 async def upload_books_excel(
+    response: Response,
     file: UploadFile = File(..., description="Excel file with books data"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> dict[str, Any]:
     """
     Upload Excel file to bulk import books.
@@ -200,92 +365,179 @@ async def upload_books_excel(
             detail="فایل باید از نوع اکسل (.xlsx یا .xls) باشد"
         )
     
+    # Worker processes parse the sheets from a copy of the upload on disk.
+    path = await run_in_threadpool(import_pool.save_upload, file.file)
+    chunks = import_pool.iter_sheet_chunks(path, book_row_validator, BOOK_FIELDS, settings.import_chunk_size)
     try:
-        content = await file.read()
-        sheets_data = read_excel_sheets(content)
-    except ValueError as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception as e:
-        logger.error(f"Failed to read Excel file: {e}", exc_info=True)
+        return await _import_books(db, chunks, response)
+    finally:
+        await chunks.aclose()
+        os.remove(path)
+
+
+@router.post("/import", status_code=status.HTTP_201_CREATED)
+async def import_books(
+    request: Request,
+    response: Response,
+    category: str | None = Query(default=None, description="Category of records without a category column"),
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, Any]:
+    """
+    Bulk import books from a CSV (text/csv) or NDJSON (application/x-ndjson) body.
+    
+    Columns are matched by the same names as in Excel files. Each record's
+    category comes from a 'دسته‌بندی' column, or the ``category`` parameter
+    when the column is missing or empty. The body is spooled to disk and
+    parsed record by record, which is far faster than parsing a workbook.
+    
+    Returns:
+        Summary of import operation including counts and any errors
+    """
+    media_type = text_import.media_type_of(request)
+    if media_type is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"خطا در خواندن فایل: {str(e)}"
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="نوع محتوا باید text/csv یا application/x-ndjson باشد"
         )
     
+    path = await text_import.save_body(request)
+    records = text_import.iter_record_chunks(
+        path, media_type, book_row_validator, BOOK_CATEGORY_COLUMNS, category, settings.import_chunk_size
+    )
+    try:
+        return await _import_books(db, iterate_in_threadpool(records), response)
+    finally:
+        records.close()
+        os.remove(path)
+
+
+async def _import_books(
+    db: AsyncSession, chunks: AsyncIterator[SheetChunk], response: Response
+) -> dict[str, Any]:
+    """
+    Insert the books of validated chunks, one category per sheet name.
+
+    Each chunk is committed on its own, so the single writer connection is
+    released while the next chunk is parsed and other writes can go in
+    between. If a malformed record or a database error stops the import
+    after some chunks were committed, those chunks stay imported and the
+    response is ``207 Multi-Status`` with their counts and the error;
+    re-importing the file skips them as duplicates.
+    
+    Returns:
+        Summary of import operation including counts and any errors
+    """
     total_created = 0
     total_skipped = 0
     errors = []
-    categories_created = []
+    categories_created: list[str] = []
+    created: list[tuple[int, str]] = []
+    # Whether a chunk was committed, and whether an error then stopped the import
+    committed = False
+    stopped = False
     
-    # Get or create categories based on sheet names
+    # Category ids by sheet name, resolved once per sheet
     category_map: dict[str, int] = {}
     
-    for sheet_name, sheet_rows in sheets_data.items():
-        if not sheet_rows:
-            continue
-        
-        # Find or create category
-        statement = select(Category).where(Category.name == sheet_name)
-        category = db.execute(statement).scalar_one_or_none()
-        
-        if category is None:
-            category = Category(name=sheet_name, description=f"دسته‌بندی {sheet_name}")
-            db.add(category)
-            try:
-                db.flush()
-                categories_created.append(sheet_name)
-                logger.info(f"Created category: {sheet_name}")
-            except IntegrityError:
-                db.rollback()
-                # Try to fetch again in case of race condition
-                statement = select(Category).where(Category.name == sheet_name)
-                category = db.execute(statement).scalar_one_or_none()
-                if category is None:
-                    errors.append(f"خطا در ایجاد دسته‌بندی '{sheet_name}'")
-                    continue
-        
-        category_map[sheet_name] = category.id
-        
-        # Validate and import books
-        try:
-            validated_books = validate_book_sheet_data(sheet_rows)
-        except ValueError as e:
-            errors.append(f"شیت '{sheet_name}': {str(e)}")
-            continue
-        
-        for book_data in validated_books:
-            book_name = book_data["name"]
+    try:
+        async for chunk in chunks:
+            if chunk.error:
+                errors.append(chunk.error)
+                continue
             
-            # Check if book already exists
-            existing_statement = select(Book).where(
-                Book.name == book_name,
-                Book.category_id == category.id
-            )
-            existing = db.execute(existing_statement).scalar_one_or_none()
+            sheet_name = chunk.sheet_name
+            if sheet_name not in category_map:
+                ids, new_categories = await _ensure_categories(db, {sheet_name})
+                category_map.update(ids)
+                categories_created.extend(new_categories)
+            category_id = category_map[sheet_name]
             
-            if existing:
-                total_skipped += 1
-                continue
+            # Dedupe within the chunk, then against the database, which also
+            # holds the books inserted from earlier chunks of this upload
+            names = list(dict.fromkeys(book["name"] for book in chunk.rows))
+            existing = await _existing_book_names(db, category_id, names)
+            rows = [{"name": name, "category_id": category_id} for name in names if name not in existing]
+            inserted = await bulk.insert_rows(db, Book.__table__, rows, returning=(Book.id, Book.name))
+            if inserted:
+                await db.execute(versioning.table_versions_bump(Book.__tablename__))
+            await db.commit()
+            committed = True
             
-            book = Book(name=book_name, category_id=category.id)
-            db.add(book)
-            total_created += 1
-    
-    try:
-        db.commit()
-        cache.invalidate_book_search_cache()
-    except Exception as e:
-        db.rollback()
+            total_created += len(inserted)
+            total_skipped += len(chunk.rows) - len(inserted)
+            created.extend((book_id, book_name) for book_id, book_name in inserted)
+    except ValueError as e:
+        await db.rollback()
+        if not committed:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        errors.append(str(e))
+        stopped = True
+    except PoolTimeoutError:
+        # Left to the application handler, which answers 503 with Retry-After
+        raise
+    except SQLAlchemyError as e:
+        await db.rollback()
         logger.error(f"Failed to commit books: {e}", exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"خطا در ذخیره‌سازی: {str(e)}"
-        )
+        if not committed:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"خطا در ذخیره‌سازی: {str(e)}"
+            )
+        errors.append(f"خطا در ذخیره‌سازی: {str(e)}")
+        stopped = True
+    finally:
+        # Committed chunks are visible even if a later one failed
+        if created:
+            await run_in_threadpool(cache.invalidate_book_search_cache)
+            await run_in_threadpool(suggest.index_books, created)
+        if categories_created:
+            await run_in_threadpool(cache.invalidate_category_list_cache)
     
+    if stopped:
+        response.status_code = status.HTTP_207_MULTI_STATUS
     return {
-        "message": "عملیات آپلود با موفقیت انجام شد",
+        "message": (
+            "آپلود پیش از پایان متوقف شد؛ بخش‌های قبلی ثبت شده‌اند" if stopped else "عملیات آپلود با موفقیت انجام شد"
+        ),
         "total_created": total_created,
         "total_skipped": total_skipped,
         "categories_created": categories_created,
         "errors": errors if errors else None,
     }
+
+
+async def _ensure_categories(db: AsyncSession, names: set[str]) -> tuple[dict[str, int], list[str]]:
+    """
+    Resolve category names to ids, creating the missing ones in one statement.
+
+    Returns:
+        Tuple of (id by name for every requested category, names created)
+    """
+    rows = [{"name": name, "description": f"دسته‌بندی {name}"} for name in sorted(names)]
+    inserted = await bulk.insert_rows(db, Category.__table__, rows, returning=(Category.name,))
+    new_categories = [name for (name,) in inserted]
+    if new_categories:
+        await db.execute(versioning.table_versions_bump(Category.__tablename__))
+        logger.info(f"Created categories: {', '.join(new_categories)}")
+    result = await db.execute(select(Category.id, Category.name).where(Category.name.in_(names)))
+    return {name: category_id for category_id, name in result}, new_categories
+
+
+async def _existing_book_names(db: AsyncSession, category_id: int, names: list[str]) -> set[str]:
+    """Return which of ``names`` already exist as books in a category, with one query per batch."""
+    existing: set[str] = set()
+    for batch in chunked(names, bulk.LOOKUP_BATCH_ROWS):
+        statement = select(Book.name).where(Book.category_id == category_id, Book.name.in_(batch))
+        existing.update((await db.execute(statement)).scalars())
+    return existing
+
+
+async def _load_book_with_category(book_id: int, db: AsyncSession) -> Book | None:
+    """Load a book with its category eagerly loaded, refreshing an already loaded instance."""
+    statement = (
+        select(Book)
+        .options(selectinload(Book.category))
+        .where(Book.id == book_id)
+        .execution_options(populate_existing=True)
+    )
+    return (await db.execute(statement)).scalar_one_or_none()
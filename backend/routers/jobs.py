@@ -0,0 +1,33 @@
+"""Background job endpoints for the library system backend."""
+from __future__ import annotations
+
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import job_queue
+from ..database import get_primary_read_db, remember_write, replicas
+from ..models import ImportJob
+from ..schemas import ImportJobRead
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("/{job_id}", response_model=ImportJobRead)
+async def get_job(
+    job_id: str, response: Response, db: AsyncSession = Depends(get_primary_read_db)
+) -> ImportJobRead:
+    """
+    Report the progress of a background job.
+
+    Read from the primary so progress is never stale, through the reader
+    pool so polling does not hold up the import's writes.
+
+    Once the job has finished, the client is about to read what it wrote,
+    so its reads are pinned to the primary as after a write of its own.
+    """
+    job = await db.get(ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if replicas is not None and job.status in (job_queue.JOB_COMPLETED, job_queue.JOB_FAILED):
+        remember_write(response)
+    return ImportJobRead.model_validate(job, from_attributes=True)
@@ -2,15 +2,44 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta, timezone
+from typing import Any, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import and_, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, insert, or_, select, update
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 
-from ..database import get_db
-from ..models import Book, Loan, Student
-from ..schemas import LoanCreate, LoanRead, LoanReturnRequest
+from .. import book_availability, bulk, loan_export, loan_stats, overdue, versioning
+from ..config import settings
+from ..database import get_db, get_read_db, stream_read_partitions
+from ..excel_utils import chunked
+from ..models import Book, Category, Loan, Student
+from ..pagination import PageParams, cursor_id, cursor_text, encode_cursor, parse_cursor, split_page
+from ..responses import (
+    dump_json,
+    etag_matches,
+    json_bytes_response,
+    list_media_type,
+    ndjson_response,
+    not_modified_response,
+    validator_headers,
+    wants_ndjson,
+)
+from ..schemas import (
+    LoanBatchCreate,
+    LoanBatchItemResult,
+    LoanBatchResult,
+    LoanBatchReturnItemResult,
+    LoanBatchReturnRequest,
+    LoanBatchReturnResult,
+    LoanCreate,
+    LoanRead,
+    LoanReturnRequest,
+    OverdueLoanRead,
+    Page,
+)
 
 # Tehran timezone (UTC+3:30)
 TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
@@ -19,53 +48,173 @@ router = APIRouter(prefix="/loans", tags=["loans"])
 
 
 @router.post("/", response_model=LoanRead, status_code=status.HTTP_201_CREATED)
-def create_loan(payload: LoanCreate, db: Session = Depends(get_db)) -> LoanRead:
-    """Register a new loan for a student and a book."""
-    book = db.get(Book, payload.book_id)
-    if book is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
-
-    student = db.get(Student, payload.student_id)
-    if student is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
-
-    active_loan_statement = select(Loan).where(
-        and_(Loan.book_id == payload.book_id, Loan.returned.is_(False))
-    )
-    active_loan = db.execute(active_loan_statement).scalar_one_or_none()
-    if active_loan is not None:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Book already on loan")
+async def create_loan(payload: LoanCreate, db: AsyncSession = Depends(get_db)) -> LoanRead:
+    """
+    Register a new loan for a student and a book.
 
-    loan = Loan(**payload.model_dump())
-    db.add(loan)
+    The loan is inserted without checking first: the foreign keys reject a
+    missing book or student and the ``uq_loans_active_book`` partial index
+    rejects a book that is already on loan, even when two checkouts race.
+    The book is marked as on loan in the same transaction.
+    """
+    statement = insert(Loan).values(**payload.model_dump()).returning(Loan.id)
     try:
-        db.commit()
+        loan_id = (await db.execute(statement)).scalar_one()
+        await loan_stats.record_checkouts(db, [loan_id])
+        await book_availability.record_checkouts(db, [(loan_id, payload.book_id)])
+        await db.execute(versioning.table_versions_bump(Loan.__tablename__))
+        await db.commit()
     except IntegrityError as exc:
-        db.rollback()
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Loan could not be created") from exc
+        await db.rollback()
+        if "foreign key" not in str(exc.orig).lower():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Book already on loan") from exc
+        # SQLite does not say which key failed, so look it up on this rare path.
+        if await db.get(Book, payload.book_id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found") from exc
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found") from exc
 
-    db.refresh(loan)
-    loan = _load_loan_with_relations(loan.id, db)
+    loan = await _load_loan_with_relations(loan_id, db)
     if loan is None:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Loan refresh failed")
     return LoanRead.model_validate(loan, from_attributes=True)
 
 
-@router.get("/", response_model=list[LoanRead])
-def list_loans(
+@router.post("/batch", response_model=LoanBatchResult)
+async def create_loans_batch(payload: LoanBatchCreate, db: AsyncSession = Depends(get_db)) -> LoanBatchResult:
+    """
+    Check out many books in one transaction, such as textbooks for a whole class.
+
+    Missing books and students and books already on loan are found with
+    one query per batch of ids, and the remaining loans are inserted with
+    one bulk statement. A book requested twice is lent to the first item
+    only. Results follow the order of the request.
+    """
+    book_ids = {item.book_id for item in payload.items}
+    books = await _existing_ids(db, Book.id, book_ids)
+    students = await _existing_ids(db, Student.id, {item.student_id for item in payload.items})
+    on_loan = await _existing_ids(db, Loan.book_id, book_ids, Loan.returned.is_(False))
+
+    outcomes: list[str] = []
+    rows = []
+    for item in payload.items:
+        if item.book_id not in books:
+            outcomes.append("book_not_found")
+        elif item.student_id not in students:
+            outcomes.append("student_not_found")
+        elif item.book_id in on_loan:
+            outcomes.append("book_on_loan")
+        else:
+            outcomes.append("created")
+            on_loan.add(item.book_id)
+            rows.append(item.model_dump())
+
+    try:
+        # Conflicts with the open-loan index, from checkouts racing this one, are skipped
+        inserted = await bulk.insert_rows(db, Loan.__table__, rows, returning=(Loan.id, Loan.book_id))
+        if inserted:
+            await loan_stats.record_checkouts(db, [loan_id for loan_id, _ in inserted])
+            await book_availability.record_checkouts(db, inserted)
+            await db.execute(versioning.table_versions_bump(Loan.__tablename__))
+        await db.commit()
+    except IntegrityError as exc:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Loans could not be created") from exc
+
+    loan_ids = {book_id: loan_id for loan_id, book_id in inserted}
+    results = []
+    for item, outcome in zip(payload.items, outcomes):
+        loan_id = loan_ids.get(item.book_id) if outcome == "created" else None
+        if outcome == "created" and loan_id is None:
+            outcome = "book_on_loan"
+        results.append(
+            LoanBatchItemResult(book_id=item.book_id, student_id=item.student_id, status=outcome, loan_id=loan_id)
+        )
+    return LoanBatchResult(total_created=len(inserted), items=results)
+
+
+@router.post("/batch-return", response_model=LoanBatchReturnResult)
+async def return_loans_batch(
+    payload: LoanBatchReturnRequest, db: AsyncSession = Depends(get_db)
+) -> LoanBatchReturnResult:
+    """
+    Mark many loans as returned in one transaction.
+
+    Open loans are closed with one bulk UPDATE per batch of ids; only the
+    loans it did not close are looked up to tell missing loans from ones
+    already returned. Results follow the order of the request.
+    """
+    return_date = payload.return_date or datetime.now(TEHRAN_TZ)
+    requested = set(payload.loan_ids)
+    returned_ids: set[int] = set()
+    for batch in chunked(sorted(requested), bulk.LOOKUP_BATCH_ROWS):
+        statement = (
+            update(Loan)
+            .where(Loan.id.in_(batch), Loan.returned.is_(False))
+            .values(returned=True, return_date=return_date)
+            .returning(Loan.id)
+            .execution_options(synchronize_session=False)
+        )
+        returned_ids.update((await db.execute(statement)).scalars())
+    existing = returned_ids | await _existing_ids(db, Loan.id, requested - returned_ids)
+
+    if returned_ids:
+        await loan_stats.record_returns(db, returned_ids)
+        await book_availability.record_returns(db, returned_ids)
+        await db.execute(versioning.table_versions_bump(Loan.__tablename__))
+    await db.commit()
+
+    results = []
+    seen: set[int] = set()
+    for loan_id in payload.loan_ids:
+        if loan_id not in existing:
+            outcome = "not_found"
+        elif loan_id in returned_ids and loan_id not in seen:
+            outcome = "returned"
+        else:
+            outcome = "already_returned"
+        seen.add(loan_id)
+        results.append(LoanBatchReturnItemResult(loan_id=loan_id, status=outcome))
+    return LoanBatchReturnResult(total_returned=len(returned_ids), items=results)
+
+
+@router.get("/", response_model=Page[LoanRead])
+async def list_loans(
+    request: Request,
     returned: bool | None = None,
     student_id: int | None = None,
     book_id: int | None = None,
-    db: Session = Depends(get_db),
-) -> list[LoanRead]:
-    """List loans with optional filters."""
+    grade: str | None = Query(default=None, description="Only loans of students in this grade"),
+    major: str | None = Query(default=None, description="Only loans of students in this major"),
+    name: str | None = Query(default=None, description="Only loans of students whose full name contains this"),
+    page: PageParams = Depends(),
+    stream: bool = Query(default=False, description="Stream every matching loan as NDJSON instead of a page"),
+    db: AsyncSession = Depends(get_read_db),
+) -> Response:
+    """
+    List loans, newest first, with optional filters.
+
+    The student filters match the report tab and the history export, so
+    the frontend can page through a filtered history.
+
+    Answers a matching If-None-Match with 304 before running the query.
+    With ``stream=true`` or ``Accept: application/x-ndjson``, every loan
+    from the cursor on is streamed as one JSON line.
+    """
+    ndjson = wants_ndjson(request, stream)
+    etag = await versioning.collection_etag(
+        request, db, Loan, Book, Category, Student, representation=list_media_type(ndjson)
+    )
+    if etag_matches(request, etag):
+        return not_modified_response(etag, vary="Accept")
+
+    after = page.decode(2)
     statement = (
         select(Loan)
         .options(
             selectinload(Loan.book).selectinload(Book.category),
             selectinload(Loan.student),
         )
-        .order_by(Loan.loan_date.desc())
+        .order_by(Loan.loan_date.desc(), Loan.id.desc())
     )
 
     if returned is not None:
@@ -74,24 +223,104 @@ def list_loans(
         statement = statement.where(Loan.student_id == student_id)
     if book_id is not None:
         statement = statement.where(Loan.book_id == book_id)
+    criteria = loan_export.student_criteria(
+        grade.strip() if grade else "",
+        major.strip() if major else "",
+        name.strip() if name else "",
+    )
+    if criteria:
+        statement = statement.join(Student, Loan.student_id == Student.id).where(*criteria)
+    if after is not None:
+        last_loan_date, last_id = _parse_loan_cursor(after)
+        statement = statement.where(
+            or_(
+                Loan.loan_date < last_loan_date,
+                and_(Loan.loan_date == last_loan_date, Loan.id < last_id),
+            )
+        )
+
+    if ndjson:
+        partitions = stream_read_partitions(request, statement, settings.stream_batch_size)
+        return ndjson_response(partitions, LoanRead, headers=validator_headers(etag, vary="Accept"))
+
+    statement = statement.limit(page.limit + 1)
+    loans, has_more = split_page((await db.execute(statement)).scalars().all(), page.limit)
+    last = loans[-1] if has_more else None
+    result = Page[LoanRead](
+        items=[LoanRead.model_validate(loan, from_attributes=True) for loan in loans],
+        next_cursor=encode_cursor(last.loan_date.isoformat(), last.id) if last else None,
+    )
+    return json_bytes_response(dump_json(result), headers=validator_headers(etag, vary="Accept"))
+
 
-    loans = db.execute(statement).scalars().all()
-    return [LoanRead.model_validate(loan, from_attributes=True) for loan in loans]
+@router.get("/export")
+async def export_loan_history(
+    request: Request,
+    format: Literal["csv", "xlsx"] = Query(default="csv", description="File format of the export"),
+    grade: str | None = Query(default=None, description="Only loans of students in this grade"),
+    major: str | None = Query(default=None, description="Only loans of students in this major"),
+    name: str | None = Query(default=None, description="Only loans of students whose full name contains this"),
+) -> StreamingResponse:
+    """
+    Download the loan history as CSV or XLSX, newest first.
+
+    Rows are read from the database in batches with ``yield_per`` and
+    written as they arrive, including the planned duration, the duration
+    until return and the delay in days, so memory stays constant however
+    long the history is.
+    """
+    statement = loan_export.history_statement(
+        grade.strip() if grade else "",
+        major.strip() if major else "",
+        name.strip() if name else "",
+    )
+    write = loan_export.iter_xlsx if format == "xlsx" else loan_export.iter_csv
+    partitions = stream_read_partitions(request, statement, settings.stream_batch_size)
+
+    media_type = (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        if format == "xlsx"
+        else "text/csv; charset=utf-8"
+    )
+    return StreamingResponse(
+        write(partitions),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="library-history.{format}"'},
+    )
+
+
+@router.get("/overdue", response_model=list[OverdueLoanRead])
+async def list_overdue_loans(db: AsyncSession = Depends(get_read_db)) -> list[OverdueLoanRead]:
+    """Return the open loans past their due date, oldest due first, with only the names needed to list them."""
+    now = datetime.now(TEHRAN_TZ)
+    rows = await db.execute(overdue.overdue_loans_statement(now))
+    return [
+        OverdueLoanRead(
+            id=loan_id,
+            book_id=book_id,
+            book_name=book_name,
+            student_id=student_id,
+            student_name=f"{first_name} {last_name}",
+            due_date=due_date,
+            days_overdue=overdue.days_overdue(due_date, now),
+        )
+        for loan_id, book_id, book_name, student_id, first_name, last_name, due_date in rows
+    ]
 
 
 @router.get("/{loan_id}", response_model=LoanRead)
-def get_loan(loan_id: int, db: Session = Depends(get_db)) -> LoanRead:
+async def get_loan(loan_id: int, db: AsyncSession = Depends(get_read_db)) -> LoanRead:
     """Retrieve a loan by identifier."""
-    loan = _load_loan_with_relations(loan_id, db)
+    loan = await _load_loan_with_relations(loan_id, db)
     if loan is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Loan not found")
     return LoanRead.model_validate(loan, from_attributes=True)
 
 
 @router.post("/{loan_id}/return", response_model=LoanRead)
-def return_book(loan_id: int, payload: LoanReturnRequest, db: Session = Depends(get_db)) -> LoanRead:
+async def return_book(loan_id: int, payload: LoanReturnRequest, db: AsyncSession = Depends(get_db)) -> LoanRead:
     """Mark a loan as returned."""
-    loan = db.get(Loan, loan_id)
+    loan = await db.get(Loan, loan_id)
     if loan is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Loan not found")
     if loan.returned:
@@ -101,34 +330,57 @@ def return_book(loan_id: int, payload: LoanReturnRequest, db: Session = Depends(
     loan.return_date = payload.return_date or datetime.now(TEHRAN_TZ)
 
     db.add(loan)
-    db.commit()
-    db.refresh(loan)
+    await db.flush()
+    await loan_stats.record_returns(db, [loan_id])
+    await book_availability.record_returns(db, [loan_id])
+    await db.commit()
 
-    loaded = _load_loan_with_relations(loan_id, db)
+    loaded = await _load_loan_with_relations(loan_id, db)
     if loaded is None:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Loan refresh failed")
     return LoanRead.model_validate(loaded, from_attributes=True)
 
 
 @router.delete("/{loan_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_loan(loan_id: int, db: Session = Depends(get_db)) -> None:
+async def delete_loan(loan_id: int, db: AsyncSession = Depends(get_db)) -> None:
     """Delete a loan record."""
-    loan = db.get(Loan, loan_id)
+    loan = await db.get(Loan, loan_id)
     if loan is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Loan not found")
     
-    db.delete(loan)
-    db.commit()
+    await loan_stats.record_removals(db, Loan.id == loan_id)
+    await book_availability.record_removals(db, Loan.id == loan_id)
+    await db.delete(loan)
+    await db.commit()
+
+
+async def _existing_ids(db: AsyncSession, column: Any, ids: set[int], *criteria: Any) -> set[int]:
+    """Return which of ``ids`` are present in ``column``, with one query per batch."""
+    found: set[int] = set()
+    for batch in chunked(list(ids), bulk.LOOKUP_BATCH_ROWS):
+        statement = select(column).where(column.in_(batch), *criteria)
+        found.update((await db.execute(statement)).scalars())
+    return found
 
 
-def _load_loan_with_relations(loan_id: int, db: Session) -> Loan | None:
-    """Load a loan with eagerly loaded book and student relationships."""
+async def _load_loan_with_relations(loan_id: int, db: AsyncSession) -> Loan | None:
+    """Load a loan with its book, category and student in one joined query, refreshing a loaded instance."""
     statement = (
         select(Loan)
         .options(
-            selectinload(Loan.book).selectinload(Book.category),
-            selectinload(Loan.student),
+            joinedload(Loan.book, innerjoin=True).joinedload(Book.category),
+            joinedload(Loan.student, innerjoin=True),
         )
         .where(Loan.id == loan_id)
+        .execution_options(populate_existing=True)
     )
-    return db.execute(statement).scalar_one_or_none()
+    return (await db.execute(statement)).scalar_one_or_none()
+
+
+def _parse_loan_cursor(values: list) -> tuple[datetime, int]:
+    """Convert a decoded loan cursor back into its (loan_date, id) sort key."""
+    last_loan_date, last_id = parse_cursor(values, cursor_text, cursor_id)
+    try:
+        return datetime.fromisoformat(last_loan_date), last_id
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
@@ -0,0 +1,82 @@
+"""Loan report endpoints for the library system backend."""
+from __future__ import annotations
+
+from collections.abc import Callable
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import overdue
+from ..database import get_read_db
+from ..loan_export import days_between
+from ..models import TEHRAN_TZ, Book, Category, Loan, LoanStat, as_tehran_time
+from ..schemas import ReportBook, ReportCount, ReportSummary
+
+router = APIRouter(prefix="/reports", tags=["reports"])
+
+# Dimensions with few enough values to be returned in full
+_LISTED_DIMENSIONS = ("total", "grade", "major", "category", "month")
+
+
+@router.get("/summary", response_model=ReportSummary)
+async def get_summary(
+    top: int = Query(default=10, ge=1, le=100, description="Number of most borrowed books"),
+    db: AsyncSession = Depends(get_read_db),
+) -> ReportSummary:
+    """
+    Return loan counts by grade, major, category and month, the most borrowed books and totals.
+
+    Everything but the delay of open overdue loans comes from the
+    ``loan_stats`` rollup, so the cost does not grow with the history.
+    """
+    statement = select(LoanStat).where(LoanStat.dimension.in_(_LISTED_DIMENSIONS), LoanStat.loans > 0)
+    stats: dict[str, list[LoanStat]] = {dimension: [] for dimension in _LISTED_DIMENSIONS}
+    for stat in (await db.execute(statement)).scalars():
+        stats[stat.dimension].append(stat)
+
+    statement = (
+        select(LoanStat.key, LoanStat.loans)
+        .where(LoanStat.dimension == "book", LoanStat.loans > 0)
+        .order_by(LoanStat.loans.desc(), LoanStat.key.asc())
+        .limit(top)
+    )
+    top_books = [(int(key), loans) for key, loans in await db.execute(statement)]
+
+    book_names = await _names(db, Book, [book_id for book_id, _ in top_books])
+    category_names = await _names(db, Category, [int(stat.key) for stat in stats["category"] if stat.key])
+
+    now = datetime.now(TEHRAN_TZ)
+    due_dates = (await db.execute(select(Loan.due_date).where(overdue.overdue_condition(now)))).scalars()
+    open_delay_days = sum(days_between(as_tehran_time(due_date), now) for due_date in due_dates)
+
+    total = stats["total"][0] if stats["total"] else LoanStat(loans=0, returned=0, duration_days=0, delay_days=0)
+    return ReportSummary(
+        total_loans=total.loans,
+        active_loans=total.loans - total.returned,
+        returned_loans=total.returned,
+        average_loan_days=round(total.duration_days / total.returned, 1) if total.returned else None,
+        total_delay_days=total.delay_days + open_delay_days,
+        by_grade=_counts(stats["grade"]),
+        by_major=_counts(stats["major"]),
+        by_category=_counts(stats["category"], lambda key: category_names.get(int(key), key) if key else ""),
+        by_month=sorted(_counts(stats["month"]), key=lambda count: count.label),
+        top_books=[
+            ReportBook(book_id=book_id, name=book_names.get(book_id, ""), loans=loans) for book_id, loans in top_books
+        ],
+    )
+
+
+def _counts(stats: list[LoanStat], label: Callable[[str], str] = str) -> list[ReportCount]:
+    """Return the loan counts of a dimension, most loans first."""
+    counts = [ReportCount(label=label(stat.key), loans=stat.loans) for stat in stats]
+    return sorted(counts, key=lambda count: -count.loans)
+
+
+async def _names(db: AsyncSession, model: type, ids: list[int]) -> dict[int, str]:
+    """Return the names of the given books or categories by id."""
+    if not ids:
+        return {}
+    rows = await db.execute(select(model.id, model.name).where(model.id.in_(ids)))
+    return {row_id: name for row_id, name in rows}
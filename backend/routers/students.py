@@ -2,17 +2,44 @@
 from __future__ import annotations
 
 import logging
+import os
+from collections.abc import AsyncIterator
+from datetime import datetime
 from typing import Any
 
-from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
-from sqlalchemy import select
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
-from ..database import get_db
-from ..excel_utils import read_excel_sheets, validate_student_sheet_data
-from ..models import Student
-from ..schemas import StudentCreate, StudentRead, StudentUpdate
+from .. import (
+    book_availability,
+    bulk,
+    cache,
+    import_pool,
+    job_queue,
+    loan_stats,
+    overdue,
+    suggest,
+    text_import,
+    versioning,
+)
+from ..config import settings
+from ..database import get_db, get_read_db, session_scope
+from ..excel_utils import STUDENT_FIELDS, STUDENT_MAJOR_COLUMNS, SheetChunk, chunked, student_row_validator
+from ..models import TEHRAN_TZ, Loan, Student
+from ..pagination import PageParams, cursor_id, cursor_text, encode_cursor, parse_cursor, split_page
+from ..responses import (
+    conditional_json_response,
+    dump_json,
+    etag_matches,
+    json_bytes_response,
+    not_modified_response,
+    validator_headers,
+)
+from ..schemas import ImportJobAccepted, Page, StudentCreate, StudentRead, StudentUpdate
 
 logger = logging.getLogger(__name__)
 
@@ -20,59 +47,144 @@ router = APIRouter(prefix="/students", tags=["students"])
 
 
 @router.post("/", response_model=StudentRead, status_code=status.HTTP_201_CREATED)
-def create_student(payload: StudentCreate, db: Session = Depends(get_db)) -> StudentRead:
+async def create_student(payload: StudentCreate, db: AsyncSession = Depends(get_db)) -> StudentRead:
     """Create a new student."""
     student = Student(**payload.model_dump())
     db.add(student)
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError as exc:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student could not be created") from exc
-    db.refresh(student)
+    await db.refresh(student)
+    await run_in_threadpool(cache.invalidate_student_search_cache)
+    await run_in_threadpool(suggest.index_student, student.id, student.full_name)
     return StudentRead.model_validate(student, from_attributes=True)
 
 
-@router.get("/", response_model=list[StudentRead])
-def list_students(
+@router.get("/", response_model=Page[StudentRead])
+async def list_students(
+    request: Request,
     search: str | None = Query(default=None, description="Optional search term for student name"),
     grade: str | None = Query(default=None, description="Filter by grade"),
     major: str | None = Query(default=None, description="Filter by major"),
-    db: Session = Depends(get_db),
-) -> list[StudentRead]:
-    """Return students optionally filtered by name, grade, or major."""
-    statement = select(Student)
-    if search:
-        normalized = search.strip().lower()
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_read_db),
+) -> Response:
+    """
+    Return a page of students optionally filtered by name, grade, or major.
+
+    Pages are cached in Redis under the normalized (search, grade, major)
+    filters, and a matching If-None-Match is answered with 304 before
+    running the query.
+    """
+    versions = await versioning.get_table_versions(db, Student)
+    etag = versioning.etag_for_versions(request, versions)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+
+    after = page.decode(3)
+    if after is not None:
+        after = parse_cursor(after, cursor_text, cursor_text, cursor_id)
+    normalized = search.strip().lower() if search else ""
+    grade = grade.strip() if grade else ""
+    major = major.strip() if major else ""
+
+    async def render() -> bytes:
+        statement = select(Student)
         if normalized:
             statement = statement.where(
                 (Student.first_name.ilike(f"%{normalized}%")) |
                 (Student.last_name.ilike(f"%{normalized}%"))
             )
-    if grade:
-        statement = statement.where(Student.grade == grade)
-    if major:
-        statement = statement.where(Student.major == major)
-    statement = statement.order_by(Student.first_name.asc(), Student.last_name.asc())
-    students = db.execute(statement).scalars().all()
-    return [StudentRead.model_validate(student, from_attributes=True) for student in students]
+        if grade:
+            statement = statement.where(Student.grade == grade)
+        if major:
+            statement = statement.where(Student.major == major)
+        if after is not None:
+            last_first, last_last, last_id = after
+            statement = statement.where(
+                or_(
+                    Student.first_name > last_first,
+                    and_(Student.first_name == last_first, Student.last_name > last_last),
+                    and_(
+                        Student.first_name == last_first,
+                        Student.last_name == last_last,
+                        Student.id > last_id,
+                    ),
+                )
+            )
+        statement = statement.order_by(
+            Student.first_name.asc(), Student.last_name.asc(), Student.id.asc()
+        ).limit(page.limit + 1)
+        students, has_more = split_page((await db.execute(statement)).scalars().all(), page.limit)
+        last = students[-1] if has_more else None
+        return dump_json(
+            Page[StudentRead](
+                items=[StudentRead.model_validate(student, from_attributes=True) for student in students],
+                next_cursor=encode_cursor(last.first_name, last.last_name, last.id) if last else None,
+            )
+        )
+
+    cache_key = await run_in_threadpool(
+        cache.build_student_search_key,
+        normalized,
+        grade,
+        major,
+        page.cursor,
+        page.limit,
+        versioning.snapshot_token(versions),
+    )
+    body, is_stale = await cache.get_or_compute_with_status(cache_key, render, raw=True)
+    return json_bytes_response(body, headers=None if is_stale else validator_headers(etag))
+
+
+@router.get("/overdue-ids", response_model=list[int])
+async def list_overdue_student_ids(request: Request, db: AsyncSession = Depends(get_read_db)) -> Response:
+    """
+    Return the ids of the students holding an overdue loan, as a cached JSON array.
+
+    The cache key follows the loans change counter, so any checkout or
+    return recomputes it, and the entry expires when the next open loan
+    comes due. Answers a matching If-None-Match with 304.
+    """
+    versions = await versioning.get_table_versions(db, Loan)
+    next_due_date = None
+    computed_at = datetime.now(TEHRAN_TZ)
+
+    async def render() -> bytes:
+        nonlocal next_due_date, computed_at
+        computed_at = datetime.now(TEHRAN_TZ)
+        student_ids = (await db.execute(overdue.overdue_student_ids_statement(computed_at))).scalars().all()
+        next_due_date = (await db.execute(overdue.next_due_date_statement(computed_at))).scalar()
+        return dump_json(student_ids)
+
+    cache_key = await run_in_threadpool(
+        cache.build_overdue_student_ids_key, versioning.snapshot_token(versions)
+    )
+    body = await cache.get_or_compute(
+        cache_key, render, ttl_seconds=lambda: overdue.seconds_until(next_due_date, computed_at), raw=True
+    )
+    return conditional_json_response(request, body)
 
 
 @router.get("/{student_id}", response_model=StudentRead)
-def get_student(student_id: int, db: Session = Depends(get_db)) -> StudentRead:
+async def get_student(student_id: int, db: AsyncSession = Depends(get_read_db)) -> StudentRead:
     """Retrieve a student by identifier."""
     statement = select(Student).where(Student.id == student_id)
-    student = db.execute(statement).scalar_one_or_none()
+    student = (await db.execute(statement)).scalar_one_or_none()
     if student is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
     return StudentRead.model_validate(student, from_attributes=True)
 
 
 @router.patch("/{student_id}", response_model=StudentRead)
-def update_student(student_id: int, payload: StudentUpdate, db: Session = Depends(get_db)) -> StudentRead:
+async def update_student(
+    student_id: int, payload: StudentUpdate, db: AsyncSession = Depends(get_db)
+) -> StudentRead:
     """Update an existing student."""
     statement = select(Student).where(Student.id == student_id)
-    student = db.execute(statement).scalar_one_or_none()
+    student = (await db.execute(statement)).scalar_one_or_none()
     if student is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
 
@@ -80,30 +192,47 @@ def update_student(student_id: int, payload: StudentUpdate, db: Session = Depend
         setattr(student, field, value)
 
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError as exc:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student could not be updated") from exc
-    db.refresh(student)
+    await db.refresh(student)
+    await run_in_threadpool(cache.invalidate_student_search_cache)
+    await run_in_threadpool(suggest.index_student, student.id, student.full_name)
     return StudentRead.model_validate(student, from_attributes=True)
 
 
 @router.delete("/{student_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_student(student_id: int, db: Session = Depends(get_db)) -> None:
+async def delete_student(student_id: int, db: AsyncSession = Depends(get_db)) -> None:
     """Delete a student."""
     statement = select(Student).where(Student.id == student_id)
-    student = db.execute(statement).scalar_one_or_none()
+    student = (await db.execute(statement)).scalar_one_or_none()
     if student is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
 
-    db.delete(student)
-    db.commit()
+    # The student's loans are deleted with them
+    await loan_stats.record_removals(db, Loan.student_id == student_id)
+    await book_availability.record_removals(db, Loan.student_id == student_id)
+    await db.delete(student)
+    await db.commit()
+    await run_in_threadpool(cache.invalidate_student_search_cache)
+    await run_in_threadpool(suggest.remove_student, student_id)
 
 
-@router.post("/upload-excel", status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/upload-excel",
+    status_code=status.HTTP_201_CREATED,
+    responses={status.HTTP_202_ACCEPTED: {"model": ImportJobAccepted}},
+)
 async def upload_students_excel(
+    response: Response,
     file: UploadFile = File(..., description="Excel file with students data"),
-    db: Session = Depends(get_db),
+    run_async: bool = Query(
+        default=False,
+        alias="async",
+        description="Import in the background and return a job id to poll at /jobs/{id}",
+    ),
+    db: AsyncSession = Depends(get_db),
 ) -> dict[str, Any]:
     """
     Upload Excel file to bulk import students.
@@ -113,8 +242,12 @@ async def upload_students_excel(
     - Required columns: 'نام', 'نام خانوادگی', 'پایه'
     - Students will be created with the major from the sheet name
     
+    Students matching an existing or earlier row by name, grade and major,
+    or by national ID, are skipped.
+    
     Returns:
-        Summary of import operation including counts and any errors
+        Summary of import operation including counts and any errors, or
+        with ``async=true`` the id of the job performing the import
     """
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(
@@ -122,64 +255,226 @@ async def upload_students_excel(
             detail="فایل باید از نوع اکسل (.xlsx یا .xls) باشد"
         )
     
+    if run_async:
+        # The upload is discarded once the response is sent, so the job gets its own copy.
+        path = await run_in_threadpool(import_pool.save_upload, file.file)
+        job_id = await job_queue.create_job("students_import", file.filename)
+        job_queue.submit(job_id, lambda: _run_student_import_job(job_id, path))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"job_id": job_id, "status": job_queue.JOB_PENDING}
+    
+    # Worker processes parse the sheets from a copy of the upload on disk.
+    path = await run_in_threadpool(import_pool.save_upload, file.file)
+    chunks = import_pool.iter_sheet_chunks(path, student_row_validator, STUDENT_FIELDS, settings.import_chunk_size)
     try:
-        content = await file.read()
-        sheets_data = read_excel_sheets(content)
-    except ValueError as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception as e:
-        logger.error(f"Failed to read Excel file: {e}", exc_info=True)
+        return await _import_students(db, chunks, response)
+    finally:
+        await chunks.aclose()
+        os.remove(path)
+
+
+@router.post("/import", status_code=status.HTTP_201_CREATED)
+async def import_students(
+    request: Request,
+    response: Response,
+    major: str | None = Query(default=None, description="Major of records without a major column"),
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, Any]:
+    """
+    Bulk import students from a CSV (text/csv) or NDJSON (application/x-ndjson) body.
+    
+    Columns are matched by the same names as in Excel files. Each record's
+    major comes from a 'رشته' column, or the ``major`` parameter when the
+    column is missing or empty. Duplicates are skipped as for Excel uploads.
+    The body is spooled to disk and parsed record by record, which is far
+    faster than parsing a workbook.
+    
+    Returns:
+        Summary of import operation including counts and any errors
+    """
+    media_type = text_import.media_type_of(request)
+    if media_type is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"خطا در خواندن فایل: {str(e)}"
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="نوع محتوا باید text/csv یا application/x-ndjson باشد"
         )
     
+    path = await text_import.save_body(request)
+    records = text_import.iter_record_chunks(
+        path, media_type, student_row_validator, STUDENT_MAJOR_COLUMNS, major, settings.import_chunk_size
+    )
+    try:
+        return await _import_students(db, iterate_in_threadpool(records), response)
+    finally:
+        records.close()
+        os.remove(path)
+
+
+async def _import_students(
+    db: AsyncSession, chunks: AsyncIterator[SheetChunk], response: Response
+) -> dict[str, Any]:
+    """
+    Insert the new students of validated chunks.
+
+    Each chunk is committed on its own, so the single writer connection is
+    released while the next chunk is parsed. If a malformed record or a
+    database error stops the import after some chunks were committed, those
+    chunks stay imported and the response is ``207 Multi-Status`` with
+    their counts and the error; re-importing skips them as duplicates.
+    
+    Returns:
+        Summary of import operation including counts and any errors
+    """
     total_created = 0
     total_skipped = 0
     errors = []
+    created: list[tuple[int, str]] = []
+    # Whether a chunk was committed, and whether an error then stopped the import
+    committed = False
+    stopped = False
     
-    for sheet_name, sheet_rows in sheets_data.items():
-        if not sheet_rows:
-            continue
-        
-        # Validate and import students
-        try:
-            validated_students = validate_student_sheet_data(sheet_rows, sheet_name)
-        except ValueError as e:
-            errors.append(f"شیت '{sheet_name}': {str(e)}")
-            continue
-        
-        for student_data in validated_students:
-            # Check if student already exists (by name and grade)
-            existing_statement = select(Student).where(
-                Student.first_name == student_data["first_name"],
-                Student.last_name == student_data["last_name"],
-                Student.grade == student_data["grade"],
-                Student.major == student_data["major"]
-            )
-            existing = db.execute(existing_statement).scalar_one_or_none()
-            
-            if existing:
-                total_skipped += 1
+    try:
+        async for chunk in chunks:
+            if chunk.error:
+                errors.append(chunk.error)
                 continue
             
-            student = Student(**student_data)
-            db.add(student)
-            total_created += 1
-    
-    try:
-        db.commit()
-    except Exception as e:
-        db.rollback()
+            inserted = await _insert_new_students(db, chunk.rows)
+            if inserted:
+                await db.execute(versioning.table_versions_bump(Student.__tablename__))
+            await db.commit()
+            committed = True
+            total_created += len(inserted)
+            total_skipped += len(chunk.rows) - len(inserted)
+            created.extend(inserted)
+    except ValueError as e:
+        await db.rollback()
+        if not committed:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        errors.append(str(e))
+        stopped = True
+    except PoolTimeoutError:
+        # Left to the application handler, which answers 503 with Retry-After
+        raise
+    except SQLAlchemyError as e:
+        await db.rollback()
         logger.error(f"Failed to commit students: {e}", exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"خطا در ذخیره‌سازی: {str(e)}"
-        )
+        if not committed:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"خطا در ذخیره‌سازی: {str(e)}"
+            )
+        errors.append(f"خطا در ذخیره‌سازی: {str(e)}")
+        stopped = True
+    finally:
+        # Committed chunks are visible even if a later one failed
+        await _index_new_students(created)
     
+    if stopped:
+        response.status_code = status.HTTP_207_MULTI_STATUS
     return {
-        "message": "عملیات آپلود با موفقیت انجام شد",
+        "message": (
+            "آپلود پیش از پایان متوقف شد؛ بخش‌های قبلی ثبت شده‌اند" if stopped else "عملیات آپلود با موفقیت انجام شد"
+        ),
         "total_created": total_created,
         "total_skipped": total_skipped,
         "errors": errors if errors else None,
     }
+
+
+_STUDENT_COLUMNS = ("first_name", "last_name", "grade", "major", "national_id", "phone_number")
+
+StudentKey = tuple[str, str, str | None, str | None]
+
+
+def _student_key(student: dict[str, Any]) -> StudentKey:
+    return (student["first_name"], student["last_name"], student.get("grade"), student.get("major"))
+
+
+async def _insert_new_students(db: AsyncSession, rows: list[dict[str, Any]]) -> list[tuple[int, str]]:
+    """
+    Insert the students of a chunk that are not already present, with set-based checks.
+
+    Rows are deduplicated among themselves, then against the database with
+    one query per batch for (first name, last name, grade, major) and one
+    for national IDs. Rows inserted from earlier chunks of the same import
+    are visible to these queries, so duplicates across chunks are skipped too.
+    
+    Returns:
+        (id, full name) of the students inserted
+    """
+    candidates: dict[StudentKey, dict[str, Any]] = {}
+    national_ids: set[str] = set()
+    for student in rows:
+        key = _student_key(student)
+        national_id = student.get("national_id")
+        if key in candidates or (national_id and national_id in national_ids):
+            continue
+        candidates[key] = student
+        if national_id:
+            national_ids.add(national_id)
+    
+    existing_keys: set[StudentKey] = set()
+    existing_ids: set[str] = set()
+    for batch in chunked(list(candidates), bulk.LOOKUP_BATCH_ROWS):
+        # Row-value IN cannot use an index on SQLite, so narrow by the indexed
+        # name columns and match the whole key here.
+        statement = select(Student.first_name, Student.last_name, Student.grade, Student.major).where(
+            Student.last_name.in_({key[1] for key in batch}),
+            Student.first_name.in_({key[0] for key in batch}),
+        )
+        batch_keys = set(batch)
+        existing_keys.update(key for row in await db.execute(statement) if (key := tuple(row)) in batch_keys)
+    for batch in chunked(list(national_ids), bulk.LOOKUP_BATCH_ROWS):
+        statement = select(Student.national_id).where(Student.national_id.in_(batch))
+        existing_ids.update((await db.execute(statement)).scalars())
+    
+    new_rows = [
+        {column: student.get(column) for column in _STUDENT_COLUMNS}
+        for key, student in candidates.items()
+        if key not in existing_keys and student.get("national_id") not in existing_ids
+    ]
+    inserted = await bulk.insert_rows(
+        db, Student.__table__, new_rows, returning=(Student.id, Student.first_name, Student.last_name)
+    )
+    return [(student_id, f"{first_name} {last_name}") for student_id, first_name, last_name in inserted]
+
+
+async def _index_new_students(created: list[tuple[int, str]]) -> None:
+    """Refresh the search cache and suggestion index after students were committed."""
+    if not created:
+        return
+    await run_in_threadpool(cache.invalidate_student_search_cache)
+    await run_in_threadpool(suggest.index_students, created)
+
+
+async def _run_student_import_job(job_id: str, path: str) -> None:
+    """
+    Import a saved student workbook for a background job.
+
+    Each chunk is committed together with the job's progress, so the
+    counts reported by ``GET /jobs/{id}`` match the stored rows and the
+    writer is released between chunks.
+    """
+    errors: list[str] = []
+    chunks = import_pool.iter_sheet_chunks(path, student_row_validator, STUDENT_FIELDS, settings.import_chunk_size)
+    try:
+        async with session_scope() as db:
+            async for chunk in chunks:
+                inserted: list[tuple[int, str]] = []
+                if chunk.error:
+                    errors.append(chunk.error)
+                else:
+                    inserted = await _insert_new_students(db, chunk.rows)
+                if inserted:
+                    await db.execute(versioning.table_versions_bump(Student.__tablename__))
+                await db.execute(
+                    job_queue.record_progress(
+                        job_id, len(chunk.rows), len(inserted), len(chunk.rows) - len(inserted), errors
+                    )
+                )
+                await db.commit()
+                await _index_new_students(inserted)
+    finally:
+        await chunks.aclose()
+        os.remove(path)
@@ -2,10 +2,13 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import Generic, Literal, TypeVar
 
 from pydantic import BaseModel, ConfigDict, Field
 from sqlalchemy import desc
 
+ItemT = TypeVar("ItemT")
+
 
 # ========================= Category Schemas =========================
 
@@ -65,9 +68,19 @@ class BookRead(BookBase):
 
     id: int
     category: CategoryRead | None = None
+    active_loan_id: int | None = Field(None, description="Open loan of the book, if it is on loan")
+    available: bool = Field(True, description="Whether the book is on the shelf")
     model_config = ConfigDict(from_attributes=True)
 
 
+class SuggestionRead(BaseModel):
+    """Schema for an autocomplete suggestion."""
+
+    kind: Literal["book", "student"]
+    id: int
+    label: str
+
+
 # ========================= Student Schemas =========================
 
 
@@ -149,3 +162,131 @@ class LoanRead(BaseModel):
     book: BookRead | None = None
     student: StudentRead | None = None
     model_config = ConfigDict(from_attributes=True)
+
+
+class OverdueLoanRead(BaseModel):
+    """Compact schema for an open loan past its due date."""
+
+    id: int
+    book_id: int
+    book_name: str
+    student_id: int
+    student_name: str
+    due_date: datetime
+    days_overdue: int
+
+
+# Maximum number of items in one batch checkout or return
+LOAN_BATCH_MAX_ITEMS = 1000
+
+
+class LoanBatchCreate(BaseModel):
+    """Schema for checking out many books at once."""
+
+    items: list[LoanCreate] = Field(..., min_length=1, max_length=LOAN_BATCH_MAX_ITEMS)
+
+
+class LoanBatchItemResult(BaseModel):
+    """Outcome of one checkout of a batch."""
+
+    book_id: int
+    student_id: int
+    status: Literal["created", "book_not_found", "student_not_found", "book_on_loan"]
+    loan_id: int | None = None
+
+
+class LoanBatchResult(BaseModel):
+    """Outcome of a batch checkout, with one result per requested item in order."""
+
+    total_created: int
+    items: list[LoanBatchItemResult]
+
+
+class LoanBatchReturnRequest(BaseModel):
+    """Schema for returning many loans at once."""
+
+    loan_ids: list[int] = Field(..., min_length=1, max_length=LOAN_BATCH_MAX_ITEMS)
+    return_date: datetime | None = Field(None, description="Date when the books were returned")
+
+
+class LoanBatchReturnItemResult(BaseModel):
+    """Outcome of one return of a batch."""
+
+    loan_id: int
+    status: Literal["returned", "not_found", "already_returned"]
+
+
+class LoanBatchReturnResult(BaseModel):
+    """Outcome of a batch return, with one result per requested loan in order."""
+
+    total_returned: int
+    items: list[LoanBatchReturnItemResult]
+
+
+# ========================= Report Schemas =========================
+
+
+class ReportCount(BaseModel):
+    """Number of loans for one value of a report dimension."""
+
+    label: str
+    loans: int
+
+
+class ReportBook(BaseModel):
+    """A book and how often it was borrowed."""
+
+    book_id: int
+    name: str
+    loans: int
+
+
+class ReportSummary(BaseModel):
+    """Loan statistics for the reports tab."""
+
+    total_loans: int
+    active_loans: int
+    returned_loans: int
+    average_loan_days: float | None = Field(None, description="Average days from loan to return of returned loans")
+    total_delay_days: int = Field(..., description="Days past due of returned loans plus open overdue loans")
+    by_grade: list[ReportCount]
+    by_major: list[ReportCount]
+    by_category: list[ReportCount]
+    by_month: list[ReportCount]
+    top_books: list[ReportBook]
+
+
+# ========================= Job Schemas =========================
+
+
+class ImportJobRead(BaseModel):
+    """Schema for reading the progress of a background import."""
+
+    id: str
+    kind: str
+    status: Literal["pending", "running", "completed", "failed"]
+    file_name: str | None
+    rows_processed: int
+    total_created: int
+    total_skipped: int
+    errors: list[str]
+    created_at: datetime
+    finished_at: datetime | None
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ImportJobAccepted(BaseModel):
+    """Schema returned when an import is queued as a background job."""
+
+    job_id: str
+    status: str
+
+
+# ========================= Pagination Schemas =========================
+
+
+class Page(BaseModel, Generic[ItemT]):
+    """A single page of a keyset-paginated list."""
+
+    items: list[ItemT]
+    next_cursor: str | None = Field(None, description="Cursor for the next page, null on the last page")
@@ -0,0 +1,242 @@
+"""In-process prefix index for book and student autocomplete."""
+from __future__ import annotations
+
+import json
+from bisect import bisect_left, insort
+from collections.abc import Iterable
+from threading import Lock
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import cache
+from .database import SessionLocal
+from .logging_config import get_logger
+from .models import Book, Student
+from .text_utils import normalize_persian
+
+logger = get_logger(__name__)
+
+BOOK = "book"
+STUDENT = "student"
+
+EntryKey = tuple[str, int]
+
+# Prefix of the broadcasts carrying index changes to the other workers
+_BROADCAST_PREFIX = "@suggest:"
+# Term changes made in place; larger batches rebuild the term array aside
+_IN_PLACE_TERMS = 64
+
+
+class PrefixIndex:
+    """
+    Sorted array of normalized label terms, matching a prefix of any word in a label.
+
+    Every suffix of a label that starts at a word boundary is stored, so
+    "پاتر" and "هری پا" both find "هری پاتر". A lookup is a binary search
+    followed by a short forward scan and never touches the database. Each
+    worker holds its own copy, built on startup; the write handlers apply
+    their changes locally and broadcast them to the other workers.
+
+    Small changes are made in place with ``insort`` and ``del``. Larger
+    ones build the new array aside and swap it in, so searches only ever
+    wait for a few array shifts or a reference swap.
+    """
+
+    def __init__(self) -> None:
+        self._terms: list[tuple[str, str, int]] = []
+        self._labels: dict[EntryKey, str] = {}
+        # Held by searches and by writers only while they touch the live array
+        self._lock = Lock()
+        # Serializes writers, so a rebuilt array cannot drop a concurrent change
+        self._write_lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def load(self, entries: Iterable[tuple[str, int, str]]) -> None:
+        """Replace the whole index with (kind, id, label) entries, sorting once."""
+        labels = {(kind, entry_id): label for kind, entry_id, label in entries}
+        terms = _entry_terms(labels)
+        with self._write_lock, self._lock:
+            self._labels = labels
+            self._terms = terms
+
+    def add(self, kind: str, entry_id: int, label: str) -> None:
+        """Insert or replace the label of an entry."""
+        self.add_many([(kind, entry_id, label)])
+
+    def add_many(self, entries: Iterable[tuple[str, int, str]]) -> None:
+        """Insert or replace the labels of many (kind, id, label) entries."""
+        labels = {(kind, entry_id): label for kind, entry_id, label in entries}
+        if not labels:
+            return
+        with self._write_lock:
+            replaced = {key: self._labels[key] for key in labels.keys() & self._labels.keys()}
+            self._update(replaced, labels)
+
+    def remove(self, kind: str, entry_id: int) -> None:
+        """Remove an entry if present."""
+        self.remove_many([(kind, entry_id)])
+
+    def remove_many(self, keys: Iterable[EntryKey]) -> None:
+        """Remove many entries, skipping those not present."""
+        with self._write_lock:
+            removed = {key: self._labels[key] for key in set(keys) if key in self._labels}
+            if removed:
+                self._update(removed, {})
+
+    def _update(self, removed: dict[EntryKey, str], added: dict[EntryKey, str]) -> None:
+        """Replace the terms of the ``removed`` labels with those of the ``added`` ones; needs the write lock."""
+        stale_terms = _entry_terms(removed)
+        new_terms = _entry_terms(added)
+        if len(stale_terms) + len(new_terms) <= _IN_PLACE_TERMS:
+            with self._lock:
+                for item in stale_terms:
+                    position = bisect_left(self._terms, item)
+                    if position < len(self._terms) and self._terms[position] == item:
+                        del self._terms[position]
+                for key in removed.keys() - added.keys():
+                    del self._labels[key]
+                self._labels.update(added)
+                for item in new_terms:
+                    insort(self._terms, item)
+            return
+
+        # Writers are serialized, so the live array can be read here without the search lock
+        stale = set(stale_terms)
+        terms = [item for item in self._terms if item not in stale] if stale else self._terms[:]
+        terms.extend(new_terms)
+        # Timsort merges the two sorted runs in linear time
+        terms.sort()
+        labels = {key: label for key, label in self._labels.items() if key not in removed}
+        labels.update(added)
+        with self._lock:
+            self._terms = terms
+            self._labels = labels
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._write_lock, self._lock:
+            self._terms = []
+            self._labels = {}
+
+    def search(self, prefix: str, limit: int = 10, kind: str | None = None) -> list[tuple[str, int, str]]:
+        """
+        Return up to ``limit`` entries whose label has a word starting with ``prefix``.
+
+        Matches are ordered by the matching term, so exact words come first.
+
+        Returns:
+            List of (kind, id, label) tuples
+        """
+        normalized = normalize_persian(prefix)
+        if not normalized:
+            return []
+
+        results: list[tuple[str, int, str]] = []
+        seen: set[EntryKey] = set()
+        with self._lock:
+            terms = self._terms
+            position = bisect_left(terms, (normalized,))
+            while position < len(terms) and len(results) < limit:
+                term, entry_kind, entry_id = terms[position]
+                if not term.startswith(normalized):
+                    break
+                position += 1
+                key = (entry_kind, entry_id)
+                if key in seen or (kind is not None and entry_kind != kind):
+                    continue
+                seen.add(key)
+                results.append((entry_kind, entry_id, self._labels[key]))
+        return results
+
+
+def _label_terms(label: str) -> set[str]:
+    words = normalize_persian(label).split(" ")
+    return {" ".join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+def _entry_terms(labels: dict[EntryKey, str]) -> list[tuple[str, str, int]]:
+    """Return the sorted (term, kind, id) items of labels keyed by (kind, id)."""
+    return sorted((term, kind, entry_id) for (kind, entry_id), label in labels.items() for term in _label_terms(label))
+
+
+suggestion_index = PrefixIndex()
+
+
+def _apply(added: list[tuple[str, int, str]], removed: list[EntryKey]) -> None:
+    suggestion_index.remove_many(removed)
+    suggestion_index.add_many(added)
+
+
+def _publish(added: list[tuple[str, int, str]], removed: list[EntryKey]) -> None:
+    """Apply index changes in this worker and broadcast them to the others."""
+    _apply(added, removed)
+    cache.broadcast(_BROADCAST_PREFIX, json.dumps({"add": added, "remove": removed}, ensure_ascii=False))
+
+
+def _on_broadcast(payload: str) -> None:
+    changes = json.loads(payload)
+    _apply(
+        [(kind, entry_id, label) for kind, entry_id, label in changes["add"]],
+        [(kind, entry_id) for kind, entry_id in changes["remove"]],
+    )
+
+
+def _resync() -> None:
+    # Broadcasts sent while this worker was disconnected are lost, so start over
+    db = SessionLocal()
+    try:
+        build_index(db)
+    finally:
+        db.close()
+
+
+cache.subscribe(_BROADCAST_PREFIX, _on_broadcast, resync=_resync)
+
+
+def index_books(books: Iterable[tuple[int, str]]) -> None:
+    """Add or refresh (id, name) books in the suggestion index of every worker."""
+    _publish([(BOOK, book_id, name) for book_id, name in books], [])
+
+
+def index_book(book_id: int, name: str) -> None:
+    """Add or refresh a book in the suggestion index of every worker."""
+    index_books([(book_id, name)])
+
+
+def remove_books(book_ids: Iterable[int]) -> None:
+    """Remove books from the suggestion index of every worker."""
+    _publish([], [(BOOK, book_id) for book_id in book_ids])
+
+
+def remove_book(book_id: int) -> None:
+    """Remove a book from the suggestion index of every worker."""
+    remove_books([book_id])
+
+
+def index_students(students: Iterable[tuple[int, str]]) -> None:
+    """Add or refresh (id, full name) students in the suggestion index of every worker."""
+    _publish([(STUDENT, student_id, full_name) for student_id, full_name in students], [])
+
+
+def index_student(student_id: int, full_name: str) -> None:
+    """Add or refresh a student in the suggestion index of every worker."""
+    index_students([(student_id, full_name)])
+
+
+def remove_student(student_id: int) -> None:
+    """Remove a student from the suggestion index of every worker."""
+    _publish([], [(STUDENT, student_id)])
+
+
+def build_index(db: Session) -> None:
+    """Rebuild the suggestion index from all books and students."""
+    books = db.execute(select(Book.id, Book.name))
+    students = db.execute(select(Student.id, Student.first_name, Student.last_name))
+    suggestion_index.load(
+        [(BOOK, book_id, name) for book_id, name in books]
+        + [(STUDENT, student_id, f"{first_name} {last_name}") for student_id, first_name, last_name in students]
+    )
+    logger.info(f"Suggestion index built with {len(suggestion_index)} entries")
@@ -0,0 +1,140 @@
+"""CSV and NDJSON parsing for bulk imports, a faster alternative to workbooks."""
+from __future__ import annotations
+
+import csv
+import json
+import os
+import tempfile
+from collections.abc import Callable, Iterator
+from itertools import chain
+from typing import Any, TextIO
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from .excel_utils import RowValidator, SheetChunk, _find_header, chunked
+from .logging_config import get_logger
+from .responses import NDJSON_MEDIA_TYPE
+
+logger = get_logger(__name__)
+
+CSV_MEDIA_TYPE = "text/csv"
+MEDIA_TYPES = (CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE)
+
+Records = tuple[list[str], Iterator[dict[str, str]]]
+
+
+def media_type_of(request: Request) -> str | None:
+    """Return the import format of a request from its Content-Type, or None if it is not supported."""
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    return media_type if media_type in MEDIA_TYPES else None
+
+
+async def save_body(request: Request) -> str:
+    """Spool a request body to a temporary file as it arrives, returning its path."""
+    target = tempfile.NamedTemporaryFile(prefix="library-import-", delete=False)
+    try:
+        async for data in request.stream():
+            await run_in_threadpool(target.write, data)
+    except BaseException:
+        target.close()
+        os.remove(target.name)
+        raise
+    target.close()
+    return target.name
+
+
+def _csv_records(source: TextIO) -> Records | None:
+    """Return the headers and a lazy iterator of the non-empty records of a CSV file, or None if it is empty."""
+    reader = csv.reader(source)
+    header_row = next(reader, None)
+    if header_row is None:
+        return None
+
+    headers = [h.strip() or f"Column_{i}" for i, h in enumerate(header_row)]
+    return headers, (
+        {h: cell.strip() for h, cell in zip(headers, row)}
+        for row in reader
+        if any(cell.strip() for cell in row)
+    )
+
+
+def _ndjson_record(line_number: int, line: str) -> dict[str, str]:
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"خط {line_number}: JSON نامعتبر است ({e.msg})")
+    if not isinstance(record, dict):
+        raise ValueError(f"خط {line_number}: هر خط باید یک شیء JSON باشد")
+    return {str(key).strip(): str(value).strip() if value is not None else "" for key, value in record.items()}
+
+
+def _ndjson_records(source: TextIO) -> Records | None:
+    """
+    Return the headers and a lazy iterator of the records of an NDJSON file, or None if it is empty.
+
+    The keys of the first record serve as the headers, so it must carry
+    every column that later records use.
+    """
+    records = (_ndjson_record(number, line) for number, line in enumerate(source, 1) if line.strip())
+    first_record = next(records, None)
+    if first_record is None:
+        return None
+    return list(first_record), chain([first_record], records)
+
+
+def iter_record_chunks(
+    path: str,
+    media_type: str,
+    make_validator: Callable[[str, list[str]], RowValidator],
+    group_columns: list[str],
+    default_group: str | None,
+    chunk_size: int,
+) -> Iterator[SheetChunk]:
+    """
+    Stream a saved CSV or NDJSON body and yield chunks of validated rows.
+
+    Records are grouped the way workbook rows are grouped by sheet: by the
+    first of ``group_columns`` present in the file, or ``default_group``
+    for files without that column and records leaving it empty. Each
+    chunk holds the valid rows of one group among at most ``chunk_size``
+    records, validated with the same rules as workbook imports.
+
+    Args:
+        path: Path of the saved body
+        media_type: One of ``MEDIA_TYPES``
+        make_validator: Builds the row validator of a group from its name and the headers
+        group_columns: Possible names of the column holding the group
+        default_group: Group of records without one, if any
+        chunk_size: Maximum number of records per batch
+
+    Raises:
+        ValueError: If the body is malformed, or a required column is missing.
+    """
+    with open(path, encoding="utf-8-sig", newline="") as source:
+        try:
+            parsed = _csv_records(source) if media_type == CSV_MEDIA_TYPE else _ndjson_records(source)
+            if parsed is None:
+                logger.warning("Import body is empty")
+                return
+            headers, records = parsed
+
+            group_column = _find_header(headers, group_columns)
+            if group_column is None and not default_group:
+                raise ValueError(f"ستون '{group_columns[0]}' در فایل یافت نشد")
+
+            validators: dict[str, RowValidator] = {}
+            for batch in chunked(records, chunk_size):
+                groups: dict[str, list[dict[str, Any]]] = {}
+                for record in batch:
+                    group = (record.get(group_column) if group_column else None) or default_group
+                    if not group:
+                        continue
+                    if group not in validators:
+                        validators[group] = make_validator(group, headers)
+                    if (data := validators[group](record)) is not None:
+                        groups.setdefault(group, []).append(data)
+                for group, rows in groups.items():
+                    yield SheetChunk(group, rows)
+        except csv.Error as e:
+            raise ValueError(f"خطا در خواندن فایل CSV: {str(e)}")
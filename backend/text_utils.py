@@ -0,0 +1,56 @@
+"""Text normalization utilities for Persian search."""
+from __future__ import annotations
+
+import re
+
+# Arabic code points that have a Persian counterpart, Arabic-Indic and Persian
+# digits mapped to ASCII, and the zero-width non-joiner treated as a space.
+_CHAR_MAP = str.maketrans(
+    {
+        "ي": "ی",
+        "ى": "ی",
+        "ئ": "ی",
+        "ك": "ک",
+        "ة": "ه",
+        "ۀ": "ه",
+        "أ": "ا",
+        "إ": "ا",
+        "ٱ": "ا",
+        "ؤ": "و",
+        "\u200c": " ",  # zero-width non-joiner
+        "\u200d": "",
+        "\u0640": "",  # tatweel
+        **{chr(0x06F0 + i): str(i) for i in range(10)},
+        **{chr(0x0660 + i): str(i) for i in range(10)},
+    }
+)
+
+# Harakat, tanwin, shadda, sukun and superscript alef
+_DIACRITICS = [chr(code) for code in range(0x064B, 0x0660)] + ["\u0670"]
+_DIACRITICS_RE = re.compile("[" + "".join(_DIACRITICS) + "]")
+
+# Every single-character replacement normalize_persian makes, for
+# reproducing it where Python cannot run, such as SQL triggers
+CHAR_REPLACEMENTS: dict[str, str] = {
+    **{chr(code): value for code, value in _CHAR_MAP.items()},
+    **{diacritic: "" for diacritic in _DIACRITICS},
+}
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_persian(text: str) -> str:
+    """
+    Normalize text so that Arabic and Persian spellings compare equal.
+
+    Unifies yeh/kaf variants, strips diacritics and tatweel, converts
+    Persian and Arabic-Indic digits to ASCII, splits on ZWNJ, lowercases
+    and collapses whitespace.
+
+    Args:
+        text: Raw user or database text
+
+    Returns:
+        Normalized text suitable for indexing and matching
+    """
+    text = _DIACRITICS_RE.sub("", text.translate(_CHAR_MAP))
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
@@ -0,0 +1,114 @@
+"""Per-table change counters and the ETags derived from them."""
+from __future__ import annotations
+
+import hashlib
+
+from fastapi import Request
+from sqlalchemy import Update, event, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from .logging_config import get_logger
+from .models import Book, Category, Loan, Student, TableVersion
+
+logger = get_logger(__name__)
+
+TRACKED_MODELS = (Category, Book, Student, Loan)
+
+_BUMPED_KEY = "bumped_tables"
+
+
+def ensure_table_versions(db: Session) -> None:
+    """Create a zero counter for every tracked table that has none yet."""
+    existing = set(db.execute(select(TableVersion.table_name)).scalars())
+    missing = [
+        {"table_name": model.__tablename__, "version": 0}
+        for model in TRACKED_MODELS
+        if model.__tablename__ not in existing
+    ]
+    if missing:
+        db.execute(insert(TableVersion), missing)
+        db.commit()
+
+
+def table_versions_bump(*table_names: str) -> Update:
+    """Return the statement incrementing the counters of the given tables."""
+    return (
+        update(TableVersion)
+        .where(TableVersion.table_name.in_(table_names))
+        .values(version=TableVersion.version + 1)
+    )
+
+
+def bump_table_versions(connection, *table_names: str) -> None:
+    """
+    Increment the counters of the given tables on a connection.
+
+    ORM writes are tracked automatically; call this after Core bulk
+    statements, which bypass mapper events. Async handlers execute
+    ``table_versions_bump`` on their session instead.
+    """
+    if table_names:
+        connection.execute(table_versions_bump(*table_names))
+
+
+def _on_row_change(mapper, connection, target) -> None:
+    table_name = mapper.local_table.name
+    session = object_session(target)
+    bumped = session.info.setdefault(_BUMPED_KEY, set()) if session is not None else None
+    if bumped is not None and table_name in bumped:
+        return
+    bump_table_versions(connection, table_name)
+    if bumped is not None:
+        bumped.add(table_name)
+
+
+for _model in TRACKED_MODELS:
+    for _event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event_name, _on_row_change)
+
+
+@event.listens_for(Session, "after_flush")
+def _reset_bumped_tables(session: Session, flush_context) -> None:
+    session.info.pop(_BUMPED_KEY, None)
+
+
+async def get_table_versions(db: AsyncSession, *models: type) -> dict[str, int]:
+    """Return the current counters of the given models' tables."""
+    names = [model.__tablename__ for model in models]
+    rows = await db.execute(
+        select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(names))
+    )
+    return dict(rows.tuples().all())
+
+
+async def collection_etag(
+    request: Request, db: AsyncSession, *models: type, representation: str = "application/json"
+) -> str:
+    """
+    Build a strong ETag for a list response from table counters and query parameters.
+
+    The ETag changes whenever any of the tables the response reads from is
+    written, so it can be checked without running the list query.
+    ``representation`` is the media type of the body, so a JSON page and
+    an NDJSON stream of the same list never share an ETag.
+    """
+    return etag_for_versions(request, await get_table_versions(db, *models), representation)
+
+
+def etag_for_versions(request: Request, versions: dict[str, int], representation: str = "application/json") -> str:
+    """Build the ``collection_etag`` of a request from counters already read."""
+    query = sorted(request.query_params.multi_items())
+    fingerprint = f"{representation}|{request.url.path}?{query}|{sorted(versions.items())}"
+    return f'"{hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=16).hexdigest()}"'
+
+
+def snapshot_token(versions: dict[str, int]) -> str:
+    """
+    Return a short token identifying a set of table counters, for use in cache keys.
+
+    A page computed on a lagging read replica then lands under the key of
+    the counters that replica had seen, so it is never served to a client
+    that has seen newer ones.
+    """
+    return ".".join(f"{name}{version}" for name, version in sorted(versions.items()))
@@ -19,12 +19,20 @@ const API = {
     create: `${API_BASE}/students/`, // POST
     delete: (id) => `${API_BASE}/students/${id}`, // DELETE
     uploadExcel: `${API_BASE}/students/upload-excel`, // POST (multipart/form-data)
+    overdueIds: `${API_BASE}/students/overdue-ids`, // GET ids of students with an overdue loan
   },
   loans: {
-    list: `${API_BASE}/loans/`, // GET with optional ?returned=bool&student_id=&book_id=
+    list: `${API_BASE}/loans/`, // GET with optional ?returned=bool&student_id=&book_id=&grade=&major=&name=&cursor=&limit=
     create: `${API_BASE}/loans/`, // POST
     return: (id) => `${API_BASE}/loans/${id}/return`, // POST
     delete: (id) => `${API_BASE}/loans/${id}`, // DELETE
+    export: `${API_BASE}/loans/export`, // GET ?format=csv|xlsx&grade=&major=&name= (file download)
+  },
+  jobs: {
+    get: (id) => `${API_BASE}/jobs/${id}`, // GET progress of a background import
+  },
+  reports: {
+    summary: `${API_BASE}/reports/summary`, // GET loan totals by grade, major, category and month, ?top=
   },
 };
 
@@ -194,6 +202,13 @@ async function mockFetch(url, options = {}) {
   if (path === '/students/' && method === 'GET') {
     return state.students;
   }
+  if (path === '/students/overdue-ids' && method === 'GET') {
+    const now = new Date();
+    const ids = state.loans
+      .filter(l => !l.returned && l.due_date && new Date(l.due_date) < now)
+      .map(l => l.student_id);
+    return [...new Set(ids)];
+  }
   if (path === '/students/' && method === 'POST') {
     const body = getBody() || {};
     const id = state.nextIds.student++;
@@ -215,10 +230,18 @@ async function mockFetch(url, options = {}) {
   // Loans list/create/delete/return
   if (path === '/loans/' && method === 'GET') {
     const returnedParam = u.searchParams.get('returned');
+    const grade = u.searchParams.get('grade');
+    const major = u.searchParams.get('major');
+    const name = (u.searchParams.get('name') || '').toLowerCase();
     let list = state.loans.slice();
     if (returnedParam === 'true') list = list.filter(l => !!l.returned);
     if (returnedParam === 'false') list = list.filter(l => !l.returned);
-    return list.map(l => withRelations(state, l));
+    return list.map(l => withRelations(state, l)).filter(l => {
+      const stu = l.student || {};
+      return (!grade || stu.grade === grade)
+        && (!major || stu.major === major)
+        && (!name || (stu.full_name || '').toLowerCase().includes(name));
+    });
   }
   if (path === '/loans/' && method === 'POST') {
     const body = getBody() || {};
@@ -251,6 +274,31 @@ async function mockFetch(url, options = {}) {
     return withRelations(state, l);
   }
 
+  // Report summary, counted from the demo loans
+  if (path === '/reports/summary' && method === 'GET') {
+    const counts = (key) => {
+      const totals = new Map();
+      for (const l of state.loans) {
+        const label = key(withRelations(state, l)) || '';
+        totals.set(label, (totals.get(label) || 0) + 1);
+      }
+      return [...totals].map(([label, loans]) => ({ label, loans })).sort((a, b) => b.loans - a.loans);
+    };
+    const returned = state.loans.filter(l => l.returned).length;
+    return {
+      total_loans: state.loans.length,
+      active_loans: state.loans.length - returned,
+      returned_loans: returned,
+      average_loan_days: null,
+      total_delay_days: 0,
+      by_grade: counts(l => l.student && l.student.grade),
+      by_major: counts(l => l.student && l.student.major),
+      by_category: counts(l => l.book && (state.categories.find(c => c.id === l.book.category_id) || {}).name),
+      by_month: [],
+      top_books: counts(l => l.book && l.book.name).slice(0, 10).map(c => ({ book_id: 0, name: c.label, loans: c.loans })),
+    };
+  }
+
   // Unknown route in demo
   return {};
 }
@@ -292,6 +340,21 @@ function debounce(fn, wait = 300) {
   };
 }
 
+// Server time of this tab's last write, as handed out in the X-Last-Write
+// response header; echoed back so that the API serves the following reads
+// from the primary database, not a replica. The server's clock is used, never
+// the browser's.
+let LAST_WRITE = null;
+
+function noteWrite(res) {
+  const token = res.headers.get('X-Last-Write');
+  if (token) LAST_WRITE = token;
+}
+
+function lastWriteHeaders() {
+  return LAST_WRITE ? { 'X-Last-Write': LAST_WRITE } : {};
+}
+
 async function apiFetch(url, options) {
   try {
     // In demo mode, intercept and return mock data without network
@@ -300,9 +363,10 @@ async function apiFetch(url, options) {
     }
 
     const res = await fetch(url, {
-      headers: { 'Content-Type': 'application/json' },
+      headers: { 'Content-Type': 'application/json', ...lastWriteHeaders() },
       ...options,
     });
+    if (res.ok) noteWrite(res);
 
     // Handle 204 No Content (no body to parse)
     if (res.status === 204) {
@@ -320,6 +384,64 @@ async function apiFetch(url, options) {
   }
 }
 
+// Poll a background job until it finishes and return its final state;
+// gives up after timeoutMs so that a job lost with its server does not poll forever
+async function waitForJob(jobId, intervalMs = 1000, timeoutMs = 30 * 60 * 1000) {
+  const deadline = Date.now() + timeoutMs;
+  for (;;) {
+    const job = await apiFetch(API.jobs.get(jobId));
+    if (job.status === 'completed' || job.status === 'failed') return job;
+    if (Date.now() >= deadline) throw new Error('پایان عملیات در زمان مقرر اعلام نشد؛ وضعیت را بعداً بررسی کنید');
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+}
+
+// Show a paginated list one page at a time: the first page is rendered at
+// once and a "more" button under the table appends the next one on demand.
+// renderItems gets each page's items; emptyRow is shown if there are none.
+async function loadPaged(table, url, renderItems, emptyRow, pageSize = 50) {
+  const tbody = table.querySelector('tbody');
+  const wrap = table.closest('.table-wrap');
+  let more = wrap.nextElementSibling;
+  if (!more || !more.classList.contains('load-more')) {
+    more = document.createElement('button');
+    more.type = 'button';
+    more.className = 'btn load-more';
+    more.textContent = 'نمایش بیشتر';
+    wrap.after(more);
+  }
+  // A newer load of the same table makes this one stop
+  const load = {};
+  table.currentLoad = load;
+  tbody.innerHTML = '';
+  more.hidden = true;
+  let cursor = null;
+  let shown = 0;
+
+  const loadPage = async () => {
+    const u = new URL(url);
+    u.searchParams.set('limit', pageSize);
+    if (cursor) u.searchParams.set('cursor', cursor);
+    let res;
+    try {
+      res = await apiFetch(u.toString());
+    } catch {
+      res = { items: [], next_cursor: null };
+    }
+    if (table.currentLoad !== load) return;
+    // Demo mode returns plain arrays
+    const items = Array.isArray(res) ? res : (res.items || []);
+    cursor = Array.isArray(res) ? null : (res.next_cursor || null);
+    shown += items.length;
+    if (shown === 0) tbody.innerHTML = emptyRow;
+    else renderItems(items);
+    more.hidden = !cursor;
+  };
+
+  more.onclick = loadPage;
+  await loadPage();
+}
+
 function initTabs() {
   const buttons = $$('.tab');
   buttons.forEach((btn) =>
@@ -483,8 +605,7 @@ function initCreateLoanForm() {
     // refresh lists affected
     try { 
       await Promise.all([loadLoans(), loadStudents()]); 
-      // refresh reports cache/view if open
-      HISTORY_CACHE = [];
+      // refresh reports view if open
       if (document.getElementById('tab-reports')?.classList.contains('active')) {
         await updateReports();
       }
@@ -497,58 +618,41 @@ function initCreateLoanForm() {
 }
 
 async function loadStudents() {
-  const tbody = $('#students-table tbody');
-  tbody.innerHTML = '';
-  let data = [];
-  try {
-    const res = await apiFetch(API.students.list);
-    data = Array.isArray(res) ? res : res.items || [];
-  } catch (e) {
-    // graceful fallback
-    data = [];
-  }
-  for (const u of data) {
-    const tr = document.createElement('tr');
-    tr.dataset.id = u.id;
-    tr.innerHTML = `
-      <td>${u.full_name || '-'}</td>
-      <td>${u.id || '-'}</td>
-      <td>${u.grade || '-'}</td>
-      <td>${u.major || '-'}</td>
-      <td class="status"><span class="status-badge status-ok">عادی</span></td>
-      <td><button class="btn danger btn-del" data-id="${u.id}">حذف</button></td>
-    `;
-    tbody.appendChild(tr);
-  }
-  // Attach delete handlers
-  $$('#students-table .btn-del').forEach((btn) =>
-    btn.addEventListener('click', async () => {
-      const id = btn.dataset.id;
-      try {
-        await apiFetch(API.students.delete(id), { method: 'DELETE' });
-        showToast('حذف شد', 'success');
-        await loadStudents();
-      } catch {}
-    })
-  );
-  // After (re)load, compute overdue flags based on loans
-  try { await markOverdueStudents(); } catch {}
+  const table = $('#students-table');
+  const empty = '<tr><td colspan="6" style="text-align:center;padding:20px;color:var(--muted);">هنرجویی یافت نشد</td></tr>';
+  await loadPaged(table, API.students.list, (data) => {
+    for (const u of data) {
+      const tr = document.createElement('tr');
+      tr.dataset.id = u.id;
+      tr.innerHTML = `
+        <td>${u.full_name || '-'}</td>
+        <td>${u.id || '-'}</td>
+        <td>${u.grade || '-'}</td>
+        <td>${u.major || '-'}</td>
+        <td class="status"><span class="status-badge status-ok">عادی</span></td>
+        <td><button class="btn danger btn-del" data-id="${u.id}">حذف</button></td>
+      `;
+      // Attach delete handler
+      tr.querySelector('.btn-del').addEventListener('click', async (e) => {
+        const id = e.currentTarget.dataset.id;
+        try {
+          await apiFetch(API.students.delete(id), { method: 'DELETE' });
+          showToast('حذف شد', 'success');
+          await loadStudents();
+        } catch {}
+      });
+      table.querySelector('tbody').appendChild(tr);
+    }
+    // After each page, compute overdue flags based on loans
+    markOverdueStudents().catch(() => {});
+  }, empty);
 }
 
 async function markOverdueStudents() {
   try {
-    const loans = await apiFetch(`${API.loans.list}?returned=false`);
-    const items = Array.isArray(loans) ? loans : loans.items || [];
-    const now = new Date();
-    // Build set of student IDs who are overdue
-    const overdueSet = new Set();
-    for (const l of items) {
-      const due = new Date(l.due_date || 0);
-      if (isFinite(due.getTime()) && due < now) {
-        const sid = l.student_id || (l.student && l.student.id);
-        if (sid) overdueSet.add(String(sid));
-      }
-    }
+    // The server answers with just the ids of students holding an overdue loan
+    const ids = await apiFetch(API.students.overdueIds);
+    const overdueSet = new Set((ids || []).map(String));
     // Paint rows
     $$('#students-table tbody tr').forEach((tr) => {
       const sid = tr.children[1]?.textContent?.trim();
@@ -585,90 +689,56 @@ function initAddStudentForm() {
 }
 
 async function loadLoans(filters = {}) {
-  const tbody = $('#loans-table tbody');
-  tbody.innerHTML = '';
-  
-  let data = [];
-  try {
-    const res = await apiFetch(API.loans.list);
-    data = Array.isArray(res) ? res : res.items || [];
-  } catch (e) {
-    data = [];
-  }
-  
-  // Client-side filtering by grade and major
-  if (filters.grade || filters.major) {
-    data = data.filter(l => {
-      if (!l.student) return false;
-      
-      const studentGrade = (l.student.grade || '').trim().toLowerCase();
-      const studentMajor = (l.student.major || '').trim().toLowerCase();
-      
-      let matchGrade = true;
-      let matchMajor = true;
-      
-      if (filters.grade) {
-        matchGrade = studentGrade === filters.grade.toLowerCase();
-      }
-      
-      if (filters.major) {
-        matchMajor = studentMajor === filters.major.toLowerCase();
-      }
-      
-      return matchGrade && matchMajor;
-    });
-  }
-  
-  const now = new Date();
-  
-  if (data.length === 0) {
-    tbody.innerHTML = '<tr><td colspan="6" style="text-align:center;padding:20px;color:var(--muted);">امانتی یافت نشد</td></tr>';
-    return;
-  }
-  
-  for (const l of data) {
-    const tr = document.createElement('tr');
-    const due = new Date(l.due_date || 0);
-    const start = new Date(l.loan_date || 0);
-    const returned = Boolean(l.returned);
-    const isLate = !returned && isFinite(due.getTime()) && due < now;
-    if (isLate) tr.classList.add('overdue');
-    
-    const studentName = l.student ? l.student.full_name : '-';
-    const bookName = l.book ? l.book.name : '-';
-    
-    tr.innerHTML = `
-      <td>${studentName}</td>
-      <td>${bookName}</td>
-      <td>${isFinite(start.getTime()) ? formatDateHuman(start) : '-'}</td>
-      <td>${isFinite(due.getTime()) ? formatDateHuman(due) : '-'}</td>
-      <td>${returned ? '<span class="status-badge status-ok">برگشته</span>' : (isLate ? '<span class="status-badge status-late">تاخیر</span>' : '<span class="status-badge status-ok">فعال</span>')}</td>
-      <td><button class="btn danger btn-del-loan" data-id="${l.id}">حذف</button></td>
-    `;
-    tbody.appendChild(tr);
-  }
-  
-  // Attach delete handlers
-  $$('#loans-table .btn-del-loan').forEach((btn) =>
-    btn.addEventListener('click', async () => {
-      const id = btn.dataset.id;
-      try {
-        await apiFetch(API.loans.delete(id), { method: 'DELETE' });
-        showToast('امانت حذف شد', 'success');
-        // Re-apply current filters
-        const currentGrade = $('#filter-grade').value;
-        const currentMajor = $('#filter-major').value;
-        await loadLoans({ grade: currentGrade, major: currentMajor });
-        // refresh reports cache/view if open
-        HISTORY_CACHE = [];
-        if (document.getElementById('tab-reports')?.classList.contains('active')) {
-          await updateReports();
+  const table = $('#loans-table');
+  const empty = '<tr><td colspan="6" style="text-align:center;padding:20px;color:var(--muted);">امانتی یافت نشد</td></tr>';
+
+  // Grade and major are filtered by the server, so each page is already filtered
+  const u = new URL(API.loans.list);
+  if (filters.grade) u.searchParams.set('grade', filters.grade);
+  if (filters.major) u.searchParams.set('major', filters.major);
+
+  await loadPaged(table, u.toString(), (data) => {
+    const now = new Date();
+    for (const l of data) {
+      const tr = document.createElement('tr');
+      const due = new Date(l.due_date || 0);
+      const start = new Date(l.loan_date || 0);
+      const returned = Boolean(l.returned);
+      const isLate = !returned && isFinite(due.getTime()) && due < now;
+      if (isLate) tr.classList.add('overdue');
+
+      const studentName = l.student ? l.student.full_name : '-';
+      const bookName = l.book ? l.book.name : '-';
+
+      tr.innerHTML = `
+        <td>${studentName}</td>
+        <td>${bookName}</td>
+        <td>${isFinite(start.getTime()) ? formatDateHuman(start) : '-'}</td>
+        <td>${isFinite(due.getTime()) ? formatDateHuman(due) : '-'}</td>
+        <td>${returned ? '<span class="status-badge status-ok">برگشته</span>' : (isLate ? '<span class="status-badge status-late">تاخیر</span>' : '<span class="status-badge status-ok">فعال</span>')}</td>
+        <td><button class="btn danger btn-del-loan" data-id="${l.id}">حذف</button></td>
+      `;
+      // Attach delete handler
+      tr.querySelector('.btn-del-loan').addEventListener('click', async (e) => {
+        const id = e.currentTarget.dataset.id;
+        try {
+          await apiFetch(API.loans.delete(id), { method: 'DELETE' });
+          showToast('امانت حذف شد', 'success');
+          // Re-apply current filters
+          const currentGrade = $('#filter-grade').value;
+          const currentMajor = $('#filter-major').value;
+          await loadLoans({ grade: currentGrade, major: currentMajor });
+          // refresh reports view if open
+          if (document.getElementById('tab-reports')?.classList.contains('active')) {
+            await updateReports();
+          }
+        } catch (e) {
+          // Error already shown by apiFetch
         }
-      } catch (e) {
-        // Error already shown by apiFetch
-      }
-    })
-  );
+      });
+      table.querySelector('tbody').appendChild(tr);
+    }
+  }, empty);
 }
 
 function initLoanFilters() {
@@ -684,7 +754,7 @@ function initLoanFilters() {
 }
 
 // ========================= Reports (گزارشات) =========================
-let HISTORY_CACHE = [];
+// History rows loaded so far with the current filters
 let HISTORY_VIEW = [];
 
 function splitName(fullName = '') {
@@ -708,34 +778,6 @@ function daysBetween(a, b) {
   return Math.max(0, Math.round(ms / (1000 * 60 * 60 * 24)));
 }
 
-async function ensureHistoryCache() {
-  if (HISTORY_CACHE.length > 0) return HISTORY_CACHE;
-  try {
-    const res = await apiFetch(API.loans.list);
-    const items = Array.isArray(res) ? res : (res.items || []);
-    HISTORY_CACHE = items;
-  } catch {
-    HISTORY_CACHE = [];
-  }
-  return HISTORY_CACHE;
-}
-
-function applyReportFilters(items, { nameQ = '', grade = '', major = '' } = {}) {
-  const q = String(nameQ || '').trim().toLowerCase();
-  const g = String(grade || '').trim().toLowerCase();
-  const m = String(major || '').trim().toLowerCase();
-
-  return items.filter(l => {
-    const stu = l.student || {};
-    const { grade: sg, major: sm } = parseGradeMajor(stu);
-    const fullName = (stu.full_name || '').toLowerCase();
-    const nameOk = !q || fullName.includes(q);
-    const gradeOk = !g || (sg || '').toLowerCase() === g;
-    const majorOk = !m || (sm || '').toLowerCase() === m;
-    return nameOk && gradeOk && majorOk;
-  });
-}
-
 function mapHistoryRows(items) {
   const now = new Date();
   return items.map(l => {
@@ -776,14 +818,8 @@ function mapHistoryRows(items) {
   });
 }
 
-function renderHistoryTable(rows) {
+function appendHistoryRows(rows) {
   const tbody = $('#history-table tbody');
-  if (!tbody) return;
-  tbody.innerHTML = '';
-  if (!rows || rows.length === 0) {
-    tbody.innerHTML = '<tr><td colspan="8" style="text-align:center;padding:20px;color:var(--muted);">موردی یافت نشد</td></tr>';
-    return;
-  }
   for (const r of rows) {
     const tr = document.createElement('tr');
     tr.innerHTML = `
@@ -808,25 +844,80 @@ function getReportFilters() {
   return { nameQ, grade, major };
 }
 
+// Totals and breakdowns come pre-aggregated from the server instead of the loan history
+async function loadReportSummary() {
+  const tbody = $('#report-summary-table tbody');
+  if (!tbody) return;
+  let summary = null;
+  try {
+    summary = await apiFetch(API.reports.summary);
+  } catch {
+    summary = null;
+  }
+  tbody.innerHTML = '';
+  if (!summary) return;
+  const rows = [
+    ['کل امانت‌ها', summary.total_loans],
+    ['امانت‌های فعال', summary.active_loans],
+    ['امانت‌های برگشته', summary.returned_loans],
+    ['میانگین مدت امانت (روز)', summary.average_loan_days ?? '-'],
+    ['مجموع تاخیر (روز)', summary.total_delay_days],
+    ...(summary.by_grade || []).map(c => [`پایه: ${c.label || '-'}`, c.loans]),
+    ...(summary.by_major || []).map(c => [`رشته: ${c.label || '-'}`, c.loans]),
+    ...(summary.by_category || []).map(c => [`دسته‌بندی: ${c.label || '-'}`, c.loans]),
+    ...(summary.top_books || []).map(b => [`کتاب پرامانت: ${b.name || '-'}`, b.loans]),
+  ];
+  for (const [label, value] of rows) {
+    const tr = document.createElement('tr');
+    tr.innerHTML = `<td>${label}</td><td>${value ?? '-'}</td>`;
+    tbody.appendChild(tr);
+  }
+}
+
+async function updateHistory() {
+  const table = $('#history-table');
+  if (!table) return;
+  // The server filters by student name, grade and major, like the CSV export
+  const { nameQ, grade, major } = getReportFilters();
+  const u = new URL(API.loans.list);
+  if (grade) u.searchParams.set('grade', grade);
+  if (major) u.searchParams.set('major', major);
+  if (nameQ.trim()) u.searchParams.set('name', nameQ.trim());
+  const empty = '<tr><td colspan="9" style="text-align:center;padding:20px;color:var(--muted);">موردی یافت نشد</td></tr>';
+  HISTORY_VIEW = [];
+  await loadPaged(table, u.toString(), (items) => {
+    const rows = mapHistoryRows(items);
+    HISTORY_VIEW.push(...rows);
+    appendHistoryRows(rows);
+  }, empty);
+}
+
 async function updateReports() {
-  await ensureHistoryCache();
-  const filters = getReportFilters();
-  const filtered = applyReportFilters(HISTORY_CACHE, filters);
-  HISTORY_VIEW = mapHistoryRows(filtered);
-  renderHistoryTable(HISTORY_VIEW);
+  await Promise.all([loadReportSummary(), updateHistory()]);
 }
 
 function exportHistoryCSV() {
-  const headers = ['نام','نام خانوادگی','پایه','رشته','تاریخ امانت','تاریخ بازگشت','مدت امانت (روز)','مدت تا تحویل (روز)','تاخیر (روز)'];
-  const lines = [headers, ...HISTORY_VIEW.map(r => [r.first, r.last, r.grade || '-', r.major || '-', r.loanDate, r.returnDate, r.plannedDays, r.untilReturnDays, r.delayDays])];
-  const csv = lines.map(row => row.map(v => '"' + String(v ?? '').replace(/"/g, '""') + '"').join(',')).join('\r\n');
-  const blob = new Blob([csv], { type: 'text/csv;charset=utf-8;' });
   const a = document.createElement('a');
-  a.href = URL.createObjectURL(blob);
-  a.download = 'library-history.csv';
+  if (DEMO_MODE) {
+    const headers = ['نام','نام خانوادگی','پایه','رشته','تاریخ امانت','تاریخ بازگشت','مدت امانت (روز)','مدت تا تحویل (روز)','تاخیر (روز)'];
+    const lines = [headers, ...HISTORY_VIEW.map(r => [r.first, r.last, r.grade || '-', r.major || '-', r.loanDate, r.returnDate, r.plannedDays, r.untilReturnDays, r.delayDays])];
+    const csv = lines.map(row => row.map(v => '"' + String(v ?? '').replace(/"/g, '""') + '"').join(',')).join('\r\n');
+    const blob = new Blob([csv], { type: 'text/csv;charset=utf-8;' });
+    a.href = URL.createObjectURL(blob);
+    a.download = 'library-history.csv';
+  } else {
+    // The server streams the filtered history, so nothing is built in the browser
+    const { nameQ, grade, major } = getReportFilters();
+    const u = new URL(API.loans.export);
+    u.searchParams.set('format', 'csv');
+    if (grade) u.searchParams.set('grade', grade);
+    if (major) u.searchParams.set('major', major);
+    if (nameQ.trim()) u.searchParams.set('name', nameQ.trim());
+    a.href = u.toString();
+  }
   document.body.appendChild(a);
   a.click();
-  setTimeout(() => { URL.revokeObjectURL(a.href); a.remove(); }, 0);
+  setTimeout(() => { if (DEMO_MODE) URL.revokeObjectURL(a.href); a.remove(); }, 0);
 }
 
 function initReports() {
@@ -835,9 +926,9 @@ function initReports() {
   const major = $('#report-filter-major');
   const exportBtn = $('#btn-export-report');
 
-  if (search) search.addEventListener('input', debounce(updateReports, 250));
-  if (grade) grade.addEventListener('change', updateReports);
-  if (major) major.addEventListener('change', updateReports);
+  if (search) search.addEventListener('input', debounce(updateHistory, 250));
+  if (grade) grade.addEventListener('change', updateHistory);
+  if (major) major.addEventListener('change', updateHistory);
   if (exportBtn) exportBtn.addEventListener('click', () => {
     if (!HISTORY_VIEW || HISTORY_VIEW.length === 0) {
       showToast('موردی برای خروجی وجود ندارد', 'error');
@@ -875,9 +966,15 @@ function initUploadBooksExcel() {
         const error = await res.json();
         throw new Error(error.detail || 'خطا در آپلود فایل');
       }
+      noteWrite(res);
       
       const result = await res.json();
-      showToast(`${result.total_created} کتاب ثبت شد${result.total_skipped > 0 ? ` و ${result.total_skipped} تکراری نادیده گرفته شد` : ''}`, 'success');
+      if (res.status === 207) {
+        // Stopped partway: the chunks before the error were kept
+        showToast(`${result.message}: ${result.total_created} کتاب ثبت شد؛ ${result.errors[result.errors.length - 1]}`, 'error');
+      } else {
+        showToast(`${result.total_created} کتاب ثبت شد${result.total_skipped > 0 ? ` و ${result.total_skipped} تکراری نادیده گرفته شد` : ''}`, 'success');
+      }
       
       if (result.errors && result.errors.length > 0) {
         console.warn('Excel import errors:', result.errors);
@@ -910,7 +1007,8 @@ function initUploadStudentsExcel() {
     formData.append('file', file);
     
     try {
-      const res = await fetch(API.students.uploadExcel, {
+      // Large files are imported in the background; poll the job instead of holding the request open
+      const res = await fetch(`${API.students.uploadExcel}?async=true`, {
         method: 'POST',
         body: formData,
       });
@@ -920,7 +1018,14 @@ function initUploadStudentsExcel() {
         throw new Error(error.detail || 'خطا در آپلود فایل');
       }
       
-      const result = await res.json();
+      const { job_id } = await res.json();
+      showToast('فایل دریافت شد، ثبت دانش‌آموزان در حال انجام است...', 'success');
+      // The finished job's status response carries the write token for the reads that follow
+      const result = await waitForJob(job_id);
+      if (result.status === 'failed') {
+        throw new Error(result.errors[result.errors.length - 1] || 'خطا در آپلود فایل');
+      }
+      
       showToast(`${result.total_created} دانش‌آموز ثبت شد${result.total_skipped > 0 ? ` و ${result.total_skipped} تکراری نادیده گرفته شد` : ''}`, 'success');
       
       if (result.errors && result.errors.length > 0) {